@@ -0,0 +1,185 @@
+from datetime import datetime, timedelta
+import logging
+import threading
+import time
+
+from sqlalchemy import event
+
+from hyperloglog import HyperLogLog
+from models import ActiveUserSketch, Message, db
+from read_routing import read_session
+from scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Pending (not yet persisted) sketches, keyed by day
+_pending_sketches = {}
+_pending_events = 0
+_last_flush = time.monotonic()
+_pending_lock = threading.Lock()
+
+# Flush buffered activity once either threshold is reached
+FLUSH_EVENT_THRESHOLD = 100
+FLUSH_INTERVAL_SECONDS = 60
+
+
+def _to_day(when):
+    if when is None:
+        return datetime.utcnow().date()
+    if isinstance(when, datetime):
+        return when.date()
+    return when
+
+
+def record_active_user(user_id, when=None):
+    """
+    Records that a user was active on a given day (default: today).
+    Activity is buffered in memory and merged into the persisted daily
+    sketch on the next flush.
+    """
+    global _pending_events
+    if user_id is None:
+        return
+    day = _to_day(when)
+    with _pending_lock:
+        sketch = _pending_sketches.get(day)
+        if sketch is None:
+            sketch = _pending_sketches[day] = HyperLogLog()
+        sketch.add(user_id)
+        _pending_events += 1
+
+
+def maybe_flush_active_user_sketches():
+    """Flushes buffered activity if enough events or time have accumulated."""
+    with _pending_lock:
+        due = (_pending_events >= FLUSH_EVENT_THRESHOLD or
+               (_pending_events and time.monotonic() - _last_flush >= FLUSH_INTERVAL_SECONDS))
+    if due:
+        flush_active_user_sketches()
+
+
+def flush_active_user_sketches():
+    """
+    Merges buffered daily sketches into the `active_user_sketches` table.
+    Merging is a register-wise max, so flushing is idempotent and the same
+    day can be flushed from several workers.
+    """
+    global _pending_sketches, _pending_events, _last_flush
+    with _pending_lock:
+        pending = _pending_sketches
+        _pending_sketches = {}
+        _pending_events = 0
+        _last_flush = time.monotonic()
+
+    if not pending:
+        return 0
+
+    try:
+        for day, sketch in pending.items():
+            row = db.session.get(ActiveUserSketch, day)
+            if row is None:
+                db.session.add(ActiveUserSketch(day=day, sketch=sketch.to_bytes()))
+            else:
+                merged = HyperLogLog.from_bytes(row.sketch).merge(sketch)
+                row.sketch = merged.to_bytes()
+        db.session.commit()
+        return len(pending)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Failed to flush active user sketches: {str(e)}")
+        # Put the activity back so it is retried on the next flush
+        with _pending_lock:
+            for day, sketch in pending.items():
+                existing = _pending_sketches.get(day)
+                _pending_sketches[day] = sketch if existing is None else existing.merge(sketch)
+        return 0
+
+
+@scheduler.job('flush-active-user-sketches', interval=60, timeout=60)
+def flush_active_user_sketches_job():
+    """Persists buffered activity even when no login triggers a flush."""
+    flush_active_user_sketches()
+
+
+def get_daily_sketches(start_day, end_day):
+    """
+    Returns {day: HyperLogLog} for each day in [start_day, end_day] that has
+    activity, including activity still buffered in this process.
+    """
+    rows = (
+        read_session().query(ActiveUserSketch)
+        .filter(ActiveUserSketch.day >= start_day, ActiveUserSketch.day <= end_day)
+        .all()
+    )
+    sketches = {row.day: HyperLogLog.from_bytes(row.sketch) for row in rows}
+
+    with _pending_lock:
+        for day, sketch in _pending_sketches.items():
+            if start_day <= day <= end_day:
+                if day in sketches:
+                    sketches[day].merge(sketch)
+                else:
+                    sketches[day] = sketch.copy()
+    return sketches
+
+
+def count_active_users(start_day, end_day):
+    """Estimates distinct active users between two days (inclusive)."""
+    sketches = get_daily_sketches(_to_day(start_day), _to_day(end_day))
+    return HyperLogLog.union(sketches.values()).count()
+
+
+def count_active_users_past(days):
+    """Estimates distinct active users over the past `days` days, today included."""
+    today = datetime.utcnow().date()
+    return count_active_users(today - timedelta(days=days - 1), today)
+
+
+def active_user_series(days=30, window=1):
+    """
+    Returns a rolling active-user series for the past `days` days.
+    `window` is the rolling window in days: 1 for DAU, 7 for WAU, 30 for MAU.
+    """
+    today = datetime.utcnow().date()
+    first_day = today - timedelta(days=days - 1)
+    sketches = get_daily_sketches(first_day - timedelta(days=window - 1), today)
+
+    series = []
+    for offset in range(days):
+        day = first_day + timedelta(days=offset)
+        window_days = (day - timedelta(days=i) for i in range(window))
+        merged = HyperLogLog.union(sketches[d] for d in window_days if d in sketches)
+        series.append({"day": day.isoformat(), "count": merged.count()})
+    return series
+
+
+def estimate_retention(cohort_day, days=30):
+    """
+    Estimates how many users active on `cohort_day` were active again on each
+    of the following `days` days, using |A ∩ B| = |A| + |B| - |A ∪ B|.
+    """
+    cohort_day = _to_day(cohort_day)
+    sketches = get_daily_sketches(cohort_day, cohort_day + timedelta(days=days))
+    cohort = sketches.get(cohort_day)
+    if cohort is None:
+        return {"cohort_day": cohort_day.isoformat(), "cohort_size": 0, "retained": []}
+
+    cohort_size = cohort.count()
+    retained = []
+    for offset in range(1, days + 1):
+        day = cohort_day + timedelta(days=offset)
+        sketch = sketches.get(day)
+        if sketch is None:
+            overlap = 0
+        else:
+            union = cohort.copy().merge(sketch).count()
+            overlap = max(0, min(cohort_size, cohort_size + sketch.count() - union))
+        retained.append({"day": day.isoformat(), "count": overlap})
+
+    return {"cohort_day": cohort_day.isoformat(), "cohort_size": cohort_size, "retained": retained}
+
+
+@event.listens_for(Message, 'after_insert')
+def _record_message_sender(mapper, connection, target):
+    """Counts message senders as active on the day the message was sent."""
+    record_active_user(target.sender_id, target.created_at)
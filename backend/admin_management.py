@@ -3,9 +3,17 @@ from flask import Blueprint, flash, jsonify, redirect, render_template, request,
 from flask_login import current_user, login_required
 import logging
 
-from app import db
-from models import ActivityLog, FlaggedContent, Message, User
-from notifications import create_notification
+from active_users import count_active_users_past
+from db_engines import engines
+from db_retry import get_retry_metrics, retry_on_lock
+from login_throttling import login_throttle
+from messages import get_message, get_messages, remove_message
+import moderation
+from models import ActivityLog, FlaggedContent, User, db
+from notifications import create_notification, create_notifications
+from password_hashing import password_hasher
+from query_instrumentation import get_route_query_stats
+from unit_of_work import commit_or_flush, current_unit_of_work, transactional
 from utils import verify_admin
 
 # Blueprint setup
@@ -13,26 +21,24 @@ admin_bp = Blueprint('admin_bp', __name__)
 logger = logging.getLogger(__name__)
 
 
-def verify_admin(user_id):
-    """Check if the user is an admin."""
-    user = User.query.get(user_id)
-    return user and user.role == 'admin'
-
-
 def flag_message(message_id, user_id, reason):
     """Flag a message for review by admin."""
     try:
-        message = Message.query.get(message_id)
+        message = get_message(message_id)
         if not message:
             return {"error": "Message not found"}, 404
 
-        flagged_content = FlaggedContent(
-            message_id=message_id,
-            user_id=user_id,
-            reason=reason
-        )
-        db.session.add(flagged_content)
-        db.session.commit()
+        @retry_on_lock
+        def save_flag():
+            flagged_content = FlaggedContent(
+                message_id=message_id,
+                user_id=user_id,
+                reason=reason
+            )
+            db.session.add(flagged_content)
+            commit_or_flush()
+
+        save_flag()
 
         # Notify user
         create_notification(
@@ -41,14 +47,9 @@ def flag_message(message_id, user_id, reason):
             message=f'You have successfully flagged message ID {message_id}. Reason: {reason}'
         )
 
-        # Notify all admins
-        admins = User.query.filter_by(role='admin').all()
-        for admin in admins:
-            create_notification(
-                user_id=admin.id,
-                notification_type='admin_alert',
-                message=f'Message ID {message_id} flagged. Reason: {reason}'
-            )
+        # Notify all admins in one batched insert
+        admin_ids = [admin_id for admin_id, in db.session.query(User.id).filter_by(role='admin')]
+        create_notifications(admin_ids, f'Message ID {message_id} flagged. Reason: {reason}', 'admin_alert')
 
         return {"message": "Message flagged successfully for review."}, 200
 
@@ -67,21 +68,28 @@ def review_flagged_content(flagged_content_id, action, admin_id):
         if not flagged_content:
             return {"error": "Flag not found"}, 404
 
-        message = Message.query.get(flagged_content.message_id)
+        message = get_message(flagged_content.message_id)
         if not message:
             return {"error": "Message not found"}, 404
 
-        # Update flag status
-        flagged_content.reviewed = True
-        flagged_content.reviewed_by = admin_id
-        flagged_content.reviewed_at = datetime.utcnow()
+        @retry_on_lock
+        def apply_review():
+            # Update flag status
+            flagged_content.reviewed = True
+            flagged_content.reviewed_by = admin_id
+            flagged_content.reviewed_at = datetime.utcnow()
 
-        # Process action
-        action_taken = process_admin_action(action, message)
+            # Process action
+            action_taken = process_admin_action(action, message)
+            if action_taken:
+                commit_or_flush()
+            return action_taken
+
+        action_taken = apply_review()
         if not action_taken:
+            db.session.rollback()
             return {"error": "Invalid action"}, 400
 
-        db.session.commit()
         log_admin_action(admin_id, f"Action '{action}' on message {message.id}")
 
         # Notify admin
@@ -97,36 +105,44 @@ def review_flagged_content(flagged_content_id, action, admin_id):
         db.session.rollback()
         return {"error": f"Error reviewing content: {str(e)}"}, 500
 
+def ban_sender(message):
+    """Bans the author of a message."""
+    moderation.ban_user(User.query.get(message.sender_id))
+
 def process_admin_action(action, message):
     """Helper to process different admin actions."""
     actions = {
-        'delete': lambda: ("Message deleted", db.session.delete(message)),
+        'delete': lambda: ("Message deleted", remove_message(message.id)),
         'warn': lambda: ("User warned", None),
-        'ban': lambda: ("User banned", setattr(User.query.get(message.sender_id), 'is_banned', True)),
+        'ban': lambda: ("User banned", ban_sender(message)),
         'ignore': lambda: ("Flag ignored", None)
     }
     
     if action not in actions:
         return None
     
-    action_taken, action_func = actions[action]
-    if action_func:
-        action_func()
+    action_taken, _ = actions[action]()
     return action_taken
 
 def log_admin_action(admin_id, action):
     """Log admin actions for auditing."""
-    try:
+    @retry_on_lock
+    def save_log():
         activity_log = ActivityLog(
             user_id=admin_id,
             action=action,
             timestamp=datetime.utcnow()
         )
         db.session.add(activity_log)
-        db.session.commit()
+        commit_or_flush()
+
+    try:
+        save_log()
     except Exception as e:
         db.session.rollback()
         logger.error(f"Failed to log admin action: {str(e)}")
+        if current_unit_of_work() is not None:
+            raise  # the rollback discarded the whole request's writes
 
 @admin_bp.route('/dashboard')
 @login_required
@@ -141,11 +157,9 @@ def get_admin_dashboard_stats():
     try:
         return {
             'total_users': User.query.count(),
-            'active_users': User.query.filter(
-                User.last_login >= datetime.utcnow() - timedelta(days=30)
-            ).count(),
+            'active_users': count_active_users_past(30),
             'flagged_messages': FlaggedContent.query.filter_by(reviewed=False).count(),
-            'banned_users': User.query.filter_by(is_banned=True).count(),
+            'banned_users': moderation.count_moderated_users()['banned'],
             'recent_flags': FlaggedContent.query.order_by(
                 FlaggedContent.created_at.desc()
             ).limit(5).all(),
@@ -159,6 +173,7 @@ def get_admin_dashboard_stats():
 
 # API Routes
 @admin_bp.route('/flag_message', methods=['POST'])
+@transactional
 def flag_content():
     user_id = session.get('user_id')
     if not user_id:
@@ -174,6 +189,7 @@ def flag_content():
     return flag_message(message_id, user_id, reason)
 
 @admin_bp.route('/review_flagged_content/<int:flagged_content_id>', methods=['POST'])
+@transactional
 def review_flagged_content_route(flagged_content_id):
     admin_id = session.get('user_id')
     if not admin_id or not verify_admin(admin_id):
@@ -187,6 +203,49 @@ def review_flagged_content_route(flagged_content_id):
 
     return review_flagged_content(flagged_content_id, action, admin_id)
 
+# Operational stats for admins. The blueprint is mounted under /admin, so these are served at
+# /admin/db/pool-stats, /admin/db/retry-stats, /admin/db/query-stats, /admin/auth/hash-stats
+# and /admin/auth/throttle-stats
+@admin_bp.route('/db/pool-stats')
+@login_required
+def pool_stats():
+    """Live connection pool statistics for every database engine."""
+    if not verify_admin(current_user.id):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(engines.pool_stats()), 200
+
+@admin_bp.route('/db/retry-stats')
+@login_required
+def retry_stats():
+    """Counters for writes retried because the database was locked."""
+    if not verify_admin(current_user.id):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(get_retry_metrics()), 200
+
+@admin_bp.route('/db/query-stats')
+@login_required
+def query_stats():
+    """Per-route query counts and database time since startup."""
+    if not verify_admin(current_user.id):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(get_route_query_stats()), 200
+
+@admin_bp.route('/auth/hash-stats')
+@login_required
+def hash_stats():
+    """Queue depth, rejections and latency of the password hashing pool."""
+    if not verify_admin(current_user.id):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(password_hasher.get_metrics()), 200
+
+@admin_bp.route('/auth/throttle-stats')
+@login_required
+def throttle_stats():
+    """Blocked (delayed / locked out) and failed sign-in attempts seen by this process."""
+    if not verify_admin(current_user.id):
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(login_throttle.get_metrics()), 200
+
 # Admin UI Routes
 @admin_bp.route('/dashboard')
 @login_required
@@ -202,15 +261,15 @@ def flagged_content():
         return redirect('/unauthorized')
     
     flagged_messages = FlaggedContent.query.filter_by(reviewed=False).all()
-    messages = []
-    for flag in flagged_messages:
-        message = Message.query.get(flag.message_id)
-        messages.append(message)
+    # One query per shard rather than one per flag
+    messages_by_id = get_messages([flag.message_id for flag in flagged_messages])
+    messages = [messages_by_id.get(flag.message_id) for flag in flagged_messages]
     
     return render_template('admin_flagged_content.html', flagged_messages=messages)
 
 @admin_bp.route('/flagged-content/action/<int:flag_id>', methods=['POST'])
 @login_required
+@transactional
 def flag_action(flag_id):
     if not verify_admin(current_user.id):
         return redirect('/unauthorized')
@@ -221,20 +280,25 @@ def flag_action(flag_id):
         return redirect(url_for('admin_bp.flagged_content'))
 
     action = request.form.get('action')
-    message = Message.query.get(flag.message_id)
+    message = get_message(flag.message_id)
 
-    try:
+    @retry_on_lock
+    def apply_action():
         action_taken = process_admin_action(action, message)
+        if action_taken:
+            # Mark flag as reviewed and save to DB
+            flag.reviewed = True
+            flag.reviewed_by = current_user.id
+            flag.reviewed_at = datetime.utcnow()
+            commit_or_flush()
+        return action_taken
+
+    try:
+        action_taken = apply_action()
         if not action_taken:
             flash('Invalid action', 'error')
             return redirect(url_for('admin_bp.flagged_content'))
 
-        # Mark flag as reviewed and save to DB
-        flag.reviewed = True
-        flag.reviewed_by = current_user.id
-        flag.reviewed_at = datetime.utcnow()
-        db.session.commit()
-
         flash(f'{action_taken} on message {message.id}', 'success')
         return redirect(url_for('admin_bp.flagged_content'))
 
@@ -247,6 +311,7 @@ def flag_action(flag_id):
 
 @admin_bp.route('/ban-user/<int:user_id>', methods=['POST'])
 @login_required
+@transactional
 def ban_user(user_id):
     if not verify_admin(current_user.id):
         return redirect('/unauthorized')
@@ -256,9 +321,12 @@ def ban_user(user_id):
         flash('User not found', 'error')
         return redirect(url_for('admin_bp.admin_dashboard'))
     
+    @retry_on_lock
+    def apply_ban():
+        moderation.ban_user(user)
+
     try:
-        user.is_banned = True
-        db.session.commit()
+        apply_ban()
         log_admin_action(current_user.id, f"Banned user {user.username}")
         flash(f'User {user.username} banned', 'success')
     except Exception as e:
@@ -270,6 +338,7 @@ def ban_user(user_id):
 
 @admin_bp.route('/suspend-user/<int:user_id>', methods=['POST'])
 @login_required
+@transactional
 def suspend_user(user_id):
     if not verify_admin(current_user.id):
         return redirect('/unauthorized')
@@ -279,10 +348,13 @@ def suspend_user(user_id):
         flash('User not found', 'error')
         return redirect(url_for('admin_bp.admin_dashboard'))
 
+    @retry_on_lock
+    def apply_suspension(suspension_days):
+        moderation.suspend_user(user, datetime.utcnow() + timedelta(days=suspension_days))
+
     try:
         suspension_days = int(request.form.get('suspension_days', 30))  # Default to 30 if not provided
-        user.suspended_until = datetime.utcnow() + timedelta(days=suspension_days)
-        db.session.commit()
+        apply_suspension(suspension_days)
         log_admin_action(current_user.id, f"Suspended user {user.username} for {suspension_days} days")
         flash(f'User {user.username} suspended for {suspension_days} days', 'success')
     except Exception as e:
@@ -1,18 +1,48 @@
 from datetime import datetime, timedelta
 from collections import Counter
 from flask import Blueprint, jsonify, request
-from flask_login import login_required
-from sqlalchemy import func, and_
-from admin_management import verify_admin
+from flask_login import current_user, login_required
+from sqlalchemy import func, and_, select
+from active_users import active_user_series, count_active_users_past, estimate_retention
+from analytics_summary import analytics_summary_response, get_cached_analytics_summary, invalidate_analytics_cache
 from app import db
+from histograms import EVENT_SOURCES, GRANULARITIES, event_histogram
+from message_archive import count_archived_messages
 from models import User, Message, ActivityLog
+from moderation import count_moderated_users
+from read_routing import read_session, uses_read_engine
+from scheduler import scheduler
+import sharding
 from utils import verify_admin
 
 # Blueprint Setup
 analytics_bp = Blueprint('analytics_bp', __name__)
 
+
+@scheduler.job('refresh-analytics-summary', interval=20, timeout=60)
+@uses_read_engine
+def refresh_analytics_summary():
+    """Recomputes the dashboard summary off the request path, ahead of its TTL."""
+    invalidate_analytics_cache()
+    get_cached_analytics_summary()
+
+
+@analytics_bp.route('/api/analytics')
+@login_required
+@uses_read_engine
+def analytics_summary():
+    """Aggregated data for every admin dashboard panel, with ETag support."""
+    if not verify_admin(current_user.id):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    try:
+        return analytics_summary_response()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @analytics_bp.route('/admin/analytics/overview')
 @login_required
+@uses_read_engine
 def analytics_overview():
     """Provides general statistics for admin charts."""
     admin_id = request.args.get('admin_id', type=int)
@@ -20,14 +50,13 @@ def analytics_overview():
         return jsonify({"error": "Unauthorized"}), 403
 
     try:
+        moderated = count_moderated_users(read_session())
         stats = {
-            "total_users": User.query.count(),
-            "messages_sent": Message.query.count(),
-            "active_users_past_7_days": User.query.filter(
-                User.last_login >= datetime.utcnow() - timedelta(days=7)
-            ).count(),
-            "banned_users": User.query.filter_by(is_banned=True).count(),
-            "suspended_users": User.query.filter(User.suspended_until > datetime.utcnow()).count()
+            "total_users": read_session().query(User).count(),
+            "messages_sent": sharding.count_rows('messages') + count_archived_messages(),
+            "active_users_past_7_days": count_active_users_past(7),
+            "banned_users": moderated['banned'],
+            "suspended_users": moderated['suspended'],
         }
         return jsonify(stats), 200
     except Exception as e:
@@ -35,6 +64,7 @@ def analytics_overview():
 
 @analytics_bp.route('/admin/analytics/messages_trend')
 @login_required
+@uses_read_engine
 def messages_trend():
     """Returns number of messages sent per day in the last 30 days."""
     admin_id = request.args.get('admin_id', type=int)
@@ -43,24 +73,93 @@ def messages_trend():
 
     try:
         days_ago = datetime.utcnow() - timedelta(days=30)
-        message_counts = (
-            db.session.query(
-                func.date(Message.timestamp).label('day'),
-                func.count(Message.id)
-            )
-            .filter(Message.timestamp >= days_ago)
-            .group_by('day')
-            .order_by('day')
-            .all()
-        )
-
-        results = [{"day": str(day), "count": count} for day, count in message_counts]
+        messages = Message.__table__
+        day = func.date(messages.c.created_at).label('day')
+        message_counts = Counter()
+        for row_day, count in sharding.scatter(
+            select(day, func.count()).where(messages.c.created_at >= days_ago).group_by(day)
+        ):
+            message_counts[str(row_day)] += count
+
+        results = [{"day": row_day, "count": message_counts[row_day]} for row_day in sorted(message_counts)]
         return jsonify(results), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@analytics_bp.route('/admin/analytics/histogram')
+@login_required
+@uses_read_engine
+def histogram():
+    """Returns event counts bucketed over an arbitrary range and granularity."""
+    admin_id = request.args.get('admin_id', type=int)
+    if not verify_admin(admin_id):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    source = request.args.get('source', 'messages')
+    granularity = request.args.get('granularity', 'day')
+    breakdown = request.args.get('breakdown')
+    user_id = request.args.get('user_id', type=int)
+    if source not in EVENT_SOURCES or granularity not in GRANULARITIES:
+        return jsonify({"error": "Invalid source or granularity"}), 400
+
+    try:
+        end = datetime.fromisoformat(request.args['end']) if 'end' in request.args else datetime.utcnow()
+        start = datetime.fromisoformat(request.args['start']) if 'start' in request.args else end - timedelta(days=30)
+    except ValueError:
+        return jsonify({"error": "start and end must be ISO 8601 datetimes"}), 400
+
+    try:
+        return jsonify(event_histogram(source, start, end, granularity, breakdown, user_id)), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@analytics_bp.route('/admin/analytics/active_users_trend')
+@login_required
+@uses_read_engine
+def active_users_trend():
+    """Returns approximate daily, weekly or monthly active users over time."""
+    admin_id = request.args.get('admin_id', type=int)
+    if not verify_admin(admin_id):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    windows = {'daily': 1, 'weekly': 7, 'monthly': 30}
+    period = request.args.get('period', 'daily')
+    days = request.args.get('days', 30, type=int)
+    if period not in windows or not 1 <= days <= 366:
+        return jsonify({"error": "Invalid period or days"}), 400
+
+    try:
+        return jsonify(active_user_series(days=days, window=windows[period])), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+@analytics_bp.route('/admin/analytics/retention')
+@login_required
+@uses_read_engine
+def retention():
+    """Returns the approximate retention curve of a daily cohort of active users."""
+    admin_id = request.args.get('admin_id', type=int)
+    if not verify_admin(admin_id):
+        return jsonify({"error": "Unauthorized"}), 403
+
+    try:
+        cohort_day = datetime.strptime(request.args['cohort_day'], '%Y-%m-%d').date()
+    except (KeyError, ValueError):
+        return jsonify({"error": "cohort_day must be given as YYYY-MM-DD"}), 400
+    days = request.args.get('days', 30, type=int)
+    if not 1 <= days <= 366:
+        return jsonify({"error": "Invalid days"}), 400
+
+    try:
+        return jsonify(estimate_retention(cohort_day, days=days)), 200
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 @analytics_bp.route('/admin/analytics/connection_network')
 @login_required
+@uses_read_engine
 def connection_network():
     """Returns connection relationships between users based on messaging."""
     admin_id = request.args.get('admin_id', type=int)
@@ -68,12 +167,11 @@ def connection_network():
         return jsonify({"error": "Unauthorized"}), 403
 
     try:
-        # Fetch sender/receiver pairs
-        connections = (
-            db.session.query(Message.sender_id, Message.receiver_id)
-            .distinct()
-            .all()
-        )
+        # Fetch sender/receiver pairs; group messages have no receiver
+        messages = Message.__table__
+        connections = set(sharding.scatter(
+            select(messages.c.sender_id, messages.c.receiver_id).where(messages.c.group_id.is_(None)).distinct()
+        ))
 
         network = []
         for sender_id, receiver_id in connections:
@@ -88,6 +186,7 @@ def connection_network():
 
 @analytics_bp.route('/admin/analytics/active_users')
 @login_required
+@uses_read_engine
 def active_users():
     """Returns the most active users by number of messages sent."""
     admin_id = request.args.get('admin_id', type=int)
@@ -95,22 +194,28 @@ def active_users():
         return jsonify({"error": "Unauthorized"}), 403
 
     try:
-        top_users = (
-            db.session.query(User.username, func.count(Message.id).label('message_count'))
-            .join(Message, User.id == Message.sender_id)
-            .group_by(User.id)
-            .order_by(func.count(Message.id).desc())
-            .limit(10)
+        # Senders are spread over shards, so count per shard and merge before taking the top 10
+        messages = Message.__table__
+        sent = Counter()
+        for sender_id, count in sharding.scatter(
+            select(messages.c.sender_id, func.count()).group_by(messages.c.sender_id)
+        ):
+            sent[sender_id] += count
+        top_senders = sent.most_common(10)
+        usernames = dict(
+            read_session().query(User.id, User.username)
+            .filter(User.id.in_([sender_id for sender_id, _ in top_senders]))
             .all()
         )
 
-        results = [{"username": username, "messages_sent": message_count} for username, message_count in top_users]
+        results = [{"username": usernames.get(sender_id), "messages_sent": count} for sender_id, count in top_senders]
         return jsonify(results), 200
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 @analytics_bp.route('/admin/analytics/activity_log')
 @login_required
+@uses_read_engine
 def activity_log():
     """Returns a summarized view of admin activities."""
     admin_id = request.args.get('admin_id', type=int)
@@ -119,7 +224,7 @@ def activity_log():
 
     try:
         recent_actions = (
-            ActivityLog.query
+            read_session().query(ActivityLog)
             .order_by(ActivityLog.timestamp.desc())
             .limit(20)
             .all()
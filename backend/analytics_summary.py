@@ -0,0 +1,102 @@
+from collections import Counter
+from datetime import datetime, timedelta
+import hashlib
+import json
+import threading
+import time
+
+from flask import current_app, request
+from sqlalchemy import text
+
+from message_archive import count_archived_messages
+from read_routing import read_session
+import sharding
+
+# Server-side cache for the aggregated dashboard payload
+_analytics_cache = {"payload": None, "etag": None, "expires_at": 0.0}
+_analytics_cache_lock = threading.Lock()
+
+# Number of days shown in the messages-per-day chart
+MESSAGES_PER_DAY_WINDOW = 7
+
+# Dashboard panels on the primary database in a single round trip; each row is (panel, label, value)
+ANALYTICS_SUMMARY_QUERY = """
+    SELECT 'total_users' AS panel, NULL AS label, COUNT(*) AS value FROM users
+    UNION ALL
+    SELECT 'total_flagged', NULL, COUNT(*) FROM flagged_content
+    UNION ALL
+    SELECT 'flag_breakdown', reason, COUNT(*) FROM flagged_content
+    GROUP BY reason
+"""
+
+# Message panels, run on every shard and summed
+MESSAGE_SUMMARY_QUERY = """
+    SELECT 'total_messages' AS panel, NULL AS label, COUNT(*) AS value FROM messages
+    UNION ALL
+    SELECT 'messages_per_day', date(created_at), COUNT(*) FROM messages
+    WHERE created_at >= :since
+    GROUP BY date(created_at)
+"""
+
+
+def build_analytics_summary():
+    """Computes every dashboard panel with one batched query per database."""
+    today = datetime.utcnow().date()
+    first_day = today - timedelta(days=MESSAGES_PER_DAY_WINDOW - 1)
+    rows = read_session().execute(text(ANALYTICS_SUMMARY_QUERY)).fetchall()
+    rows += sharding.scatter(
+        text(MESSAGE_SUMMARY_QUERY),
+        {'since': datetime.combine(first_day, datetime.min.time())}
+    )
+
+    summary = {"total_users": 0, "total_messages": 0, "total_flagged": 0, "flag_breakdown": {}}
+    daily_counts = Counter()
+    for panel, label, value in rows:
+        if panel == 'messages_per_day':
+            daily_counts[str(label)] += value
+        elif panel == 'flag_breakdown':
+            summary['flag_breakdown'][label] = value
+        else:
+            summary[panel] += value
+    summary['total_messages'] += count_archived_messages()
+
+    days = [first_day + timedelta(days=i) for i in range(MESSAGES_PER_DAY_WINDOW)]
+    summary['messages_per_day'] = {
+        "labels": [day.strftime('%a') for day in days],
+        "counts": [daily_counts.get(day.isoformat(), 0) for day in days]
+    }
+    return summary
+
+
+def get_cached_analytics_summary():
+    """
+    Returns (payload, etag) for the dashboard, recomputing at most once per
+    ANALYTICS_CACHE_TTL seconds.
+    """
+    ttl = current_app.config.get('ANALYTICS_CACHE_TTL', 30)
+    with _analytics_cache_lock:
+        if _analytics_cache['payload'] is not None and time.monotonic() < _analytics_cache['expires_at']:
+            return _analytics_cache['payload'], _analytics_cache['etag']
+
+        payload = json.dumps(build_analytics_summary(), sort_keys=True)
+        etag = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+        _analytics_cache.update(payload=payload, etag=etag, expires_at=time.monotonic() + ttl)
+        return payload, etag
+
+
+def invalidate_analytics_cache():
+    """Forces the next dashboard request to recompute the summary."""
+    with _analytics_cache_lock:
+        _analytics_cache['expires_at'] = 0.0
+
+
+def analytics_summary_response():
+    """
+    The cached summary as a JSON response with its ETag; a 304 without a
+    body when the client's If-None-Match already names it.
+    """
+    payload, etag = get_cached_analytics_summary()
+    response = current_app.response_class(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response.make_conditional(request)
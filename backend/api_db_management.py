@@ -1,10 +1,22 @@
-from flask import current_app
-from sqlalchemy import create_engine, text
-from sqlalchemy.orm import sessionmaker, scoped_session
+from sqlalchemy import func, select, text
+from sqlalchemy.orm import sessionmaker
+from collections import OrderedDict
 from contextlib import contextmanager
 import logging
+import os
+import threading
+import time
 from datetime import datetime, timedelta
 
+from db_engines import engines
+from db_retry import retry_on_lock
+from models import Message, Notification, User, db
+import sharding
+from unit_of_work import current_unit_of_work, note_write
+
+# Alembic environment (also used by Flask-Migrate's `flask db` commands)
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations')
+
 
 # Initialize logger for database actions
 logger = logging.getLogger(__name__)
@@ -12,16 +24,13 @@ logger = logging.getLogger(__name__)
 # Database connection setup
 def get_db_engine():
     """
-    Returns the SQLAlchemy engine based on app config settings.
-    This engine is responsible for connecting to the database.
+    Returns the app's primary SQLAlchemy engine from the engine registry.
+    This is the same engine (and connection pool) used by the `db` extension.
     """
-    db_url = current_app.config['SQLALCHEMY_DATABASE_URI']
-    engine = create_engine(db_url, pool_recycle=3600)  # Recycle the connection every hour
-    return engine
+    return engines.get_engine()
 
-# Establish a scoped session for database interaction
-engine = get_db_engine()
-Session = scoped_session(sessionmaker(bind=engine))
+# Sessions for raw-SQL helpers; each get_db_session() block gets its own, so nested blocks never share one
+Session = sessionmaker()
 
 # Context manager for managing database transactions
 @contextmanager
@@ -29,8 +38,14 @@ def get_db_session():
     """
     Context manager for handling database sessions.
     Ensures that the session is properly closed after use.
+    Inside a unit of work it yields the request's session instead, so the
+    statements join that transaction and commit with it.
     """
-    session = Session()  # Open a new session
+    if current_unit_of_work() is not None:
+        yield db.session
+        return
+
+    session = Session(bind=get_db_engine())  # Open a new session
     try:
         yield session
         session.commit()  # Commit changes on success
@@ -39,35 +54,164 @@ def get_db_session():
         logger.error(f"Database session error: {str(e)}")
         raise
     finally:
-        session.close()  # Ensure session is always closed
+        session.close()  # Close only this block's session
 
-# Helper function to execute raw SQL queries
-def execute_query(query, params=None, one=False):
-    """
-    Executes a raw SQL query with parameters.
-    Returns the first result if `one=True`, otherwise returns all results.
-    """
+# Compiled text() statements, keyed by SQL string (least recently used evicted first)
+STATEMENT_CACHE_SIZE = 256
+_statement_cache = OrderedDict()
+_statement_cache_lock = threading.Lock()
+
+# Rows fetched per round trip when streaming
+DEFAULT_STREAM_BATCH_SIZE = 1000
+
+# Aggregate query metrics for this process
+_query_metrics = {"queries": 0, "rows": 0, "total_ms": 0.0, "slowest_ms": 0.0, "errors": 0,
+                  "statement_cache_hits": 0, "statement_cache_misses": 0}
+_query_metrics_lock = threading.Lock()
+
+
+class QueryResult(list):
+    """List of result rows that also carries the row count and execution time."""
+
+    def __init__(self, rows=(), rowcount=0, elapsed_ms=0.0):
+        super().__init__(rows)
+        self.rowcount = rowcount
+        self.elapsed_ms = elapsed_ms
+
+
+def get_statement(query):
+    """Returns the cached text() construct for a SQL string, compiling it once."""
+    with _statement_cache_lock:
+        statement = _statement_cache.get(query)
+        if statement is not None:
+            _statement_cache.move_to_end(query)
+            _query_metrics["statement_cache_hits"] += 1
+            return statement
+        _query_metrics["statement_cache_misses"] += 1
+        statement = _statement_cache[query] = text(query)
+        if len(_statement_cache) > STATEMENT_CACHE_SIZE:
+            _statement_cache.popitem(last=False)
+        return statement
+
+
+def _record_query(rows, elapsed_ms, failed=False):
+    with _query_metrics_lock:
+        _query_metrics["queries"] += 1
+        _query_metrics["rows"] += rows
+        _query_metrics["total_ms"] += elapsed_ms
+        _query_metrics["slowest_ms"] = max(_query_metrics["slowest_ms"], elapsed_ms)
+        if failed:
+            _query_metrics["errors"] += 1
+
+
+def get_query_metrics():
+    """Returns a snapshot of query counts, rows, timings and statement cache hits."""
+    with _query_metrics_lock:
+        return dict(_query_metrics)
+
+
+def _run_query(session_factory, query, params, one):
+    statement = get_statement(query)
+    start = time.perf_counter()
+    rows = 0
+    failed = False
     try:
-        with get_db_session() as session:
-            result = session.execute(text(query), params or {})
+        with session_factory() as session:
+            # A list of parameter dicts runs as a single executemany
+            result = session.execute(statement, params if params else {})
+            if not result.returns_rows:
+                note_write()
+                rows = max(result.rowcount, 0)
+                return QueryResult(rowcount=rows, elapsed_ms=(time.perf_counter() - start) * 1000)
             if one:
-                return result.fetchone()  # Return a single record
-            return result.fetchall()  # Return all records
+                row = result.fetchone()
+                rows = int(row is not None)
+                return row
+            records = result.fetchall()
+            rows = len(records)
+            return QueryResult(records, rowcount=rows, elapsed_ms=(time.perf_counter() - start) * 1000)
     except Exception as e:
+        failed = True
         logger.error(f"Error executing query: {str(e)}")
-        return None
+        raise
+    finally:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        _record_query(rows, elapsed_ms, failed)
+        logger.debug(f"Query returned {rows} rows in {elapsed_ms:.1f} ms: {query.strip()[:80]}")
+
+
+# Each call opens, commits and closes its own session, so it is safe to re-run
+_run_query_with_retry = retry_on_lock(_run_query, rollback_session=False)
+
+
+def _stream_query(engine, query, params, batch_size):
+    """Yields rows using a server-side cursor, holding at most `batch_size` in memory."""
+    statement = get_statement(query)
+    start = time.perf_counter()
+    rows = 0
+    try:
+        with engine.connect() as connection:
+            result = connection.execution_options(stream_results=True, yield_per=batch_size).execute(
+                statement, params or {}
+            )
+            for partition in result.partitions():
+                rows += len(partition)
+                yield from partition
+    except Exception as e:
+        _record_query(rows, (time.perf_counter() - start) * 1000, failed=True)
+        logger.error(f"Error streaming query: {str(e)}")
+        raise
+    else:
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        _record_query(rows, elapsed_ms)
+        logger.debug(f"Streamed {rows} rows in {elapsed_ms:.1f} ms: {query.strip()[:80]}")
+
+
+# Helper function to execute raw SQL queries
+def execute_query(query, params=None, one=False, stream=False, batch_size=DEFAULT_STREAM_BATCH_SIZE):
+    """
+    Executes a raw SQL query with parameters.
+
+    - `params` may be a dict, or a list of dicts to run the statement once
+      per entry in a single executemany (bulk inserts/updates).
+    - `one=True` returns only the first row.
+    - `stream=True` returns an iterator that fetches `batch_size` rows at a
+      time, so large reads run in constant memory.
+    - Otherwise returns a QueryResult: the rows (empty for writes) along with
+      `rowcount` and `elapsed_ms`.
+
+    Statements that hit a locked database are retried with backoff (see
+    db_retry); other errors are logged and re-raised.
+    """
+    if stream:
+        return _stream_query(get_db_engine(), query, params, batch_size)
+    return _run_query_with_retry(get_db_session, query, params, one)
+
+# Helper function to execute read-only queries on the analytics read engine
+def execute_read_query(query, params=None, one=False, stream=False, batch_size=DEFAULT_STREAM_BATCH_SIZE):
+    """
+    Like execute_query(), but runs on the read engine, so long scans never
+    hold locks that chat writes are waiting for.
+    """
+    from read_routing import get_read_engine, get_read_session
+    if stream:
+        return _stream_query(get_read_engine(), query, params, batch_size)
+    return _run_query(get_read_session, query, params, one)
 
 # Helper function to execute database migrations
 def run_migrations():
     """
     Executes database migrations using Alembic or other migrations framework.
     This function will be important for managing schema changes over time.
+    Must be called inside an app context (the environment reads the engine
+    from the Flask-Migrate extension).
     """
     try:
         from alembic import command
         from alembic.config import Config
 
-        alembic_cfg = Config("alembic.ini")
+        alembic_cfg = Config(os.path.join(MIGRATIONS_DIR, "alembic.ini"))
+        alembic_cfg.set_main_option("script_location", MIGRATIONS_DIR)
         command.upgrade(alembic_cfg, "head")  # Upgrade to the latest migration
         logger.info("Migrations applied successfully.")
     except Exception as e:
@@ -122,32 +266,32 @@ def update_user_status(user_id, status):
 # Helper function to get user notifications
 def get_user_notifications(user_id):
     """
-    Retrieves all notifications for a given user.
-    """
-    query = """
-        SELECT * FROM notifications
-        WHERE user_id = :user_id
-        ORDER BY created_at DESC
-    """
-    params = {'user_id': user_id}
-    return execute_query(query, params)
+    Retrieves all notifications for a given user, from the shard that
+    holds them.
+    """
+    notifications = Notification.__table__
+    query = (
+        select(notifications)
+        .where(notifications.c.user_id == user_id)
+        .order_by(notifications.c.created_at.desc())
+    )
+    start = time.perf_counter()
+    rows = sharding.execute_on_shard(sharding.get_shard_map().shard_for_user(user_id), query)
+    return QueryResult(rows, rowcount=len(rows), elapsed_ms=(time.perf_counter() - start) * 1000)
 
 # Helper function to insert a new notification
+@retry_on_lock(rollback_session=False)
 def create_notification(user_id, message, notification_type='info'):
     """
-    Creates a new notification for the user.
-    """
-    query = """
-        INSERT INTO notifications (user_id, message, notification_type, created_at)
-        VALUES (:user_id, :message, :notification_type, :created_at)
+    Creates a new notification on the user's shard and returns its id.
     """
-    params = {
+    return sharding.insert_row('notifications', {
         'user_id': user_id,
         'message': message,
-        'notification_type': notification_type,
-        'created_at': datetime.utcnow()
-    }
-    return execute_query(query, params)
+        'type': notification_type,
+        'is_read': False,
+        'created_at': datetime.utcnow(),
+    })
 
 # Function for inserting a flagged message for review
 def flag_message(user_id, message_id, reason):
@@ -166,24 +310,61 @@ def flag_message(user_id, message_id, reason):
     }
     return execute_query(query, params)
 
+def _with_messages(flags):
+    """
+    Adds the flagged message's content and its sender's username to each
+    flag (dicts); flags whose message no longer exists are dropped.
+    """
+    from messages import get_messages
+    from read_routing import get_read_session
+    found = get_messages([flag['message_id'] for flag in flags])
+    sender_ids = {row.sender_id for row in found.values()}
+    users = User.__table__
+    with get_read_session() as session:
+        usernames = dict(session.execute(
+            select(users.c.id, users.c.username).where(users.c.id.in_(sender_ids))
+        ).fetchall())
+    return [
+        dict(flag, content=found[flag['message_id']].content,
+             username=usernames.get(found[flag['message_id']].sender_id))
+        for flag in flags
+        if flag['message_id'] in found and found[flag['message_id']].sender_id in usernames
+    ]
+
+
+def _stream_flagged_content(flags, batch_size):
+    batch = []
+    for flag in flags:
+        batch.append(dict(flag._mapping))
+        if len(batch) == batch_size:
+            yield from _with_messages(batch)
+            batch = []
+    if batch:
+        yield from _with_messages(batch)
+
 # Function to get all flagged content
-def get_flagged_content():
+def get_flagged_content(stream=False, batch_size=DEFAULT_STREAM_BATCH_SIZE):
     """
-    Fetches content that has been flagged by users for admin review.
+    Fetches content that has been flagged by users for admin review, with
+    the message content and sender's username. Flags are read from the
+    primary database and their messages from the shards (or the archive),
+    one lookup per `batch_size` flags.
+    With `stream=True`, returns an iterator instead of loading every row.
     """
     query = """
-        SELECT fc.*, m.content, u.username FROM flagged_content fc
-        JOIN messages m ON fc.message_id = m.id
-        JOIN users u ON m.sender_id = u.id
-        WHERE fc.reviewed = false
-        ORDER BY fc.created_at DESC
+        SELECT * FROM flagged_content
+        WHERE reviewed = false
+        ORDER BY created_at DESC
     """
-    return execute_query(query)
+    if stream:
+        return _stream_flagged_content(execute_read_query(query, stream=True, batch_size=batch_size), batch_size)
+    return list(_stream_flagged_content(execute_read_query(query), batch_size))
 
 # Function for fetching recent user activity logs
-def get_user_activity_logs(user_id, days=30):
+def get_user_activity_logs(user_id, days=30, stream=False):
     """
     Fetches user activity logs within a given timeframe (default 30 days).
+    With `stream=True`, returns an iterator instead of loading every row.
     """
     cutoff = datetime.utcnow() - timedelta(days=days)
     query = """
@@ -192,21 +373,27 @@ def get_user_activity_logs(user_id, days=30):
         ORDER BY timestamp DESC
     """
     params = {'user_id': user_id, 'cutoff': cutoff}
-    return execute_query(query, params)
+    return execute_query(query, params, stream=stream)
+
+# Conversations with more messages than this (in one direction) count as a trend
+MIN_TREND_INTERACTIONS = 10
 
 # Function for detecting user interaction trends
 def get_user_interaction_trends():
     """
     Detects user interaction trends (e.g., who interacted with whom).
     """
-    query = """
-        SELECT sender_id, receiver_id, COUNT(*) as interaction_count
-        FROM messages
-        GROUP BY sender_id, receiver_id
-        HAVING interaction_count > 10  -- Example: more than 10 interactions
-        ORDER BY interaction_count DESC
-    """
-    return execute_query(query)
+    # A conversation lives on a single shard, so each shard's counts are already complete
+    messages = Message.__table__
+    query = (
+        select(messages.c.sender_id, messages.c.receiver_id, func.count().label('interaction_count'))
+        .where(messages.c.group_id.is_(None))
+        .group_by(messages.c.sender_id, messages.c.receiver_id)
+        .having(func.count() > MIN_TREND_INTERACTIONS)
+    )
+    start = time.perf_counter()
+    rows = sorted(sharding.scatter(query), key=lambda row: row.interaction_count, reverse=True)
+    return QueryResult(rows, rowcount=len(rows), elapsed_ms=(time.perf_counter() - start) * 1000)
 
 # Utility function to fetch all tables (helpful for debugging)
 def list_tables():
@@ -216,12 +403,3 @@ def list_tables():
     """
     query = "SELECT name FROM sqlite_master WHERE type='table'"
     return execute_query(query)
-
-# Cleanup function to close the session manually (if needed)
-def close_session():
-    """
-    Manually closes the database session.
-    Typically used in certain edge cases.
-    """
-    Session.remove()  # Close the scoped session
-    logger.info("Database session closed manually.")
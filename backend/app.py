@@ -1,14 +1,13 @@
 from flask import Flask
-from flask_sqlalchemy import SQLAlchemy
+import click
 from flask_migrate import Migrate
-from flask_session import Session
 from datetime import timedelta
 import logging
 import os
 import random
 import string
+from models import User, db
 from notifications import create_notification, get_notifications, mark_as_read
-from models import User
 import random
 import string
 from flask import jsonify, render_template, redirect
@@ -18,19 +17,32 @@ from analytics import analytics_bp
 from flask_login import login_required, current_user
 from user_management_authentication import user_auth_bp
 from chat import chat_bp
-from user_management_authentication import user_bp
+from user_management_authentication import dashboard_bp, user_bp
 from admin_management import admin_bp
 from notifications import notifications_bp
 from analytics import analytics_bp
 from group_management import group_bp
+from scheduler import scheduler
+from db_engines import engines
+import query_instrumentation
+import sharding
+import message_archive
+import message_compaction
+import moderation
+import session_store
+import synthetic_data
+from group_membership import membership_cache
+from password_hashing import password_hasher
+from presence import presence_tracker
+from login_throttling import login_throttle
+from unit_of_work import transactional
+from utils import identity_cache
 
 
 app = Flask(__name__)
 
-# Initialize extensions
-db = SQLAlchemy()
-migrate = Migrate()
-session = Session()
+# Initialize extensions (`db` is the single extension defined in models.py)
+migrate = Migrate(directory=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'migrations'))
 
 
 app.register_blueprint(user_auth_bp)
@@ -49,17 +61,90 @@ def create_app():
     app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'default_secret_key')
     app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///database.db')
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    # Optional replica/snapshot for analytics; defaults to a read-only handle on the primary
+    app.config['SQLALCHEMY_READ_DATABASE_URI'] = os.getenv('READ_DATABASE_URL')
     app.config.from_object('config.Config')
 
-    # Session Config
-    app.config['SESSION_TYPE'] = 'filesystem'
+    # Background jobs (leases in the database keep one runner per job across workers)
+    app.config['SCHEDULER_ENABLED'] = os.getenv('SCHEDULER_ENABLED', '0') == '1'
+
+    # Connection pool (shared by the `db` extension and the raw-SQL helpers)
+    app.config['DB_POOL_SIZE'] = int(os.getenv('DB_POOL_SIZE', 5))
+    app.config['DB_MAX_OVERFLOW'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    app.config['DB_POOL_TIMEOUT'] = int(os.getenv('DB_POOL_TIMEOUT', 30))
+    app.config['DB_POOL_RECYCLE'] = int(os.getenv('DB_POOL_RECYCLE', 3600))
+    app.config['DB_POOL_PRE_PING'] = os.getenv('DB_POOL_PRE_PING', '1') == '1'
+
+    # SQLite tuning: 'performance' (WAL, synchronous=NORMAL), 'durable' or 'default'
+    app.config['SQLITE_PRAGMA_PROFILE'] = os.getenv('SQLITE_PRAGMA_PROFILE', 'performance')
+
+    # Password hashing pool: werkzeug method/work factor, 'process'/'thread'/'inline' executor and
+    # how many hashes may be queued before sign-ins get a 503 (default: 4 per worker)
+    app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt')
+    app.config['PASSWORD_HASH_EXECUTOR'] = os.getenv('PASSWORD_HASH_EXECUTOR', 'process')
+    app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 0)) or None
+    app.config['PASSWORD_HASH_QUEUE_SIZE'] = int(os.getenv('PASSWORD_HASH_QUEUE_SIZE', 0)) or None
+    app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', 5))
+
+    # Sign-in throttling: sliding-window failure limits per account and per client IP, and the
+    # number of account failures allowed before delays (1 s, doubling up to the max) set in
+    app.config['LOGIN_THROTTLE_WINDOW_SECONDS'] = int(os.getenv('LOGIN_THROTTLE_WINDOW_SECONDS', 900))
+    app.config['LOGIN_THROTTLE_ACCOUNT_LIMIT'] = int(os.getenv('LOGIN_THROTTLE_ACCOUNT_LIMIT', 10))
+    app.config['LOGIN_THROTTLE_IP_LIMIT'] = int(os.getenv('LOGIN_THROTTLE_IP_LIMIT', 100))
+    app.config['LOGIN_THROTTLE_FREE_FAILURES'] = int(os.getenv('LOGIN_THROTTLE_FREE_FAILURES', 3))
+    app.config['LOGIN_THROTTLE_MAX_DELAY'] = int(os.getenv('LOGIN_THROTTLE_MAX_DELAY', 60))
+
+    # Seconds a user's role/ban/suspension stays cached per process (changes made here apply at once)
+    app.config['IDENTITY_CACHE_TTL'] = int(os.getenv('IDENTITY_CACHE_TTL', 60))
+
+    # User search index: pick up other workers' registrations / rebuild (bans, renames) this often
+    app.config['USER_SEARCH_SYNC_SECONDS'] = int(os.getenv('USER_SEARCH_SYNC_SECONDS', 5))
+    app.config['USER_SEARCH_REBUILD_SECONDS'] = int(os.getenv('USER_SEARCH_REBUILD_SECONDS', 600))
+
+    # Seconds a group's member set stays cached per process (joins/leaves made here apply at once)
+    app.config['GROUP_MEMBERSHIP_CACHE_TTL'] = int(os.getenv('GROUP_MEMBERSHIP_CACHE_TTL', 300))
+
+    # Group messages are stored once; groups up to this size also keep per-member unread
+    # counters current on each post (bigger groups are counted on read; 0 disables counters)
+    app.config['GROUP_FANOUT_ON_WRITE_MAX_MEMBERS'] = int(os.getenv('GROUP_FANOUT_ON_WRITE_MAX_MEMBERS', 100))
+
+    # Presence: users count as online this long after their last request; heartbeats and
+    # last_login are written in batches this often
+    app.config['PRESENCE_TTL_SECONDS'] = int(os.getenv('PRESENCE_TTL_SECONDS', 120))
+    app.config['PRESENCE_FLUSH_SECONDS'] = int(os.getenv('PRESENCE_FLUSH_SECONDS', 15))
+
+    # Message/notification shards: comma-separated database URLs, 'primary' for the main database
+    app.config['SHARD_DATABASE_URIS'] = [url.strip() for url in os.getenv('SHARD_DATABASE_URLS', '').split(',') if url.strip()]
+
+    # Messages older than this move to monthly archive files (default: instance/message_archive)
+    app.config['MESSAGE_ARCHIVE_AFTER_DAYS'] = int(os.getenv('MESSAGE_ARCHIVE_AFTER_DAYS', 180))
+    app.config['MESSAGE_ARCHIVE_DIR'] = os.getenv('MESSAGE_ARCHIVE_DIR')
+
+    # Soft-deleted messages are hard-deleted by the compactor after this long
+    app.config['MESSAGE_PURGE_AFTER_HOURS'] = int(os.getenv('MESSAGE_PURGE_AFTER_HOURS', 24))
+
+    # Query instrumentation: warn on N+1 loops and slow statements, optional Server-Timing header
+    app.config['QUERY_REPEAT_THRESHOLD'] = int(os.getenv('QUERY_REPEAT_THRESHOLD', 10))
+    app.config['SLOW_QUERY_MS'] = int(os.getenv('SLOW_QUERY_MS', 100))
+    app.config['SERVER_TIMING_HEADER'] = os.getenv('SERVER_TIMING_HEADER', '0') == '1'
+
+    # Session Config (server-side sessions in the sessions table; the cookie only carries the id)
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(days=7)
+    # Unchanged sessions only rewrite their expiry once it is this many seconds stale
+    app.config['SESSION_REFRESH_SECONDS'] = int(os.getenv('SESSION_REFRESH_SECONDS', 3600))
 
-    # Initialize extensions
-    db.init_app(app)
+    # Initialize extensions (the engine registry also initializes `db`)
+    engines.init_app(app, db)
+    sharding.init_app(app)
     migrate.init_app(app, db)
-    session.init_app(app)
-
+    session_store.init_app(app)
+    scheduler.init_app(app)
+    password_hasher.init_app(app)
+    login_throttle.init_app(app)
+    identity_cache.init_app(app)
+    presence_tracker.init_app(app)
+    membership_cache.init_app(app)
+    query_instrumentation.init_app(app)
 
     # Register blueprints
     app.register_blueprint(user_bp, url_prefix='/user')
@@ -68,6 +153,13 @@ def create_app():
     app.register_blueprint(analytics_bp, url_prefix='/analytics')
     app.register_blueprint(user_auth_bp, url_prefix='/auth')
     app.register_blueprint(chat_bp, url_prefix='/chat')
+    app.register_blueprint(dashboard_bp)
+
+    # Every authenticated request is a presence heartbeat (kept in memory, written in batches)
+    @app.before_request
+    def track_presence():
+        if current_user.is_authenticated:
+            presence_tracker.touch(current_user.id)
 
     # Register error handlers and CLI commands
     register_error_handlers(app)
@@ -101,7 +193,7 @@ def register_error_handlers(app):
 def register_cli_commands(app):
     """Register custom CLI commands for development"""
 
-    from models import User, Message, FlaggedContent
+    from models import User, FlaggedContent
 
     @app.cli.command("create-db")
     def create_db():
@@ -146,22 +238,94 @@ def register_cli_commands(app):
 
             db.session.commit()
 
-            # Create random messages
+            # Create random messages, each on its conversation's shard
+            from messages import store_message
             users = User.query.all()
             for _ in range(20):
-                msg = Message(
-                    sender_id=random.choice(users).id,
-                    content="".join(random.choices(string.ascii_letters + string.digits, k=50))
+                sender, receiver = random.sample(users, 2)
+                store_message(
+                    sender.id, receiver.id,
+                    "".join(random.choices(string.ascii_letters + string.digits, k=50))
                 )
-                db.session.add(msg)
-
-            db.session.commit()
             logger.info("Database seeded with users and messages.")
 
         except Exception as e:
             db.session.rollback()
             logger.error(f"Seeding failed: {str(e)}")
 
+    @app.cli.command("upgrade-db")
+    def upgrade_db():
+        """Apply all pending schema migrations (indexes, new columns and tables)"""
+        from api_db_management import run_migrations
+        run_migrations()
+
+    @app.cli.command("list-jobs")
+    def list_jobs():
+        """List scheduled jobs with their last run"""
+        from models import JobLease
+        leases = {lease.name: lease for lease in JobLease.query.all()}
+        for name, job in sorted(scheduler.jobs.items()):
+            lease = leases.get(name)
+            if lease and lease.last_started_at:
+                print(f"{name} ({job.schedule}) - last run {lease.last_started_at:%Y-%m-%d %H:%M:%S}, "
+                      f"{lease.last_status} in {lease.last_duration_ms} ms, {lease.run_count} runs")
+            else:
+                print(f"{name} ({job.schedule}) - never run")
+
+    @app.cli.command("run-job")
+    @click.argument("name")
+    @click.option("--force", is_flag=True, help="Run even if another worker holds the lease")
+    def run_job(name, force):
+        """Run a scheduled job immediately"""
+        if name not in scheduler.jobs:
+            logger.error(f"Unknown job '{name}'. Available: {', '.join(sorted(scheduler.jobs))}")
+            return
+        status = scheduler.run_job(name, force=force)
+        logger.info(f"Job {name}: {status}")
+
+    @app.cli.command("rebalance-shards")
+    @click.option("--dry-run", is_flag=True, help="Only count the rows that would move")
+    @click.option("--batch-size", default=sharding.DEFAULT_REBALANCE_BATCH_SIZE, show_default=True)
+    def rebalance_shards(dry_run, batch_size):
+        """Move messages and notifications onto the shards the shard map assigns (run with the app stopped)"""
+        moved = sharding.rebalance(batch_size=batch_size, dry_run=dry_run)
+        for table_name, count in moved.items():
+            logger.info(f"{table_name}: {count} rows {'to move' if dry_run else 'moved'}")
+
+    @app.cli.command("archive-messages")
+    @click.option("--days", type=int, default=None, help="Archive messages older than this many days")
+    def archive_messages(days):
+        """Move old messages into the monthly archive files"""
+        count = message_archive.archive_messages(older_than_days=days)
+        logger.info(f"Archived {count} messages.")
+
+    @app.cli.command("purge-messages")
+    @click.option("--hours", type=int, default=None, help="Purge messages soft-deleted more than this many hours ago")
+    def purge_messages(hours):
+        """Hard-delete soft-deleted messages and reclaim their space"""
+        count = message_compaction.purge_deleted_messages(older_than_hours=hours)
+        logger.info(f"Purged {count} messages.")
+
+    @app.cli.command("generate-data")
+    @click.option("--users", default=1000, show_default=True)
+    @click.option("--messages", default=10000, show_default=True)
+    @click.option("--groups", default=100, show_default=True)
+    @click.option("--flags", default=100, show_default=True)
+    @click.option("--notifications", default=1000, show_default=True)
+    @click.option("--activity-logs", default=1000, show_default=True)
+    @click.option("--seed", default=synthetic_data.DEFAULT_SEED, show_default=True)
+    @click.option("--days", default=synthetic_data.DEFAULT_DAYS, show_default=True, help="Spread timestamps over this many days")
+    @click.option("--zipf", default=synthetic_data.DEFAULT_ZIPF_EXPONENT, show_default=True, help="Activity skew exponent")
+    @click.option("--batch-size", default=synthetic_data.DEFAULT_BATCH_SIZE, show_default=True)
+    def generate_data(users, messages, groups, flags, notifications, activity_logs, seed, days, zipf, batch_size):
+        """Append a large synthetic dataset (power-law activity, deterministic per seed)"""
+        counts = synthetic_data.generate_dataset(
+            users=users, messages=messages, groups=groups, flags=flags, notifications=notifications,
+            activity_logs=activity_logs, seed=seed, days=days, batch_size=batch_size, exponent=zipf,
+        )
+        for table_name, count in counts.items():
+            logger.info(f"{table_name}: {count} rows")
+
     @app.cli.command("list-users")
     def list_users():
         """List all registered users"""
@@ -201,11 +365,11 @@ def mark_notification_as_read(id):
     return redirect('/notifications')  # Redirect back to notifications page after marking as read
 
 @app.route('/ban_user/<int:user_id>', methods=['POST'])
+@transactional
 def ban_user(user_id):
     user = User.query.get(user_id)
     if user:
-        user.is_banned = True
-        db.session.commit()
+        moderation.ban_user(user)
 
         # Create notification for the banned user
         create_notification(
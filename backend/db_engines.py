@@ -0,0 +1,328 @@
+import logging
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import create_engine, event, exc as sa_exc
+from sqlalchemy.engine import make_url
+from sqlalchemy.pool import QueuePool
+
+from scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Checkouts that wait longer than this on a saturated pool count as waits
+POOL_WAIT_THRESHOLD_SECONDS = 0.001
+
+# How long SQLite itself waits for a lock before raising "database is locked". Kept
+# short so that db_retry.retry_on_lock does the longer waiting, with backoff, well
+# inside its deadline (the driver's own default is 5 s, longer than that deadline)
+SQLITE_BUSY_TIMEOUT_MS = 250
+
+# PRAGMAs applied to every new SQLite connection, by profile name
+SQLITE_PRAGMA_PROFILES = {
+    # Stock SQLite: rollback journal, full fsync on every commit
+    'default': {
+        'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    },
+    # WAL lets readers run alongside the single writer; NORMAL only fsyncs at checkpoints
+    'performance': {
+        'auto_vacuum': 'INCREMENTAL',  # only takes effect on new files (or after a full VACUUM)
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,  # negative = KiB, so ~64 MB
+        'temp_store': 'MEMORY',
+        'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    },
+    # WAL concurrency, but fsync on every commit
+    'durable': {
+        'auto_vacuum': 'INCREMENTAL',
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'cache_size': -64000,
+        'busy_timeout': SQLITE_BUSY_TIMEOUT_MS,
+    },
+}
+
+# PRAGMAs that change the database file and cannot run on a read-only connection
+SQLITE_WRITE_PRAGMAS = {'journal_mode', 'auto_vacuum'}
+
+# Free pages returned to the filesystem per incremental vacuum step
+DEFAULT_INCREMENTAL_VACUUM_PAGES = 2000
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that counts checkouts, waits for a free connection and timeouts."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics_lock = threading.Lock()
+        self.metrics = {
+            "connections_created": 0,
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_ms": 0.0,
+            "max_wait_ms": 0.0,
+            "timeouts": 0,
+        }
+
+    def recreate(self):
+        # Keep counters across pool recreation (e.g. after dispose())
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        pool.metrics_lock = self.metrics_lock
+        return pool
+
+    def _create_connection(self):
+        with self.metrics_lock:
+            self.metrics["connections_created"] += 1
+        return super()._create_connection()
+
+    def _do_get(self):
+        saturated = self._max_overflow > -1 and self.checkedout() >= self.size() + self._max_overflow
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except sa_exc.TimeoutError:
+            with self.metrics_lock:
+                self.metrics["timeouts"] += 1
+            logger.warning(f"Connection pool exhausted: {self.status()}")
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self.metrics_lock:
+                self.metrics["checkouts"] += 1
+                if saturated and waited >= POOL_WAIT_THRESHOLD_SECONDS:
+                    self.metrics["waits"] += 1
+                    self.metrics["wait_time_ms"] += waited * 1000
+                    self.metrics["max_wait_ms"] = max(self.metrics["max_wait_ms"], waited * 1000)
+
+
+def sqlite_pragmas(config):
+    """Returns the PRAGMAs for the configured profile, with per-PRAGMA overrides."""
+    profile = config.get('SQLITE_PRAGMA_PROFILE', 'performance')
+    if profile not in SQLITE_PRAGMA_PROFILES:
+        raise ValueError(f"Unknown SQLite pragma profile '{profile}'")
+    pragmas = dict(SQLITE_PRAGMA_PROFILES[profile])
+    pragmas.update(config.get('SQLITE_PRAGMAS', {}))
+    return pragmas
+
+
+def apply_sqlite_pragmas(dbapi_connection, pragmas, read_only=False):
+    """Runs each PRAGMA on a raw DB-API connection, logging (not raising) failures."""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            if read_only and name in SQLITE_WRITE_PRAGMAS:
+                continue
+            try:
+                cursor.execute(f"PRAGMA {name} = {value}")
+            except Exception as e:
+                logger.warning(f"Could not apply PRAGMA {name} = {value}: {str(e)}")
+    finally:
+        cursor.close()
+
+
+def install_sqlite_pragmas(engine, config):
+    """Applies the configured PRAGMA profile to every new connection of a SQLite engine."""
+    if engine.dialect.name != 'sqlite':
+        return
+    pragmas = sqlite_pragmas(config)
+    if not pragmas:
+        return
+    read_only = engine.url.query.get('mode') == 'ro'
+
+    @event.listens_for(engine, 'connect')
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        apply_sqlite_pragmas(dbapi_connection, pragmas, read_only)
+
+
+def _is_memory_sqlite(db_url):
+    url = make_url(db_url)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def pool_options(config, db_url):
+    """Builds pool arguments for create_engine from the app config."""
+    if _is_memory_sqlite(db_url):
+        # In-memory SQLite needs a single shared connection (StaticPool)
+        return {}
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': config.get('DB_POOL_SIZE', 5),
+        'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': config.get('DB_POOL_RECYCLE', 3600),
+        'pool_pre_ping': config.get('DB_POOL_PRE_PING', True),
+    }
+
+
+class EngineRegistry:
+    """
+    Owns every SQLAlchemy engine the app uses.
+
+    The primary engine is the one created by the Flask-SQLAlchemy `db`
+    extension; other engines (the analytics read engine, shards, ...) are
+    created lazily from factories registered by name, with the same pool
+    configuration.
+    """
+
+    def __init__(self):
+        self.db = None
+        self._factories = {}
+        self._lock = threading.Lock()
+
+    def register(self, name, factory, configure=None):
+        """
+        Registers factory(app) -> (url, extra_options) for a named engine.
+        A factory may return (None, {}) to share the primary engine instead.
+        `configure(engine)` runs once on each newly created engine.
+        """
+        self._factories[name] = (factory, configure)
+
+    def init_app(self, app, db):
+        """
+        Initializes the `db` extension with the configured pool and, for
+        SQLite, the configured PRAGMA profile.
+        """
+        self.db = db
+        options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        for key, value in pool_options(app.config, app.config['SQLALCHEMY_DATABASE_URI']).items():
+            options.setdefault(key, value)
+        app.extensions['engine_registry'] = {}
+
+        db.init_app(app)
+        with app.app_context():
+            install_sqlite_pragmas(db.engine, app.config)
+
+    def _engines(self, app):
+        return app.extensions.setdefault('engine_registry', {})
+
+    def get_engine(self, name='primary', app=None):
+        """Returns the named engine, creating it on first use."""
+        if name == 'primary':
+            return self.db.engine
+
+        app = app or current_app._get_current_object()
+        engines = self._engines(app)
+        engine = engines.get(name)
+        if engine is None:
+            with self._lock:
+                engine = engines.get(name)
+                if engine is None:
+                    if name not in self._factories:
+                        raise KeyError(f"No engine registered under '{name}'")
+                    factory, configure = self._factories[name]
+                    url, extra_options = factory(app)
+                    if url is None:
+                        engine = self.get_engine('primary')
+                    else:
+                        engine = self.create_engine(app, url, **extra_options)
+                        if configure:
+                            configure(engine)
+                        logger.info(f"Created engine '{name}' for {engine.url.render_as_string(hide_password=True)}")
+                    engines[name] = engine
+        return engine
+
+    def create_engine(self, app, url, **extra_options):
+        options = pool_options(app.config, str(url))
+        options.update(extra_options)
+        engine = create_engine(url, **options)
+        install_sqlite_pragmas(engine, app.config)
+        return engine
+
+    def all_engines(self, app=None):
+        app = app or current_app._get_current_object()
+        engines = {'primary': self.get_engine('primary')}
+        engines.update(self._engines(app))
+        return engines
+
+    def distinct_engines(self, app=None):
+        """Like all_engines(), but skips names that alias another engine."""
+        seen = set()
+        result = {}
+        for name, engine in self.all_engines(app).items():
+            if id(engine) not in seen:
+                seen.add(id(engine))
+                result[name] = engine
+        return result
+
+    def pool_stats(self, app=None):
+        """Returns live statistics for every engine's connection pool."""
+        stats = {}
+        for name, engine in self.distinct_engines(app).items():
+            pool = engine.pool
+            entry = {"pool_class": type(pool).__name__, "status": pool.status()}
+            if isinstance(pool, QueuePool):
+                entry.update({
+                    "size": pool.size(),
+                    "checked_out": pool.checkedout(),
+                    "checked_in": pool.checkedin(),
+                    "overflow": pool.overflow(),
+                })
+            if isinstance(pool, InstrumentedQueuePool):
+                with pool.metrics_lock:
+                    entry.update(pool.metrics)
+            stats[name] = entry
+        return stats
+
+    def dispose(self, app=None):
+        for engine in self.distinct_engines(app).values():
+            engine.dispose()
+
+
+# Shared registry; engines live per app in app.extensions['engine_registry']
+engines = EngineRegistry()
+
+
+def _writable_sqlite_engines():
+    return [
+        engine for engine in engines.distinct_engines().values()
+        if engine.dialect.name == 'sqlite' and engine.url.query.get('mode') != 'ro'
+    ]
+
+
+@scheduler.job('sqlite-wal-checkpoint', interval=300, timeout=120)
+def sqlite_wal_checkpoint():
+    """Checkpoints the WAL so it does not grow without bound between automatic checkpoints."""
+    for engine in _writable_sqlite_engines():
+        with engine.connect() as connection:
+            busy, log_frames, checkpointed = connection.exec_driver_sql(
+                "PRAGMA wal_checkpoint(PASSIVE)"
+            ).fetchone()
+            logger.info(f"WAL checkpoint on {engine.url.database}: "
+                        f"{checkpointed}/{log_frames} frames{' (busy)' if busy else ''}")
+
+
+def sqlite_incremental_vacuum(engine, max_pages=DEFAULT_INCREMENTAL_VACUUM_PAGES):
+    """
+    Returns up to `max_pages` free pages of a SQLite file to the filesystem.
+    Needs auto_vacuum = INCREMENTAL, which existing files only pick up after
+    one full VACUUM; returns the number of pages freed (0 if not enabled).
+    """
+    if engine.dialect.name != 'sqlite':
+        return 0
+    raw = engine.raw_connection()
+    try:
+        cursor = raw.cursor()
+        if cursor.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:  # 2 = INCREMENTAL
+            logger.info(f"Incremental vacuum not enabled on {engine.url.database}; run VACUUM once to enable it")
+            return 0
+        free_pages = cursor.execute("PRAGMA freelist_count").fetchone()[0]
+        # execute() only steps the PRAGMA once (one page); executescript runs it to completion
+        cursor.executescript(f"PRAGMA incremental_vacuum({int(max_pages)})")
+        freed = free_pages - cursor.execute("PRAGMA freelist_count").fetchone()[0]
+    finally:
+        raw.close()
+    if freed:
+        logger.info(f"Incremental vacuum on {engine.url.database}: freed {freed} pages")
+    return freed
+
+
+@scheduler.job('sqlite-optimize', cron='15 3 * * *', timeout=600)
+def sqlite_optimize():
+    """Lets SQLite refresh planner statistics for tables whose indexes need it."""
+    for engine in _writable_sqlite_engines():
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA optimize")
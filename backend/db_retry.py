@@ -0,0 +1,129 @@
+from functools import wraps
+import logging
+import random
+import threading
+import time
+
+from sqlalchemy.exc import OperationalError
+
+logger = logging.getLogger(__name__)
+
+# SQLite error messages that mean "try again later", not "this is wrong"
+LOCK_ERROR_MESSAGES = (
+    'database is locked',
+    'database table is locked',
+    'database schema is locked',
+    'database is busy',
+)
+
+# Defaults for retry_on_lock; the deadline must stay well above SQLite's busy_timeout
+# (db_engines.SQLITE_BUSY_TIMEOUT_MS), or the first lock error already exceeds it
+DEFAULT_DEADLINE_SECONDS = 2.0
+DEFAULT_BASE_DELAY_SECONDS = 0.01
+DEFAULT_MAX_DELAY_SECONDS = 0.25
+
+_retry_metrics = {
+    "calls": 0,
+    "retries": 0,
+    "recovered": 0,
+    "gave_up": 0,
+}
+_retry_metrics_by_unit = {}
+_retry_metrics_lock = threading.Lock()
+
+
+def is_lock_error(error):
+    """True if the error (or anything it wraps) is SQLite lock contention."""
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        if isinstance(error, OperationalError):
+            error = error.orig
+            continue
+        # DB-API drivers all name this class OperationalError
+        if type(error).__name__ == 'OperationalError':
+            message = str(error).lower()
+            if any(text in message for text in LOCK_ERROR_MESSAGES):
+                return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def _count(unit, key):
+    with _retry_metrics_lock:
+        _retry_metrics[key] += 1
+        unit_metrics = _retry_metrics_by_unit.setdefault(unit, dict.fromkeys(_retry_metrics, 0))
+        unit_metrics[key] += 1
+
+
+def get_retry_metrics():
+    """Returns overall and per-unit retry counters."""
+    with _retry_metrics_lock:
+        return {
+            "total": dict(_retry_metrics),
+            "units": {unit: dict(metrics) for unit, metrics in _retry_metrics_by_unit.items()},
+        }
+
+
+def retry_on_lock(func=None, *, deadline=DEFAULT_DEADLINE_SECONDS, base_delay=DEFAULT_BASE_DELAY_SECONDS,
+                  max_delay=DEFAULT_MAX_DELAY_SECONDS, rollback_session=True):
+    """
+    Decorator that re-runs an idempotent write unit when SQLite reports lock
+    contention, with full-jitter exponential backoff until `deadline` seconds
+    have passed. The session is rolled back before each retry, so the unit
+    must redo all of its changes (add objects, set attributes, commit).
+    Any other error is raised immediately. Units that manage their own
+    session (e.g. get_db_session) pass rollback_session=False, as do shard
+    writes (sharding cleans up after its own failed statements): rolling
+    back db.session for them would silently drop an enclosing unit's
+    pending changes.
+
+    Inside a unit of work that has already written, rolling back would throw
+    away the request's earlier writes, so the unit runs once and any lock
+    error propagates to the request.
+
+    Usage:
+        @retry_on_lock
+        def save():
+            db.session.add(obj)
+            db.session.commit()
+    """
+    def decorator(f):
+        unit = f"{f.__module__}.{f.__qualname__}"
+
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            from unit_of_work import current_unit_of_work
+
+            _count(unit, "calls")
+            uow = current_unit_of_work()
+            if uow is not None and uow.has_writes:
+                return f(*args, **kwargs)
+            start = time.monotonic()
+            attempt = 0
+            while True:
+                try:
+                    result = f(*args, **kwargs)
+                    if attempt:
+                        _count(unit, "recovered")
+                    return result
+                except Exception as e:
+                    if not is_lock_error(e):
+                        raise
+                    if rollback_session:
+                        from models import db
+                        db.session.rollback()
+                    delay = random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+                    if time.monotonic() - start + delay > deadline:
+                        _count(unit, "gave_up")
+                        logger.error(f"{unit}: database still locked after {attempt + 1} attempts")
+                        raise
+                    attempt += 1
+                    _count(unit, "retries")
+                    logger.warning(f"{unit}: database locked, retry {attempt} in {delay * 1000:.0f} ms")
+                    time.sleep(delay)
+        return wrapper
+
+    if func is not None:
+        return decorator(func)
+    return decorator
@@ -0,0 +1,208 @@
+from array import array
+from bisect import bisect_left
+from collections import OrderedDict
+import logging
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import delete, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db_engines import engines
+from models import Group, GroupMembership, User, db
+from unit_of_work import after_commit, commit_or_flush, note_write
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_MEMBERSHIP_CACHE_TTL_SECONDS = 300   # GROUP_MEMBERSHIP_CACHE_TTL: bounds staleness across processes
+DEFAULT_MEMBERSHIP_CACHE_MAX_GROUPS = 1000   # GROUP_MEMBERSHIP_CACHE_MAX_GROUPS
+CHUNK_SIZE = 500  # ids per ... IN (...) statement
+
+_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+class MemberSet:
+    """
+    Immutable set of a group's member ids. Dense groups (members at least
+    1/64 of the id range, i.e. any big group) are a bitmap with O(1)
+    lookups; sparse ones are a sorted array of 64-bit ids searched with
+    bisect. Each takes whichever of the two is smaller.
+    """
+
+    __slots__ = ('_bitmap', '_ids', '_count')
+
+    def __init__(self, user_ids):
+        user_ids = np.unique(np.asarray(list(user_ids), dtype=np.int64))
+        self._count = len(user_ids)
+        self._bitmap = self._ids = None
+        if self._count and int(user_ids[-1]) // 8 + 1 <= self._count * 8:
+            bits = np.zeros(int(user_ids[-1]) + 1, dtype=bool)
+            bits[user_ids] = True
+            self._bitmap = np.packbits(bits, bitorder='little').tobytes()
+        else:
+            self._ids = array('q', user_ids.tolist())
+
+    def __contains__(self, user_id):
+        if self._bitmap is not None:
+            byte = user_id >> 3
+            return 0 <= byte < len(self._bitmap) and bool(self._bitmap[byte] & (1 << (user_id & 7)))
+        position = bisect_left(self._ids, user_id)
+        return position < len(self._ids) and self._ids[position] == user_id
+
+    def __len__(self):
+        return self._count
+
+    def user_ids(self):
+        """All member ids, ascending."""
+        if self._bitmap is not None:
+            bits = np.unpackbits(np.frombuffer(self._bitmap, dtype=np.uint8), bitorder='little')
+            return np.flatnonzero(bits).tolist()
+        return self._ids.tolist()
+
+    @property
+    def nbytes(self):
+        return len(self._bitmap) if self._bitmap is not None else self._ids.itemsize * len(self._ids)
+
+
+class GroupMembershipCache:
+    """
+    Per-process LRU cache of group id -> MemberSet, loaded with one covering
+    index scan. Entries are dropped when a join, leave or kick commits in
+    this process; other processes see the change when the TTL expires.
+    """
+
+    def __init__(self):
+        self.ttl = DEFAULT_MEMBERSHIP_CACHE_TTL_SECONDS
+        self.max_groups = DEFAULT_MEMBERSHIP_CACHE_MAX_GROUPS
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def init_app(self, app):
+        self.ttl = app.config.get('GROUP_MEMBERSHIP_CACHE_TTL', DEFAULT_MEMBERSHIP_CACHE_TTL_SECONDS)
+        self.max_groups = app.config.get('GROUP_MEMBERSHIP_CACHE_MAX_GROUPS', DEFAULT_MEMBERSHIP_CACHE_MAX_GROUPS)
+        self.clear()
+
+    def _load(self, group_id):
+        # Committed rows only, so a request that rolls back cannot leave its members cached
+        memberships = GroupMembership.__table__
+        with engines.get_engine().connect() as connection:
+            user_ids = connection.execute(
+                select(memberships.c.user_id).where(memberships.c.group_id == group_id)
+            ).scalars().all()
+        return MemberSet(user_ids)
+
+    def get(self, group_id):
+        """Returns the MemberSet of a group (empty for unknown groups)."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(group_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(group_id)
+                self.metrics["hits"] += 1
+                return entry[0]
+            self.metrics["misses"] += 1
+
+        members = self._load(group_id)
+        with self._lock:
+            self._entries[group_id] = (members, now + self.ttl)
+            self._entries.move_to_end(group_id)
+            while len(self._entries) > self.max_groups:
+                self._entries.popitem(last=False)
+        return members
+
+    def invalidate(self, group_id):
+        with self._lock:
+            self._entries.pop(group_id, None)
+            self.metrics["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_metrics(self):
+        with self._lock:
+            return dict(self.metrics, groups=len(self._entries),
+                        bytes=sum(entry[0].nbytes for entry in self._entries.values()))
+
+
+# Shared cache; configured by membership_cache.init_app(app)
+membership_cache = GroupMembershipCache()
+
+
+def is_member(group_id, user_id):
+    return user_id in membership_cache.get(group_id)
+
+
+def get_member_ids(group_id):
+    return membership_cache.get(group_id).user_ids()
+
+
+def count_members(group_id):
+    return len(membership_cache.get(group_id))
+
+
+def add_members(group_id, user_ids):
+    """
+    Adds users to a group with one executemany in the current unit of work;
+    existing members are skipped. Returns how many were added.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return 0
+    insert = _INSERTS[db.engine.dialect.name](GroupMembership.__table__).on_conflict_do_nothing(
+        index_elements=['group_id', 'user_id'])
+    added = db.session.execute(insert, [{'group_id': group_id, 'user_id': user_id} for user_id in user_ids]).rowcount
+    note_write()
+    commit_or_flush()
+    after_commit(membership_cache.invalidate, group_id)
+    return added
+
+
+def remove_members(group_id, user_ids):
+    """Removes users from a group in the current unit of work; returns how many were members."""
+    user_ids = list(dict.fromkeys(user_ids))
+    memberships = GroupMembership.__table__
+    removed = 0
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        removed += db.session.execute(
+            delete(memberships).where(
+                memberships.c.group_id == group_id,
+                memberships.c.user_id.in_(user_ids[start:start + CHUNK_SIZE]),
+            )
+        ).rowcount
+    if removed:
+        note_write()
+        commit_or_flush()
+        after_commit(membership_cache.invalidate, group_id)
+    return removed
+
+
+def existing_user_ids(user_ids):
+    """The given ids that belong to users who exist and are not banned, in their original order."""
+    user_ids = list(dict.fromkeys(user_ids))
+    users = User.__table__
+    existing = set()
+    for start in range(0, len(user_ids), CHUNK_SIZE):
+        existing.update(db.session.execute(
+            select(users.c.id).where(users.c.id.in_(user_ids[start:start + CHUNK_SIZE]), users.c.is_banned.isnot(True))
+        ).scalars())
+    return [user_id for user_id in user_ids if user_id in existing]
+
+
+def create_group(name, created_by, member_ids=()):
+    """Creates a group with its creator (and `member_ids`) as members, in one commit; returns its id."""
+    result = db.session.execute(Group.__table__.insert().values(name=name, created_by=created_by))
+    group_id = result.inserted_primary_key[0]
+    add_members(group_id, [created_by, *member_ids])
+    return group_id
+
+
+def get_user_group_ids(user_id):
+    """Ids of the groups a user belongs to, from the (user_id, group_id) index."""
+    memberships = GroupMembership.__table__
+    return db.session.execute(
+        select(memberships.c.group_id).where(memberships.c.user_id == user_id).order_by(memberships.c.group_id)
+    ).scalars().all()
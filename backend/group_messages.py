@@ -0,0 +1,232 @@
+from collections import defaultdict
+from datetime import datetime
+import logging
+
+from flask import current_app
+from sqlalchemy import case, func, literal, select, union_all, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db_retry import is_lock_error, retry_on_lock
+from group_membership import count_members, get_user_group_ids
+from models import GroupReadCursor, Message, db
+import sharding
+from unit_of_work import commit_or_flush, note_write
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_FANOUT_ON_WRITE_MAX_MEMBERS = 100  # GROUP_FANOUT_ON_WRITE_MAX_MEMBERS: 0 counts unread on read for every group
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+UNREAD_COUNT_CAP = 1000  # unread counts stop here ("1000+")
+GROUPS_PER_STATEMENT = 100  # UNION ALL branches per statement (SQLite allows 500)
+
+_UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+def _latest_message_id(index, group_id, before_id=None):
+    """Id of the group's newest message (older than `before_id`), 0 if none; one probe of ix_messages_group_id."""
+    messages = Message.__table__
+    query = select(func.max(messages.c.id)).where(messages.c.group_id == group_id)
+    if before_id is not None:
+        query = query.where(messages.c.id < before_id)
+    return sharding.execute_on_shard(index, query)[0][0] or 0
+
+
+def _per_group(index, queries):
+    """
+    Runs {group_id: query} on one shard as UNION ALL statements of one
+    (group_id, value) branch per group; returns {group_id: value}. Each
+    branch is a single index probe, so a user's groups cost one round trip
+    per shard.
+    """
+    values = {}
+    branches = [select(literal(group_id).label('group_id'), query.scalar_subquery().label('value'))
+                for group_id, query in queries.items()]
+    for start in range(0, len(branches), GROUPS_PER_STATEMENT):
+        chunk = branches[start:start + GROUPS_PER_STATEMENT]
+        statement = chunk[0] if len(chunk) == 1 else union_all(*chunk)
+        values.update((row.group_id, row.value) for row in sharding.execute_on_shard(index, statement))
+    return values
+
+
+def _latest_message_ids(index, group_ids):
+    """{group_id: id of its newest message, 0 if none} for groups on one shard."""
+    messages = Message.__table__
+    latest = _per_group(index, {
+        group_id: select(func.max(messages.c.id)).where(messages.c.group_id == group_id)
+        for group_id in group_ids
+    })
+    return {group_id: latest_id or 0 for group_id, latest_id in latest.items()}
+
+
+def _count_unread(index, user_id, after_ids):
+    """{group_id: others' messages after after_ids[group_id]}, each counted up to UNREAD_COUNT_CAP."""
+    messages = Message.__table__
+    queries = {}
+    for group_id, after_id in after_ids.items():
+        unread = (
+            select(messages.c.id)
+            .where(
+                messages.c.group_id == group_id,
+                messages.c.id > after_id,
+                messages.c.sender_id != user_id,
+                messages.c.deleted.isnot(True),
+            )
+            .limit(UNREAD_COUNT_CAP)
+            .subquery()
+        )
+        queries[group_id] = select(func.count()).select_from(unread)
+    return _per_group(index, queries)
+
+
+@retry_on_lock(rollback_session=False)
+def _store_group_message(group_id, sender_id, content):
+    return sharding.insert_row('messages', {
+        'sender_id': sender_id,
+        'receiver_id': None,
+        'group_id': group_id,
+        'content': content,
+        'created_at': datetime.utcnow(),
+        'deleted': False,
+    })
+
+
+@retry_on_lock
+def _count_on_write(group_id, sender_id, message_id):
+    index = sharding.get_shard_map().shard_for_group(group_id)
+    previous_id = _latest_message_id(index, group_id, before_id=message_id)
+    cursors = GroupReadCursor.__table__
+    # Only counters that were exact up to the previous message stay exact; the rest are counted on read
+    db.session.execute(
+        update(cursors)
+        .where(
+            cursors.c.group_id == group_id,
+            cursors.c.counted_through_id == previous_id,
+            cursors.c.unread_count.isnot(None),
+        )
+        .values(
+            unread_count=cursors.c.unread_count + case((cursors.c.user_id == sender_id, 0), else_=1),
+            counted_through_id=message_id,
+        )
+    )
+    note_write()
+    commit_or_flush()
+
+
+def post_group_message(group_id, sender_id, content):
+    """
+    Stores a group message once, on the group's shard, and returns its id.
+    Groups of up to GROUP_FANOUT_ON_WRITE_MAX_MEMBERS also bump their
+    members' unread counters in one UPDATE; bigger groups are counted on
+    read, so posting to them is the single insert.
+
+    The insert and the counter update are retried separately, so a lock
+    error on the counters never stores the message twice. If the counters
+    cannot be updated they fall behind and are counted on read instead.
+    """
+    message_id = _store_group_message(group_id, sender_id, content)
+    max_members = current_app.config.get('GROUP_FANOUT_ON_WRITE_MAX_MEMBERS', DEFAULT_FANOUT_ON_WRITE_MAX_MEMBERS)
+    if max_members and count_members(group_id) <= max_members:
+        try:
+            _count_on_write(group_id, sender_id, message_id)
+        except Exception as e:
+            if not is_lock_error(e):
+                raise
+            logger.warning(f"Unread counters of group {group_id} left to be counted on read: {str(e)}")
+    return message_id
+
+
+@retry_on_lock
+def mark_group_read(group_id, user_id, message_id=None):
+    """
+    Moves a member's read cursor up to `message_id` (default: the group's
+    newest message); it never moves back. Stores the exact number still
+    unread so the next unread count needs no scan. Returns that number.
+    """
+    cursors = GroupReadCursor.__table__
+    index = sharding.get_shard_map().shard_for_group(group_id)
+    latest_id = _latest_message_id(index, group_id)
+    read_through = latest_id if message_id is None else min(message_id, latest_id)
+    current = db.session.execute(
+        select(cursors.c.last_read_message_id)
+        .where(cursors.c.user_id == user_id, cursors.c.group_id == group_id)
+    ).scalar()
+    read_through = max(read_through, current or 0)
+
+    unread = _count_unread(index, user_id, {group_id: read_through})[group_id] if read_through < latest_id else 0
+    values = {
+        'last_read_message_id': read_through,
+        # A capped count is not exact, so it is left to be counted on read
+        'unread_count': unread if unread < UNREAD_COUNT_CAP else None,
+        'counted_through_id': latest_id,
+        'updated_at': datetime.utcnow(),
+    }
+    upsert = _UPSERTS[db.engine.dialect.name](cursors).values(user_id=user_id, group_id=group_id, **values)
+    db.session.execute(upsert.on_conflict_do_update(index_elements=['user_id', 'group_id'], set_=values))
+    note_write()
+    commit_or_flush()
+    return unread
+
+
+def unread_counts(user_id):
+    """
+    Returns {group_id: {'unread', 'last_read_message_id', 'latest_message_id'}}
+    for every group the user belongs to. A stored counter is used while it
+    is current (it has counted the group's newest message); otherwise the
+    unread messages after the cursor are counted from the group's index,
+    capped at UNREAD_COUNT_CAP. Latest ids and recounts are batched, so
+    this takes at most two statements per shard whatever the number of
+    groups.
+    """
+    group_ids = get_user_group_ids(user_id)
+    if not group_ids:
+        return {}
+    cursors = GroupReadCursor.__table__
+    stored = {
+        row.group_id: row
+        for row in db.session.execute(
+            select(cursors.c.group_id, cursors.c.last_read_message_id,
+                   cursors.c.unread_count, cursors.c.counted_through_id)
+            .where(cursors.c.user_id == user_id)
+        )
+    }
+    by_shard = defaultdict(list)
+    shard_map = sharding.get_shard_map()
+    for group_id in group_ids:
+        by_shard[shard_map.shard_for_group(group_id)].append(group_id)
+
+    summary = {}
+    for index, shard_group_ids in by_shard.items():
+        latest = _latest_message_ids(index, shard_group_ids)
+        stale = {}
+        for group_id in shard_group_ids:
+            cursor = stored.get(group_id)
+            last_read = cursor.last_read_message_id if cursor is not None else 0
+            if cursor is not None and cursor.unread_count is not None and cursor.counted_through_id == latest[group_id]:
+                unread = cursor.unread_count
+            elif last_read >= latest[group_id]:
+                unread = 0
+            else:
+                unread = None
+                stale[group_id] = last_read
+            summary[group_id] = {'unread': unread, 'last_read_message_id': last_read,
+                                 'latest_message_id': latest[group_id]}
+        if stale:
+            for group_id, unread in _count_unread(index, user_id, stale).items():
+                summary[group_id]['unread'] = unread
+    return {group_id: summary[group_id] for group_id in group_ids}
+
+
+def get_group_messages(group_id, limit=DEFAULT_PAGE_SIZE, before_id=None):
+    """A page of a group's messages, newest first; pass the last id seen as `before_id` for the next page."""
+    messages = Message.__table__
+    query = (
+        select(messages.c.id, messages.c.sender_id, messages.c.content, messages.c.created_at)
+        .where(messages.c.group_id == group_id, messages.c.deleted.isnot(True))
+        .order_by(messages.c.id.desc())
+        .limit(min(limit, MAX_PAGE_SIZE))
+    )
+    if before_id is not None:
+        query = query.where(messages.c.id < before_id)
+    return sharding.execute_on_shard(sharding.get_shard_map().shard_for_group(group_id), query)
@@ -0,0 +1,169 @@
+from datetime import datetime, timezone
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Fixed-width granularities, in seconds. 'month' uses calendar month edges.
+GRANULARITY_SECONDS = {
+    'minute': 60,
+    'hour': 3600,
+    'day': 86400,
+    'week': 7 * 86400,
+}
+GRANULARITIES = tuple(GRANULARITY_SECONDS) + ('month',)
+
+# Guards against accidental minute-resolution histograms over years of data
+MAX_BUCKETS = 10000
+
+# Event sources: (model name, timestamp column, user column, type column)
+EVENT_SOURCES = {
+    'messages': ('Message', 'created_at', 'sender_id', None),
+    'notifications': ('Notification', 'created_at', 'user_id', 'type'),
+    'flags': ('FlaggedContent', 'created_at', 'user_id', 'reason'),
+    'activity': ('ActivityLog', 'timestamp', 'user_id', 'action'),
+}
+
+
+def _to_epoch(when):
+    """Converts a naive UTC datetime to integer epoch seconds."""
+    return int(when.replace(tzinfo=timezone.utc).timestamp())
+
+
+def bucket_edges(start, end, granularity):
+    """
+    Returns an int64 array of bucket boundaries (epoch seconds) covering
+    [start, end). The first edge is `start` rounded down to the granularity,
+    so buckets line up with calendar minutes/hours/days/months.
+    Weeks start on Monday.
+    """
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unknown granularity '{granularity}'")
+    if end <= start:
+        raise ValueError("end must be after start")
+
+    if granularity == 'month':
+        first = np.datetime64(start.strftime('%Y-%m'), 'M')
+        last = np.datetime64(end.strftime('%Y-%m'), 'M') + 1
+        edges = np.arange(first, last + 1, dtype='datetime64[M]')
+        edges = edges.astype('datetime64[s]').astype(np.int64)
+    else:
+        step = GRANULARITY_SECONDS[granularity]
+        # The Unix epoch was a Thursday; shift so weeks begin on Monday
+        offset = 3 * 86400 if granularity == 'week' else 0
+        first = (_to_epoch(start) + offset) // step * step - offset
+        last = _to_epoch(end)
+        edges = np.arange(first, last + step, step, dtype=np.int64)
+
+    # Drop a trailing edge that lies entirely past `end`
+    end_epoch = _to_epoch(end)
+    if len(edges) > 2 and edges[-2] >= end_epoch:
+        edges = edges[:-1]
+
+    if len(edges) - 1 > MAX_BUCKETS:
+        raise ValueError(f"Range produces more than {MAX_BUCKETS} buckets; use a coarser granularity")
+    return edges
+
+
+def bucket_events(timestamps, edges, keys=None):
+    """
+    Counts events per bucket.
+
+    Parameters:
+    - timestamps: array of event times in epoch seconds.
+    - edges: bucket boundaries from bucket_edges().
+    - keys: optional array (same length as timestamps) to break counts down by.
+
+    Returns a 1-D count array, or (unique_keys, 2-D count array) when keys
+    are given, with one row per key.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    num_buckets = len(edges) - 1
+
+    indices = np.searchsorted(edges, timestamps, side='right') - 1
+    in_range = (indices >= 0) & (indices < num_buckets)
+    indices = indices[in_range]
+
+    if keys is None:
+        return np.bincount(indices, minlength=num_buckets)
+
+    keys = np.asarray(keys)[in_range]
+    unique_keys, key_indices = np.unique(keys, return_inverse=True)
+    flat = np.bincount(key_indices * num_buckets + indices, minlength=len(unique_keys) * num_buckets)
+    return unique_keys, flat.reshape(len(unique_keys), num_buckets)
+
+
+def fetch_event_timestamps(source, start, end, breakdown=None, user_id=None):
+    """
+    Fetches compact arrays of event timestamps (and breakdown keys) in a
+    single query per shard. Returns (timestamps, keys); keys is None without
+    breakdown.
+    """
+    from sqlalchemy import Integer, cast, func, select
+    import models
+    from read_routing import read_session
+    import sharding
+
+    model_name, time_attr, user_attr, type_attr = EVENT_SOURCES[source]
+    table = getattr(models, model_name).__table__
+    time_column = table.c[time_attr]
+
+    columns = [cast(func.strftime('%s', time_column), Integer)]
+    if breakdown == 'user':
+        columns.append(table.c[user_attr])
+    elif breakdown == 'type':
+        if type_attr is None:
+            raise ValueError(f"Source '{source}' has no type to break down by")
+        columns.append(table.c[type_attr])
+    elif breakdown is not None:
+        raise ValueError(f"Unknown breakdown '{breakdown}'")
+
+    query = select(*columns).where(time_column >= start, time_column < end)
+    if user_id is not None:
+        query = query.where(table.c[user_attr] == user_id)
+
+    if table.name == 'notifications' and user_id is not None:
+        rows = sharding.execute_on_shard(sharding.get_shard_map().shard_for_user(user_id), query)
+    elif table.name in sharding.SHARDED_TABLES:
+        rows = sharding.scatter(query)
+    else:
+        rows = read_session().execute(query).fetchall()
+    timestamps = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+    if breakdown is None:
+        return timestamps, None
+    if breakdown == 'user':
+        keys = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+    else:
+        keys = np.array([row[1] or '' for row in rows], dtype=str)
+    return timestamps, keys
+
+
+def event_histogram(source, start, end, granularity='day', breakdown=None, user_id=None):
+    """
+    Builds a time-bucketed histogram of events.
+
+    Parameters:
+    - source: one of EVENT_SOURCES ('messages', 'notifications', 'flags', 'activity').
+    - start, end: naive UTC datetimes bounding the range [start, end).
+    - granularity: one of GRANULARITIES ('minute' ... 'month').
+    - breakdown: None, 'user' or 'type' to split counts into one series per key.
+    - user_id: optionally restrict to a single user's events.
+    """
+    if source not in EVENT_SOURCES:
+        raise ValueError(f"Unknown source '{source}'")
+
+    edges = bucket_edges(start, end, granularity)
+    timestamps, keys = fetch_event_timestamps(source, start, end, breakdown, user_id)
+    labels = [
+        datetime.fromtimestamp(int(edge), tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%S')
+        for edge in edges[:-1]
+    ]
+
+    result = {"source": source, "granularity": granularity, "labels": labels}
+    if breakdown is None:
+        result["counts"] = bucket_events(timestamps, edges).tolist()
+    else:
+        unique_keys, counts = bucket_events(timestamps, edges, keys)
+        result["series"] = {str(key): row.tolist() for key, row in zip(unique_keys.tolist(), counts)}
+    return result
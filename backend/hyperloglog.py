@@ -0,0 +1,115 @@
+import hashlib
+import math
+import zlib
+
+
+# Default precision: 2**12 registers, ~1.6% standard error, 4 KB uncompressed
+DEFAULT_PRECISION = 12
+
+# Blob header: format version followed by the precision
+SKETCH_FORMAT_VERSION = 1
+
+
+def _hash64(value):
+    """
+    Returns a stable 64-bit hash of a value.
+    Python's built-in hash() is salted per process, so it cannot be used
+    for sketches that are persisted and merged across workers.
+    """
+    digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+
+class HyperLogLog:
+    """
+    HyperLogLog sketch for approximate distinct counts.
+
+    Sketches with the same precision can be merged (register-wise max), so a
+    count over any range of days is the count of the merged daily sketches.
+    """
+
+    def __init__(self, precision=DEFAULT_PRECISION, registers=None):
+        if not 4 <= precision <= 16:
+            raise ValueError("precision must be between 4 and 16")
+        self.precision = precision
+        self.num_registers = 1 << precision
+        if registers is None:
+            registers = bytearray(self.num_registers)
+        elif len(registers) != self.num_registers:
+            raise ValueError("register count does not match precision")
+        self.registers = bytearray(registers)
+
+    def add(self, value):
+        """Adds a value to the sketch."""
+        hashed = _hash64(value)
+        index = hashed >> (64 - self.precision)
+        remaining_bits = 64 - self.precision
+        remainder = hashed & ((1 << remaining_bits) - 1)
+        # Position of the leftmost 1-bit in the remaining bits
+        rank = remaining_bits - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        """Merges another sketch into this one in place."""
+        if other.precision != self.precision:
+            raise ValueError("cannot merge sketches with different precision")
+        self.registers = bytearray(map(max, self.registers, other.registers))
+        return self
+
+    def copy(self):
+        return HyperLogLog(self.precision, self.registers)
+
+    def is_empty(self):
+        return not any(self.registers)
+
+    def count(self):
+        """Returns the estimated number of distinct values added."""
+        m = self.num_registers
+        if m == 16:
+            alpha = 0.673
+        elif m == 32:
+            alpha = 0.697
+        elif m == 64:
+            alpha = 0.709
+        else:
+            alpha = 0.7213 / (1 + 1.079 / m)
+
+        harmonic_sum = sum(2.0 ** -r for r in self.registers)
+        estimate = alpha * m * m / harmonic_sum
+
+        # Small range correction: linear counting while registers are sparse
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+
+        return int(round(estimate))
+
+    def to_bytes(self):
+        """Serializes the sketch to a compact, compressed blob."""
+        header = bytes([SKETCH_FORMAT_VERSION, self.precision])
+        return header + zlib.compress(bytes(self.registers), 6)
+
+    @classmethod
+    def from_bytes(cls, blob):
+        """Deserializes a sketch produced by to_bytes()."""
+        if not blob or len(blob) < 2:
+            raise ValueError("invalid sketch blob")
+        version, precision = blob[0], blob[1]
+        if version != SKETCH_FORMAT_VERSION:
+            raise ValueError(f"unsupported sketch format version {version}")
+        return cls(precision, zlib.decompress(blob[2:]))
+
+    @classmethod
+    def union(cls, sketches, precision=DEFAULT_PRECISION):
+        """Returns a new sketch that is the union of the given sketches."""
+        result = cls(precision)
+        for sketch in sketches:
+            result.merge(sketch)
+        return result
+
+    def __len__(self):
+        return self.count()
+
+    def __repr__(self):
+        return f"<HyperLogLog p={self.precision} ~{self.count()}>"
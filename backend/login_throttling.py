@@ -0,0 +1,225 @@
+from collections import Counter, OrderedDict, deque
+import logging
+import math
+import threading
+import time
+
+from sqlalchemy import delete, select
+from sqlalchemy.exc import SQLAlchemyError
+
+from db_engines import engines
+from db_retry import retry_on_lock
+from models import LoginFailure
+from scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_WINDOW_SECONDS = 900     # LOGIN_THROTTLE_WINDOW_SECONDS: failures older than this are forgotten
+DEFAULT_ACCOUNT_LIMIT = 10       # LOGIN_THROTTLE_ACCOUNT_LIMIT: failures per account and window before a lockout
+DEFAULT_IP_LIMIT = 100           # LOGIN_THROTTLE_IP_LIMIT: failures per client IP and window before a lockout
+DEFAULT_FREE_FAILURES = 3        # LOGIN_THROTTLE_FREE_FAILURES: failures per account before delays start
+DEFAULT_MAX_DELAY_SECONDS = 60   # LOGIN_THROTTLE_MAX_DELAY: delays double from 1 s up to this
+DEFAULT_SYNC_SECONDS = 5         # LOGIN_THROTTLE_SYNC_SECONDS: how often a key re-reads other workers' failures
+DEFAULT_MAX_KEYS = 100000        # keys tracked in memory (least recently used are dropped)
+
+
+def account_key(scope, identifier):
+    """Throttle key of an account for one flow, e.g. account_key('login', username)."""
+    return f"{scope}:{(identifier or '').strip().casefold()}"
+
+
+def ip_key(address):
+    return f"ip:{address or 'unknown'}"
+
+
+class LoginThrottle:
+    """
+    Sliding-window counters of failed sign-in attempts per account and per
+    client IP. Each process keeps the recent failure times of a key in
+    memory and re-reads the login_failures table (shared by all workers)
+    at most every LOGIN_THROTTLE_SYNC_SECONDS; if the table cannot be read
+    or written, the in-memory counters keep working alone.
+
+    An account gets LOGIN_THROTTLE_FREE_FAILURES failures, then must wait
+    1, 2, 4... seconds (up to LOGIN_THROTTLE_MAX_DELAY) after each failure,
+    and is locked out once it reaches its limit within the window. Check
+    before verifying any password, so throttled attempts cost no hashing.
+    """
+
+    def __init__(self):
+        self.window = DEFAULT_WINDOW_SECONDS
+        self.account_limit = DEFAULT_ACCOUNT_LIMIT
+        self.ip_limit = DEFAULT_IP_LIMIT
+        self.free_failures = DEFAULT_FREE_FAILURES
+        self.max_delay = DEFAULT_MAX_DELAY_SECONDS
+        self.sync_seconds = DEFAULT_SYNC_SECONDS
+        self.max_keys = DEFAULT_MAX_KEYS
+        self._failures = OrderedDict()  # key -> (deque of failure times, monotonic time of the last sync)
+        self._lock = threading.Lock()
+        self.metrics = {
+            "checks": 0,
+            "delayed": 0,
+            "locked_out": 0,
+            "failures": 0,
+            "successes": 0,
+            "store_errors": 0,
+        }
+
+    def init_app(self, app):
+        self.window = app.config.get('LOGIN_THROTTLE_WINDOW_SECONDS', DEFAULT_WINDOW_SECONDS)
+        self.account_limit = app.config.get('LOGIN_THROTTLE_ACCOUNT_LIMIT', DEFAULT_ACCOUNT_LIMIT)
+        self.ip_limit = app.config.get('LOGIN_THROTTLE_IP_LIMIT', DEFAULT_IP_LIMIT)
+        self.free_failures = app.config.get('LOGIN_THROTTLE_FREE_FAILURES', DEFAULT_FREE_FAILURES)
+        self.max_delay = app.config.get('LOGIN_THROTTLE_MAX_DELAY', DEFAULT_MAX_DELAY_SECONDS)
+        self.sync_seconds = app.config.get('LOGIN_THROTTLE_SYNC_SECONDS', DEFAULT_SYNC_SECONDS)
+        self.clear()
+
+    def _limit(self, key):
+        return self.ip_limit if key.startswith('ip:') else self.account_limit
+
+    def _count(self, name):
+        with self._lock:
+            self.metrics[name] += 1
+
+    def _store_error(self, action, error):
+        self._count("store_errors")
+        logger.warning(f"Login throttle could not {action} the shared store, using memory only: {str(error)}")
+
+    def _load(self, key, now):
+        # Only the most recent `limit` failures matter for both the delay and the lockout
+        table = LoginFailure.__table__
+        with engines.get_engine().connect() as connection:
+            rows = connection.execute(
+                select(table.c.failed_at)
+                .where(table.c.throttle_key == key, table.c.failed_at > now - self.window)
+                .order_by(table.c.failed_at.desc())
+                .limit(self._limit(key))
+            ).fetchall()
+        return [row.failed_at for row in rows]
+
+    def _recent_failures(self, key, now):
+        """Failure times of `key` within the window, oldest first."""
+        with self._lock:
+            entry = self._failures.get(key)
+            if entry is not None:
+                self._failures.move_to_end(key)
+        if entry is None or time.monotonic() - entry[1] > self.sync_seconds:
+            try:
+                stored = self._load(key, now)
+            except SQLAlchemyError as e:
+                self._store_error("read", e)
+                stored = []
+            with self._lock:
+                # Union of both views, keeping failures that share a timestamp (and any the store missed)
+                current = self._failures.get(key, (deque(),))[0]
+                merged = sorted((Counter(current) | Counter(stored)).elements())
+                merged = deque(merged[-self._limit(key):], maxlen=self._limit(key))
+                entry = self._failures[key] = (merged, time.monotonic())
+                self._failures.move_to_end(key)
+                while len(self._failures) > self.max_keys:
+                    self._failures.popitem(last=False)
+        with self._lock:
+            return [failed_at for failed_at in entry[0] if failed_at > now - self.window]
+
+    def _wait(self, key, now):
+        """Seconds until `key` may try again, and whether that is a lockout."""
+        failures = self._recent_failures(key, now)
+        limit = self._limit(key)
+        if len(failures) >= limit:
+            # Sliding window: unlocked once enough failures have aged out
+            return failures[-limit] + self.window - now, True
+        if not key.startswith('ip:') and len(failures) >= self.free_failures:
+            delay = min(2 ** (len(failures) - self.free_failures), self.max_delay)
+            return failures[-1] + delay - now, False
+        return 0, False
+
+    def retry_after(self, *keys):
+        """
+        Returns 0 if an attempt on these keys may go ahead, else the whole
+        number of seconds to wait before trying again.
+        """
+        now = time.time()
+        self._count("checks")
+        wait, locked_out = 0, False
+        for key in keys:
+            key_wait, key_locked_out = self._wait(key, now)
+            if key_wait > wait:
+                wait, locked_out = key_wait, key_locked_out
+        if wait <= 0:
+            return 0
+        self._count("locked_out" if locked_out else "delayed")
+        return math.ceil(wait)
+
+    def record_failure(self, *keys):
+        """Counts a failed attempt against every key."""
+        now = time.time()
+        self._count("failures")
+        with self._lock:
+            for key in keys:
+                if key not in self._failures:
+                    # Unknown here: sync on the next check rather than trusting this one failure
+                    self._failures[key] = (deque(maxlen=self._limit(key)), float('-inf'))
+                self._failures[key][0].append(now)
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+        @retry_on_lock(rollback_session=False)
+        def store():
+            with engines.get_engine().begin() as connection:
+                connection.execute(LoginFailure.__table__.insert(), [
+                    {'throttle_key': key, 'failed_at': now} for key in keys
+                ])
+
+        try:
+            store()
+        except SQLAlchemyError as e:
+            self._store_error("write", e)
+
+    def record_success(self, key):
+        """Forgets an account's failures after a successful sign-in (client IP counters are kept)."""
+        self._count("successes")
+        with self._lock:
+            self._failures.pop(key, None)
+        table = LoginFailure.__table__
+
+        @retry_on_lock(rollback_session=False)
+        def forget():
+            with engines.get_engine().begin() as connection:
+                connection.execute(delete(table).where(table.c.throttle_key == key))
+
+        try:
+            forget()
+        except SQLAlchemyError as e:
+            self._store_error("write", e)
+
+    def clear(self):
+        with self._lock:
+            self._failures.clear()
+
+    def get_metrics(self):
+        with self._lock:
+            return dict(self.metrics, tracked_keys=len(self._failures), window=self.window)
+
+
+# Shared throttle; configured by login_throttle.init_app(app)
+login_throttle = LoginThrottle()
+
+
+def sweep_login_failures():
+    """Deletes failures that have left the window; returns how many."""
+    table = LoginFailure.__table__
+    with engines.get_engine().begin() as connection:
+        count = connection.execute(
+            delete(table).where(table.c.failed_at <= time.time() - login_throttle.window)
+        ).rowcount
+    if count:
+        logger.info(f"Swept {count} expired login failures")
+    return count
+
+
+@scheduler.job('sweep-login-failures', interval=900, timeout=300)
+def sweep_login_failures_job():
+    """Keeps the login_failures table down to the current window."""
+    sweep_login_failures()
@@ -0,0 +1,342 @@
+from collections import OrderedDict, defaultdict, namedtuple
+from datetime import datetime, timedelta
+import logging
+import os
+import threading
+import zlib
+
+from flask import current_app
+from sqlalchemy import (
+    Boolean, Column, DateTime, Index, Integer, LargeBinary, MetaData, Table, and_, delete, func, insert,
+    inspect, or_, select, update,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db_engines import engines, sqlite_incremental_vacuum
+from models import Message, MessageArchiveConversation, MessageArchivePartition
+from scheduler import scheduler
+import sharding
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_ARCHIVE_AFTER_DAYS = 180   # MESSAGE_ARCHIVE_AFTER_DAYS
+DEFAULT_ARCHIVE_BATCH_SIZE = 1000
+MAX_OPEN_PARTITIONS = 8            # archive files kept open for reads
+
+_INSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+# Schema of each monthly archive file; content is stored zlib-compressed
+archive_metadata = MetaData()
+archived_messages = Table(
+    'archived_messages', archive_metadata,
+    Column('id', Integer, primary_key=True),
+    Column('sender_id', Integer, nullable=False),
+    Column('receiver_id', Integer, nullable=True),
+    Column('created_at', DateTime, nullable=False),
+    Column('deleted', Boolean, default=False),
+    Column('deleted_at', DateTime, nullable=True),
+    Column('content_z', LargeBinary, nullable=False),
+    Index('ix_archived_messages_conversation', 'sender_id', 'receiver_id', 'created_at'),
+)
+
+# Archived rows have the same fields as rows of the hot messages table
+ArchivedMessage = namedtuple('ArchivedMessage', ['id', 'sender_id', 'receiver_id', 'content', 'created_at', 'deleted'])
+
+_partition_engines = OrderedDict()
+_partition_engines_lock = threading.Lock()
+
+
+def archive_dir(app=None):
+    app = app or current_app
+    return app.config.get('MESSAGE_ARCHIVE_DIR') or os.path.join(app.instance_path, 'message_archive')
+
+
+def partition_path(month):
+    return os.path.join(archive_dir(), f"messages-{month}.db")
+
+
+def _partition_engine(path):
+    """Returns an engine for an archive file, keeping the most recently used few open."""
+    with _partition_engines_lock:
+        engine = _partition_engines.get(path)
+        if engine is not None:
+            _partition_engines.move_to_end(path)
+            return engine
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        engine = engines.create_engine(current_app._get_current_object(), f"sqlite:///{path}")
+        archive_metadata.create_all(engine)
+        _upgrade_partition(engine)
+        _partition_engines[path] = engine
+        if len(_partition_engines) > MAX_OPEN_PARTITIONS:
+            _, evicted = _partition_engines.popitem(last=False)
+            evicted.dispose()
+        return engine
+
+
+def _upgrade_partition(engine):
+    # Archive files are not migrated by Alembic: add columns newer than the file on first open
+    with engine.begin() as connection:
+        columns = {column['name'] for column in inspect(connection).get_columns('archived_messages')}
+        if 'deleted_at' not in columns:
+            connection.exec_driver_sql("ALTER TABLE archived_messages ADD COLUMN deleted_at DATETIME")
+
+
+def _decode(row):
+    return ArchivedMessage(
+        row.id, row.sender_id, row.receiver_id, zlib.decompress(row.content_z).decode('utf-8'),
+        row.created_at, row.deleted,
+    )
+
+
+def _conversation_keys(pairs):
+    return {sharding.conversation_key(sender_id, receiver_id) for sender_id, receiver_id in pairs
+            if receiver_id is not None}
+
+
+def _update_manifest(month, path, connection, conversation_keys=()):
+    """
+    Refreshes a partition's manifest entry from the archive file itself,
+    and records the conversations of the rows just added. A file not yet
+    indexed (new, or archived before conversations were indexed) has all
+    of its conversations recorded once.
+    """
+    count, min_id, max_id, min_created, max_created = connection.execute(
+        select(
+            func.count(), func.min(archived_messages.c.id), func.max(archived_messages.c.id),
+            func.min(archived_messages.c.created_at), func.max(archived_messages.c.created_at),
+        )
+    ).fetchone()
+    values = {
+        'path': path, 'row_count': count, 'min_message_id': min_id, 'max_message_id': max_id,
+        'min_created_at': min_created, 'max_created_at': max_created, 'conversations_indexed': True,
+        'updated_at': datetime.utcnow(),
+    }
+    table = MessageArchivePartition.__table__
+    conversations = MessageArchiveConversation.__table__
+    with engines.get_engine().begin() as primary:
+        indexed = primary.execute(select(table.c.conversations_indexed).where(table.c.month == month)).scalar()
+        if not indexed:
+            conversation_keys = _conversation_keys(connection.execute(
+                select(archived_messages.c.sender_id, archived_messages.c.receiver_id).distinct()
+            ))
+        if conversation_keys:
+            primary.execute(
+                _INSERTS[primary.dialect.name](conversations).on_conflict_do_nothing(),
+                [{'conversation_key': key, 'month': month} for key in conversation_keys],
+            )
+        if primary.execute(update(table).where(table.c.month == month).values(**values)).rowcount == 0:
+            primary.execute(insert(table).values(month=month, **values))
+
+
+def _append_to_partition(month, rows):
+    path = partition_path(month)
+    with _partition_engine(path).begin() as connection:
+        # OR IGNORE: a batch copied before a crash is not duplicated when the job reruns
+        connection.execute(
+            archived_messages.insert().prefix_with('OR IGNORE'),
+            [{
+                'id': row['id'],
+                'sender_id': row['sender_id'],
+                'receiver_id': row['receiver_id'],
+                'created_at': row['created_at'],
+                'deleted': row['deleted'],
+                'content_z': zlib.compress(row['content'].encode('utf-8')),
+            } for row in rows]
+        )
+        _update_manifest(month, path, connection,
+                         _conversation_keys((row['sender_id'], row['receiver_id']) for row in rows))
+
+
+def archive_messages(older_than_days=None, batch_size=DEFAULT_ARCHIVE_BATCH_SIZE):
+    """
+    Moves messages older than the threshold from every shard into monthly
+    archive files, copying each batch before deleting it from the hot
+    table. Returns the number of messages archived.
+    """
+    if older_than_days is None:
+        older_than_days = current_app.config.get('MESSAGE_ARCHIVE_AFTER_DAYS', DEFAULT_ARCHIVE_AFTER_DAYS)
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    messages = Message.__table__
+    archived = 0
+    for index in range(sharding.get_shard_map().num_shards):
+        engine = sharding.shard_engine(index)
+        while True:
+            with engine.connect() as connection:
+                batch = connection.execute(
+                    # Soft-deleted messages are left for message_compaction to purge
+                    # Group messages are not archived: their pages and unread counts read the hot table
+                    select(messages)
+                    .where(messages.c.created_at < cutoff, messages.c.deleted.isnot(True),
+                           messages.c.group_id.is_(None))
+                    .order_by(messages.c.id)
+                    .limit(batch_size)
+                ).mappings().all()
+            if not batch:
+                break
+            by_month = defaultdict(list)
+            for row in batch:
+                by_month[row['created_at'].strftime('%Y-%m')].append(row)
+            for month, rows in by_month.items():
+                _append_to_partition(month, rows)
+            with engine.begin() as connection:
+                connection.execute(delete(messages).where(messages.c.id.in_([row['id'] for row in batch])))
+            archived += len(batch)
+    if archived:
+        logger.info(f"Archived {archived} messages older than {cutoff:%Y-%m-%d}")
+    return archived
+
+
+@scheduler.job('archive-old-messages', cron='30 2 * * *', timeout=3600)
+def archive_old_messages():
+    """Nightly move of old messages into cold storage."""
+    archive_messages()
+    index_archived_conversations()
+
+
+def index_archived_conversations():
+    """Records the conversations of archive files archived before they were indexed; returns how many files."""
+    table = MessageArchivePartition.__table__
+    with engines.get_engine().connect() as primary:
+        unindexed = primary.execute(
+            select(table.c.month, table.c.path).where(table.c.conversations_indexed.isnot(True))
+        ).fetchall()
+    for month, path in unindexed:
+        with _partition_engine(path).connect() as connection:
+            _update_manifest(month, path, connection)
+    return len(unindexed)
+
+
+def list_partitions(before=None, conversation=None):
+    """
+    Manifest entries, newest month first; with `before`, only months holding
+    older messages, and with `conversation` (a sharding.conversation_key),
+    only months holding that conversation.
+    """
+    from read_routing import read_session
+
+    table = MessageArchivePartition.__table__
+    query = select(table).order_by(table.c.month.desc())
+    if before is not None:
+        query = query.where(table.c.min_created_at < before)
+    if conversation is not None:
+        conversations = MessageArchiveConversation.__table__
+        query = query.where(or_(
+            table.c.conversations_indexed.isnot(True),
+            table.c.month.in_(
+                select(conversations.c.month).where(conversations.c.conversation_key == conversation)
+            ),
+        ))
+    return read_session().execute(query).fetchall()
+
+
+def count_archived_messages():
+    from read_routing import read_session
+
+    table = MessageArchivePartition.__table__
+    return read_session().execute(select(func.coalesce(func.sum(table.c.row_count), 0))).scalar()
+
+
+def get_archived_conversation(user_a, user_b, limit=50, before=None):
+    """
+    Returns archived messages between two users, newest first, reading
+    month files from newest to oldest only until `limit` is reached. Only
+    files the manifest lists for the conversation are opened, so most
+    conversations (with no archived history) open none.
+    """
+    results = []
+    for partition in list_partitions(before, conversation=sharding.conversation_key(user_a, user_b)):
+        query = (
+            select(archived_messages)
+            .where(
+                or_(
+                    and_(archived_messages.c.sender_id == user_a, archived_messages.c.receiver_id == user_b),
+                    and_(archived_messages.c.sender_id == user_b, archived_messages.c.receiver_id == user_a),
+                ),
+                archived_messages.c.deleted == False,
+            )
+            .order_by(archived_messages.c.created_at.desc())
+            .limit(limit - len(results))
+        )
+        if before is not None:
+            query = query.where(archived_messages.c.created_at < before)
+        with _partition_engine(partition.path).connect() as connection:
+            results.extend(_decode(row) for row in connection.execute(query))
+        if len(results) >= limit:
+            break
+    return results
+
+
+def _partition_for_id(message_id):
+    for partition in list_partitions():
+        if partition.min_message_id is not None and partition.min_message_id <= message_id <= partition.max_message_id:
+            return partition
+    return None
+
+
+def delete_archived_message(message_id):
+    """Soft-deletes an archived message; returns True if it was found and not already deleted."""
+    partition = _partition_for_id(message_id)
+    if partition is None:
+        return False
+    with _partition_engine(partition.path).begin() as connection:
+        return connection.execute(
+            update(archived_messages)
+            .where(archived_messages.c.id == message_id, archived_messages.c.deleted.isnot(True))
+            .values(deleted=True, deleted_at=datetime.utcnow())
+        ).rowcount > 0
+
+
+def purge_deleted_messages(before_delete=None, batch_size=DEFAULT_ARCHIVE_BATCH_SIZE, cutoff=None):
+    """
+    Hard-deletes archived messages soft-deleted before `cutoff` (all of
+    them if None) in batches, calling `before_delete(ids)` first so
+    references to them can be removed, then vacuums each file that shrank.
+    Returns the number of messages purged.
+    """
+    purgeable = archived_messages.c.deleted == True
+    if cutoff is not None:
+        # Rows deleted before deleted_at was recorded have no time, so they count as old
+        purgeable = and_(purgeable, or_(archived_messages.c.deleted_at < cutoff,
+                                        archived_messages.c.deleted_at.is_(None)))
+    purged = 0
+    for partition in list_partitions():
+        engine = _partition_engine(partition.path)
+        purged_here = 0
+        while True:
+            with engine.connect() as connection:
+                ids = connection.execute(
+                    select(archived_messages.c.id).where(purgeable).limit(batch_size)
+                ).scalars().all()
+            if not ids:
+                break
+            if before_delete is not None:
+                before_delete(ids)
+            with engine.begin() as connection:
+                connection.execute(delete(archived_messages).where(archived_messages.c.id.in_(ids)))
+                _update_manifest(partition.month, partition.path, connection)
+            purged_here += len(ids)
+        if purged_here:
+            sqlite_incremental_vacuum(engine)
+            purged += purged_here
+    return purged
+
+
+def get_archived_messages(message_ids):
+    """Returns {id: ArchivedMessage} for ids found in the archive."""
+    remaining = set(message_ids)
+    found = {}
+    for partition in list_partitions():
+        if not remaining:
+            break
+        candidates = [
+            message_id for message_id in remaining
+            if partition.min_message_id is not None and partition.min_message_id <= message_id <= partition.max_message_id
+        ]
+        if not candidates:
+            continue
+        with _partition_engine(partition.path).connect() as connection:
+            for row in connection.execute(select(archived_messages).where(archived_messages.c.id.in_(candidates))):
+                found[row.id] = _decode(row)
+        remaining -= set(found)
+    return found
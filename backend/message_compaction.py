@@ -0,0 +1,81 @@
+from datetime import datetime, timedelta
+import logging
+
+from flask import current_app
+from sqlalchemy import delete, or_, select
+
+from db_engines import engines, sqlite_incremental_vacuum
+import message_archive
+from models import FlaggedContent, Message
+from scheduler import scheduler
+import sharding
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_PURGE_AFTER_HOURS = 24   # MESSAGE_PURGE_AFTER_HOURS: how long soft-deleted messages are kept
+DEFAULT_PURGE_BATCH_SIZE = 500
+
+
+def _delete_references(message_ids):
+    """Removes rows on the primary database that point at messages about to be purged."""
+    flags = FlaggedContent.__table__
+    with engines.get_engine().begin() as connection:
+        connection.execute(delete(flags).where(flags.c.message_id.in_(message_ids)))
+
+
+def _purge_shard(index, cutoff, batch_size):
+    messages = Message.__table__
+    engine = sharding.shard_engine(index)
+    purged = 0
+    while True:
+        with engine.connect() as connection:
+            ids = connection.execute(
+                select(messages.c.id)
+                .where(
+                    messages.c.deleted == True,
+                    or_(messages.c.deleted_at < cutoff, messages.c.deleted_at.is_(None)),
+                )
+                .order_by(messages.c.id)
+                .limit(batch_size)
+            ).scalars().all()
+        if not ids:
+            return purged
+        # References go first: a crash in between leaves soft-deleted rows for the next run
+        _delete_references(ids)
+        with engine.begin() as connection:
+            connection.execute(delete(messages).where(messages.c.id.in_(ids), messages.c.deleted == True))
+        purged += len(ids)
+
+
+def purge_deleted_messages(older_than_hours=None, batch_size=DEFAULT_PURGE_BATCH_SIZE):
+    """
+    Hard-deletes messages soft-deleted more than `older_than_hours` ago from
+    every shard and archive file, one bounded batch per transaction, along
+    with the flags that point at them, then returns the freed pages to the
+    filesystem. Returns the number of messages purged.
+    """
+    if older_than_hours is None:
+        older_than_hours = current_app.config.get('MESSAGE_PURGE_AFTER_HOURS', DEFAULT_PURGE_AFTER_HOURS)
+    cutoff = datetime.utcnow() - timedelta(hours=older_than_hours)
+
+    purged = 0
+    vacuum = {engines.get_engine()}
+    for index in range(sharding.get_shard_map().num_shards):
+        shard_purged = _purge_shard(index, cutoff, batch_size)
+        if shard_purged:
+            vacuum.add(sharding.shard_engine(index))
+            purged += shard_purged
+    purged += message_archive.purge_deleted_messages(_delete_references, batch_size, cutoff=cutoff)
+
+    if purged:
+        for engine in vacuum:
+            sqlite_incremental_vacuum(engine)
+        logger.info(f"Purged {purged} deleted messages")
+    return purged
+
+
+@scheduler.job('purge-deleted-messages', interval=3600, timeout=1800)
+def purge_deleted_messages_job():
+    """Hourly hard delete of soft-deleted messages, off the request path."""
+    purge_deleted_messages()
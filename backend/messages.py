@@ -0,0 +1,94 @@
+from datetime import datetime
+import logging
+
+from sqlalchemy import and_, or_, select, update
+
+from active_users import record_active_user
+from db_retry import retry_on_lock
+import message_archive
+from models import Message
+import sharding
+
+logger = logging.getLogger(__name__)
+
+
+@retry_on_lock(rollback_session=False)
+def store_message(sender_id, receiver_id, content):
+    """
+    Stores a message on its conversation's shard and returns its id.
+    Both directions of a conversation live on the same shard.
+    """
+    message_id = sharding.insert_row('messages', {
+        'sender_id': sender_id,
+        'receiver_id': receiver_id,
+        'content': content,
+        'created_at': datetime.utcnow(),
+        'deleted': False,
+    })
+    record_active_user(sender_id)
+    return message_id
+
+
+def get_message(message_id):
+    """Returns the message row with this id (archived or not), or None."""
+    return get_messages([message_id]).get(message_id)
+
+
+def get_messages(message_ids):
+    """
+    Returns {id: message row} for the given ids, with one query per shard;
+    ids not in the hot table are looked up in the archive.
+    """
+    found = sharding.get_rows_by_id('messages', message_ids)
+    missing = set(message_ids) - set(found)
+    if missing:
+        found.update(message_archive.get_archived_messages(missing))
+    return found
+
+
+def get_conversation(user_a, user_b, limit=50, before=None):
+    """
+    Returns the latest messages between two users, newest first (only those
+    sent before `before`, if given, for paging back). Once the hot table
+    runs out, older pages are read from the monthly archive.
+    """
+    messages = Message.__table__
+    query = (
+        select(messages)
+        .where(
+            or_(
+                and_(messages.c.sender_id == user_a, messages.c.receiver_id == user_b),
+                and_(messages.c.sender_id == user_b, messages.c.receiver_id == user_a),
+            ),
+            messages.c.deleted == False,
+        )
+        .order_by(messages.c.created_at.desc())
+        .limit(limit)
+    )
+    if before is not None:
+        query = query.where(messages.c.created_at < before)
+    rows = sharding.execute_on_shard(sharding.get_shard_map().shard_for_conversation(user_a, user_b), query)
+    if len(rows) < limit:
+        oldest = rows[-1].created_at if rows else before
+        rows += message_archive.get_archived_conversation(user_a, user_b, limit - len(rows), before=oldest)
+    return rows
+
+
+@retry_on_lock(rollback_session=False)
+def remove_message(message_id):
+    """
+    Soft-deletes a message with a single UPDATE on its shard (or in its
+    archive file); message_compaction purges it later. Returns True if the
+    message existed and was not already deleted.
+    """
+    index = sharding.get_shard_map().shard_for_id(message_id)
+    if index is not None:
+        messages = Message.__table__
+        statement = (
+            update(messages)
+            .where(messages.c.id == message_id, messages.c.deleted.isnot(True))
+            .values(deleted=True, deleted_at=datetime.utcnow())
+        )
+        if sharding.execute_write(index, statement):
+            return True
+    return message_archive.delete_archived_message(message_id)
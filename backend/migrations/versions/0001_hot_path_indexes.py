@@ -0,0 +1,104 @@
+"""Add indexes for hot query paths
+
+Adds users.last_login (read by login and analytics but never declared),
+the active_user_sketches and job_leases tables, and composite/partial
+indexes on every column the hot queries filter or sort by.
+
+Databases created with db.create_all() may already have some of these
+objects, so each step checks before creating.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+
+# (name, table, columns, partial WHERE clause for SQLite, for PostgreSQL)
+INDEXES = [
+    ('ix_users_last_login', 'users', ['last_login'], None, None),
+    ('ix_users_suspended_until', 'users', ['suspended_until'],
+     'suspended_until IS NOT NULL', 'suspended_until IS NOT NULL'),
+    ('ix_messages_sender_receiver_created', 'messages', ['sender_id', 'receiver_id', 'created_at'], None, None),
+    ('ix_messages_receiver_created_live', 'messages', ['receiver_id', 'created_at'],
+     'deleted = 0', 'NOT deleted'),
+    ('ix_messages_created_at', 'messages', ['created_at'], None, None),
+    ('ix_group_membership_group_user', 'group_membership', ['group_id', 'user_id'], None, None),
+    ('ix_flagged_content_reviewed_created', 'flagged_content', ['reviewed', 'created_at'], None, None),
+    ('ix_flagged_content_message_id', 'flagged_content', ['message_id'], None, None),
+    ('ix_activity_logs_user_timestamp', 'activity_logs', ['user_id', 'timestamp'], None, None),
+    ('ix_activity_logs_timestamp', 'activity_logs', ['timestamp'], None, None),
+    ('ix_notifications_user_created', 'notifications', ['user_id', 'created_at'], None, None),
+    ('ix_notifications_unread', 'notifications', ['user_id', 'created_at'], 'is_read = 0', 'NOT is_read'),
+    ('ix_notifications_created_at', 'notifications', ['created_at'], None, None),
+]
+
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+
+def _has_table(table):
+    return _inspector().has_table(table)
+
+
+def _has_column(table, column):
+    return any(c['name'] == column for c in _inspector().get_columns(table))
+
+
+def _has_index(table, name):
+    return any(i['name'] == name for i in _inspector().get_indexes(table))
+
+
+def upgrade():
+    if not _has_column('users', 'last_login'):
+        op.add_column('users', sa.Column('last_login', sa.DateTime(), nullable=True))
+
+    if not _has_table('active_user_sketches'):
+        op.create_table(
+            'active_user_sketches',
+            sa.Column('day', sa.Date(), primary_key=True),
+            sa.Column('sketch', sa.LargeBinary(), nullable=False),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+        )
+
+    if not _has_table('job_leases'):
+        op.create_table(
+            'job_leases',
+            sa.Column('name', sa.String(100), primary_key=True),
+            sa.Column('owner', sa.String(255), nullable=False),
+            sa.Column('expires_at', sa.DateTime(), nullable=False),
+            sa.Column('last_started_at', sa.DateTime(), nullable=True),
+            sa.Column('last_duration_ms', sa.Integer(), nullable=True),
+            sa.Column('last_status', sa.String(20), nullable=True),
+            sa.Column('last_error', sa.Text(), nullable=True),
+            sa.Column('run_count', sa.Integer(), nullable=False, server_default='0'),
+        )
+
+    for name, table, columns, sqlite_where, postgresql_where in INDEXES:
+        if _has_index(table, name):
+            continue
+        kwargs = {}
+        if sqlite_where:
+            kwargs['sqlite_where'] = sa.text(sqlite_where)
+            kwargs['postgresql_where'] = sa.text(postgresql_where)
+        op.create_index(name, table, columns, **kwargs)
+
+
+def downgrade():
+    for name, table, _, _, _ in reversed(INDEXES):
+        if _has_index(table, name):
+            op.drop_index(name, table_name=table)
+    op.drop_table('job_leases')
+    op.drop_table('active_user_sketches')
+    with op.batch_alter_table('users') as batch_op:
+        batch_op.drop_column('last_login')
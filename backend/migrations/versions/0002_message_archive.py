@@ -0,0 +1,43 @@
+"""Add the message archive manifest
+
+Adds message_archive_partitions, which lists the monthly archive files that
+old messages are moved into.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table):
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade():
+    if not _has_table('message_archive_partitions'):
+        op.create_table(
+            'message_archive_partitions',
+            sa.Column('month', sa.String(7), primary_key=True),
+            sa.Column('path', sa.String(255), nullable=False),
+            sa.Column('row_count', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('min_message_id', sa.Integer(), nullable=True),
+            sa.Column('max_message_id', sa.Integer(), nullable=True),
+            sa.Column('min_created_at', sa.DateTime(), nullable=True),
+            sa.Column('max_created_at', sa.DateTime(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+        )
+
+
+def downgrade():
+    if _has_table('message_archive_partitions'):
+        op.drop_table('message_archive_partitions')
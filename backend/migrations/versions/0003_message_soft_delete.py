@@ -0,0 +1,49 @@
+"""Add the soft-delete time of messages
+
+Adds messages.deleted_at, set when a message is soft-deleted, and a partial
+index over deleted rows that the compactor uses to find rows to purge.
+
+Shard databases get the column when their tables are first created; shard
+files created before this revision need the same change applied by hand.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+
+def _has_column(table, column):
+    return any(c['name'] == column for c in _inspector().get_columns(table))
+
+
+def _has_index(table, name):
+    return any(i['name'] == name for i in _inspector().get_indexes(table))
+
+
+def upgrade():
+    if not _has_column('messages', 'deleted_at'):
+        op.add_column('messages', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    if not _has_index('messages', 'ix_messages_deleted_at'):
+        op.create_index('ix_messages_deleted_at', 'messages', ['deleted_at'],
+                        sqlite_where=sa.text('deleted = 1'), postgresql_where=sa.text('deleted'))
+
+
+def downgrade():
+    if _has_index('messages', 'ix_messages_deleted_at'):
+        op.drop_index('ix_messages_deleted_at', table_name='messages')
+    with op.batch_alter_table('messages') as batch_op:
+        batch_op.drop_column('deleted_at')
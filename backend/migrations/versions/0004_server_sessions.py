@@ -0,0 +1,45 @@
+"""Add the server-side session table
+
+Adds sessions, which replaces the filesystem session store: one row per
+session cookie, indexed by expiry for the sweeper and by user for
+revoking a user's sessions.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table):
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade():
+    if _has_table('sessions'):
+        return
+    op.create_table(
+        'sessions',
+        sa.Column('sid', sa.String(64), primary_key=True),
+        sa.Column('user_id', sa.Integer(), nullable=True),
+        sa.Column('data', sa.LargeBinary(), nullable=False),
+        sa.Column('expires_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+    )
+    op.create_index('ix_sessions_user_id', 'sessions', ['user_id'],
+                    sqlite_where=sa.text('user_id IS NOT NULL'), postgresql_where=sa.text('user_id IS NOT NULL'))
+    op.create_index('ix_sessions_expires_at', 'sessions', ['expires_at'])
+
+
+def downgrade():
+    if _has_table('sessions'):
+        op.drop_table('sessions')
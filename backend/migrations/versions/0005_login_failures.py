@@ -0,0 +1,43 @@
+"""Add the login failure table
+
+Adds login_failures, the shared store behind the sign-in throttle: one
+row per failed attempt and throttle key (account or client IP), indexed
+by key and time for the sliding-window lookups and by time for the
+sweeper.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table):
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade():
+    if _has_table('login_failures'):
+        return
+    op.create_table(
+        'login_failures',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('throttle_key', sa.String(255), nullable=False),
+        sa.Column('failed_at', sa.Float(), nullable=False),
+    )
+    op.create_index('ix_login_failures_key_failed_at', 'login_failures', ['throttle_key', 'failed_at'])
+    op.create_index('ix_login_failures_failed_at', 'login_failures', ['failed_at'])
+
+
+def downgrade():
+    if _has_table('login_failures'):
+        op.drop_table('login_failures')
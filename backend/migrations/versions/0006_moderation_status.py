@@ -0,0 +1,70 @@
+"""Model moderation state as an indexed status plus expiry
+
+Adds users.moderation_status (NULL in good standing, 'suspended' or
+'banned') and backfills it from is_banned and suspended_until, clearing
+suspensions that have already run out. The partial index on (status,
+expiry) only holds moderated users; it replaces ix_users_suspended_until
+for the suspension sweeper and the moderation counts.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+
+def _has_column(table, column):
+    return any(c['name'] == column for c in _inspector().get_columns(table))
+
+
+def _has_index(table, name):
+    return any(i['name'] == name for i in _inspector().get_indexes(table))
+
+
+def upgrade():
+    if not _has_column('users', 'moderation_status'):
+        op.add_column('users', sa.Column('moderation_status', sa.String(20), nullable=True))
+
+    op.execute(sa.text(
+        "UPDATE users SET moderation_status = 'banned', suspended_until = NULL WHERE is_banned"
+    ))
+    op.execute(sa.text(
+        "UPDATE users SET moderation_status = 'suspended' "
+        "WHERE moderation_status IS NULL AND suspended_until > CURRENT_TIMESTAMP"
+    ))
+    op.execute(sa.text(
+        "UPDATE users SET suspended_until = NULL "
+        "WHERE moderation_status IS NULL AND suspended_until IS NOT NULL"
+    ))
+
+    if not _has_index('users', 'ix_users_moderation'):
+        op.create_index('ix_users_moderation', 'users', ['moderation_status', 'suspended_until'],
+                        sqlite_where=sa.text('moderation_status IS NOT NULL'),
+                        postgresql_where=sa.text('moderation_status IS NOT NULL'))
+    if _has_index('users', 'ix_users_suspended_until'):
+        op.drop_index('ix_users_suspended_until', table_name='users')
+
+
+def downgrade():
+    if not _has_index('users', 'ix_users_suspended_until'):
+        op.create_index('ix_users_suspended_until', 'users', ['suspended_until'],
+                        sqlite_where=sa.text('suspended_until IS NOT NULL'),
+                        postgresql_where=sa.text('suspended_until IS NOT NULL'))
+    if _has_index('users', 'ix_users_moderation'):
+        op.drop_index('ix_users_moderation', table_name='users')
+    if _has_column('users', 'moderation_status'):
+        with op.batch_alter_table('users') as batch_op:
+            batch_op.drop_column('moderation_status')
@@ -0,0 +1,39 @@
+"""Add the user presence table
+
+Adds user_presence: the last heartbeat of each user, upserted in batches
+by the presence tracker and read for the online status of contacts.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def _has_table(table):
+    return sa.inspect(op.get_bind()).has_table(table)
+
+
+def upgrade():
+    if _has_table('user_presence'):
+        return
+    op.create_table(
+        'user_presence',
+        sa.Column('user_id', sa.Integer(), primary_key=True),
+        sa.Column('last_seen', sa.DateTime(), nullable=False),
+    )
+    op.create_index('ix_user_presence_last_seen', 'user_presence', ['last_seen'])
+
+
+def downgrade():
+    if _has_table('user_presence'):
+        op.drop_table('user_presence')
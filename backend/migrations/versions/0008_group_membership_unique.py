@@ -0,0 +1,45 @@
+"""Make group memberships unique and index them both ways
+
+Removes duplicate (group_id, user_id) rows, keeping the oldest, then
+replaces ix_group_membership_group_user with unique indexes on
+(group_id, user_id) and (user_id, group_id).
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+
+def _has_index(table, name):
+    return any(i['name'] == name for i in sa.inspect(op.get_bind()).get_indexes(table))
+
+
+def upgrade():
+    op.execute(sa.text(
+        "DELETE FROM group_membership WHERE id NOT IN "
+        "(SELECT MIN(id) FROM group_membership GROUP BY group_id, user_id)"
+    ))
+    if not _has_index('group_membership', 'uq_group_membership_group_user'):
+        op.create_index('uq_group_membership_group_user', 'group_membership', ['group_id', 'user_id'], unique=True)
+    if not _has_index('group_membership', 'uq_group_membership_user_group'):
+        op.create_index('uq_group_membership_user_group', 'group_membership', ['user_id', 'group_id'], unique=True)
+    if _has_index('group_membership', 'ix_group_membership_group_user'):
+        op.drop_index('ix_group_membership_group_user', table_name='group_membership')
+
+
+def downgrade():
+    if not _has_index('group_membership', 'ix_group_membership_group_user'):
+        op.create_index('ix_group_membership_group_user', 'group_membership', ['group_id', 'user_id'])
+    for name in ('uq_group_membership_user_group', 'uq_group_membership_group_user'):
+        if _has_index('group_membership', name):
+            op.drop_index(name, table_name='group_membership')
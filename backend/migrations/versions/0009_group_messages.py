@@ -0,0 +1,71 @@
+"""Add group messages and per-member read cursors
+
+Adds messages.group_id (group messages are stored once, on the shard of
+their group, with receiver_id NULL) with a partial (group_id, id) index
+for group pages and unread counts, and group_read_cursors, the
+last-read message id of each member.
+
+Shard databases get the column when their tables are first created; shard
+files created before this revision need the same change applied by hand.
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0009'
+down_revision = '0008'
+branch_labels = None
+depends_on = None
+
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+
+def _has_table(table):
+    return _inspector().has_table(table)
+
+
+def _has_column(table, column):
+    return any(c['name'] == column for c in _inspector().get_columns(table))
+
+
+def _has_index(table, name):
+    return any(i['name'] == name for i in _inspector().get_indexes(table))
+
+
+def upgrade():
+    if not _has_column('messages', 'group_id'):
+        op.add_column('messages', sa.Column('group_id', sa.Integer(), nullable=True))
+    if not _has_index('messages', 'ix_messages_group_id'):
+        op.create_index('ix_messages_group_id', 'messages', ['group_id', 'id'],
+                        sqlite_where=sa.text('group_id IS NOT NULL'),
+                        postgresql_where=sa.text('group_id IS NOT NULL'))
+
+    if not _has_table('group_read_cursors'):
+        op.create_table(
+            'group_read_cursors',
+            sa.Column('user_id', sa.Integer(), primary_key=True),
+            sa.Column('group_id', sa.Integer(), primary_key=True),
+            sa.Column('last_read_message_id', sa.Integer(), nullable=False, server_default='0'),
+            sa.Column('unread_count', sa.Integer(), nullable=True),
+            sa.Column('counted_through_id', sa.Integer(), nullable=True),
+            sa.Column('updated_at', sa.DateTime(), nullable=True),
+        )
+        op.create_index('ix_group_read_cursors_group', 'group_read_cursors', ['group_id'])
+
+
+def downgrade():
+    if _has_table('group_read_cursors'):
+        op.drop_table('group_read_cursors')
+    if _has_index('messages', 'ix_messages_group_id'):
+        op.drop_index('ix_messages_group_id', table_name='messages')
+    if _has_column('messages', 'group_id'):
+        with op.batch_alter_table('messages') as batch_op:
+            batch_op.drop_column('group_id')
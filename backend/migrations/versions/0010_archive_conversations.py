@@ -0,0 +1,54 @@
+"""Index which archive files hold each conversation
+
+Adds message_archive_conversations, the (conversation, month) pairs of the
+monthly archive files, so reading a conversation's history only opens the
+files that hold it. Files archived before this revision are marked
+unindexed (and so still searched) until the archive job indexes them.
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-19 00:00:00
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0010'
+down_revision = '0009'
+branch_labels = None
+depends_on = None
+
+
+def _inspector():
+    return sa.inspect(op.get_bind())
+
+
+def _has_table(table):
+    return _inspector().has_table(table)
+
+
+def _has_column(table, column):
+    return any(c['name'] == column for c in _inspector().get_columns(table))
+
+
+def upgrade():
+    if not _has_column('message_archive_partitions', 'conversations_indexed'):
+        op.add_column('message_archive_partitions', sa.Column(
+            'conversations_indexed', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+    if not _has_table('message_archive_conversations'):
+        op.create_table(
+            'message_archive_conversations',
+            sa.Column('conversation_key', sa.String(41), primary_key=True),
+            sa.Column('month', sa.String(7), primary_key=True),
+        )
+
+
+def downgrade():
+    if _has_table('message_archive_conversations'):
+        op.drop_table('message_archive_conversations')
+    if _has_column('message_archive_partitions', 'conversations_indexed'):
+        with op.batch_alter_table('message_archive_partitions') as batch_op:
+            batch_op.drop_column('conversations_indexed')
@@ -18,17 +18,32 @@ class User(db.Model):
     security_answer_hash = db.Column(db.String(255), nullable=False)
     role = db.Column(db.String(20), default='user')  # 'user' or 'admin'
     is_banned = db.Column(db.Boolean, default=False)
+    moderation_status = db.Column(db.String(20), nullable=True)  # None, 'suspended' or 'banned'
     suspended_until = db.Column(db.DateTime, nullable=True)
+    last_login = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_users_last_login', 'last_login'),
+        db.Index('ix_users_moderation', 'moderation_status', 'suspended_until',
+                 sqlite_where=db.text('moderation_status IS NOT NULL'),
+                 postgresql_where=db.text('moderation_status IS NOT NULL')),
+    )
+
     messages_sent = db.relationship('Message', backref='sender', lazy=True, foreign_keys='Message.sender_id')
     messages_received = db.relationship('Message', backref='receiver', lazy=True, foreign_keys='Message.receiver_id')
-    flagged_contents = db.relationship('FlaggedContent', backref='reporter', lazy=True, foreign_keys='FlaggedContent.reporter_id')
+    flagged_contents = db.relationship('FlaggedContent', backref='reporter', lazy=True, foreign_keys='FlaggedContent.user_id')
     notifications = db.relationship('Notification', backref='user', lazy=True)
     activities = db.relationship('ActivityLog', backref='user', lazy=True)
     reviewed_flags = db.relationship('FlaggedContent', backref='reviewed_by_admin', lazy=True, foreign_keys='FlaggedContent.reviewed_by')
 
+    @property
+    def is_suspended(self):
+        # Expired suspensions count as lifted even before the sweeper clears them
+        return (self.moderation_status == 'suspended'
+                and self.suspended_until is not None and self.suspended_until > datetime.utcnow())
+
     def set_password(self, password):
         self.password_hash = generate_password_hash(password)
 
@@ -49,9 +64,25 @@ class Message(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     sender_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     receiver_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), nullable=True)  # set (and receiver_id NULL) for group messages
     content = db.Column(db.Text, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     deleted = db.Column(db.Boolean, default=False)
+    deleted_at = db.Column(db.DateTime, nullable=True)  # soft delete time; purged later by the compactor
+
+    __table_args__ = (
+        db.Index('ix_messages_sender_receiver_created', 'sender_id', 'receiver_id', 'created_at'),
+        db.Index('ix_messages_receiver_created_live', 'receiver_id', 'created_at',
+                 sqlite_where=db.text('deleted = 0'),
+                 postgresql_where=db.text('NOT deleted')),
+        db.Index('ix_messages_created_at', 'created_at'),
+        db.Index('ix_messages_deleted_at', 'deleted_at',
+                 sqlite_where=db.text('deleted = 1'),
+                 postgresql_where=db.text('deleted')),
+        db.Index('ix_messages_group_id', 'group_id', 'id',
+                 sqlite_where=db.text('group_id IS NOT NULL'),
+                 postgresql_where=db.text('group_id IS NOT NULL')),
+    )
 
 #Group Model
 class Group(db.Model):
@@ -69,23 +100,54 @@ class GroupMembership(db.Model):
     group_id = db.Column(db.Integer, db.ForeignKey('groups.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
 
+    __table_args__ = (
+        # Unique in both directions: member lookups by group, group lists by user
+        db.Index('uq_group_membership_group_user', 'group_id', 'user_id', unique=True),
+        db.Index('uq_group_membership_user_group', 'user_id', 'group_id', unique=True),
+    )
+
+
+
+# Group Read Cursor Model (how far each member has read a group; group messages are stored once)
+class GroupReadCursor(db.Model):
+    __tablename__ = 'group_read_cursors'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    group_id = db.Column(db.Integer, primary_key=True)
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0)
+    # Unread messages after the cursor, counting the group's messages up to counted_through_id;
+    # only trusted while that is still the group's latest message (else counted on read)
+    unread_count = db.Column(db.Integer, nullable=True)
+    counted_through_id = db.Column(db.Integer, nullable=True)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_group_read_cursors_group', 'group_id'),
+    )
 
 
 # Flagged Content Model
 class FlaggedContent(db.Model):
     __tablename__ = 'flagged_content'
     id = db.Column(db.Integer, primary_key=True)
-    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    message_id = db.Column(db.Integer, db.ForeignKey('messages.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=False)
     reason = db.Column(db.String(255), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     reviewed = db.Column(db.Boolean, default=False)
-    reviewed_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True)
+    reviewed_by = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
     reviewed_at = db.Column(db.DateTime, nullable=True)
 
+    __table_args__ = (
+        db.Index('ix_flagged_content_reviewed_created', 'reviewed', 'created_at'),
+        db.Index('ix_flagged_content_message_id', 'message_id'),
+    )
+
     message = db.relationship('Message', backref=db.backref('flagged_content', lazy=True))
-    user = db.relationship('User', backref=db.backref('flagged_content', lazy=True))
-    reviewer = db.relationship('User', foreign_keys=[reviewed_by])
+    # Same foreign keys as User.flagged_contents / User.reviewed_flags, seen from the flag
+    user = db.relationship('User', foreign_keys=[user_id], overlaps='flagged_contents,reporter',
+                           backref=db.backref('flagged_content', lazy=True, overlaps='flagged_contents,reporter'))
+    reviewer = db.relationship('User', foreign_keys=[reviewed_by], overlaps='reviewed_by_admin,reviewed_flags')
 
     def __repr__(self):
         return f"<FlaggedContent {self.id} - Message {self.message_id} - User {self.user_id}>"
@@ -101,6 +163,11 @@ class ActivityLog(db.Model):
     details = db.Column(db.Text, nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_activity_logs_user_timestamp', 'user_id', 'timestamp'),
+        db.Index('ix_activity_logs_timestamp', 'timestamp'),
+    )
+
 
 # Notification Model
 class Notification(db.Model):
@@ -113,6 +180,99 @@ class Notification(db.Model):
     is_read = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index('ix_notifications_user_created', 'user_id', 'created_at'),
+        db.Index('ix_notifications_unread', 'user_id', 'created_at',
+                 sqlite_where=db.text('is_read = 0'),
+                 postgresql_where=db.text('NOT is_read')),
+        db.Index('ix_notifications_created_at', 'created_at'),
+    )
+
+
+# Active User Sketch Model (one HyperLogLog of active user ids per day)
+class ActiveUserSketch(db.Model):
+    __tablename__ = 'active_user_sketches'
+
+    day = db.Column(db.Date, primary_key=True)
+    sketch = db.Column(db.LargeBinary, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Job Lease Model (single-runner locking and last-run metrics for scheduled jobs)
+class JobLease(db.Model):
+    __tablename__ = 'job_leases'
+
+    name = db.Column(db.String(100), primary_key=True)
+    owner = db.Column(db.String(255), nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    last_started_at = db.Column(db.DateTime, nullable=True)
+    last_duration_ms = db.Column(db.Integer, nullable=True)
+    last_status = db.Column(db.String(20), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    run_count = db.Column(db.Integer, default=0, nullable=False)
+
+# Message Archive Partition Model (manifest of monthly cold-storage files of old messages)
+class MessageArchivePartition(db.Model):
+    __tablename__ = 'message_archive_partitions'
+
+    month = db.Column(db.String(7), primary_key=True)  # 'YYYY-MM'
+    path = db.Column(db.String(255), nullable=False)
+    row_count = db.Column(db.Integer, default=0, nullable=False)
+    min_message_id = db.Column(db.Integer, nullable=True)
+    max_message_id = db.Column(db.Integer, nullable=True)
+    min_created_at = db.Column(db.DateTime, nullable=True)
+    max_created_at = db.Column(db.DateTime, nullable=True)
+    # False for files archived before conversations were indexed; those are always searched
+    conversations_indexed = db.Column(db.Boolean, default=False, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# Message Archive Conversation Model (which monthly archive files hold each conversation)
+class MessageArchiveConversation(db.Model):
+    __tablename__ = 'message_archive_conversations'
+
+    conversation_key = db.Column(db.String(41), primary_key=True)  # sharding.conversation_key(user_a, user_b)
+    month = db.Column(db.String(7), primary_key=True)
+
+# Server Session Model (server-side Flask sessions, keyed by the id in the session cookie)
+class ServerSession(db.Model):
+    __tablename__ = 'sessions'
+
+    sid = db.Column(db.String(64), primary_key=True)
+    user_id = db.Column(db.Integer, nullable=True)
+    data = db.Column(db.LargeBinary, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_sessions_user_id', 'user_id',
+                 sqlite_where=db.text('user_id IS NOT NULL'),
+                 postgresql_where=db.text('user_id IS NOT NULL')),
+        db.Index('ix_sessions_expires_at', 'expires_at'),
+    )
+
+# Login Failure Model (shared sliding-window counters of failed sign-ins, per account or client IP)
+class LoginFailure(db.Model):
+    __tablename__ = 'login_failures'
+
+    id = db.Column(db.Integer, primary_key=True)
+    throttle_key = db.Column(db.String(255), nullable=False)
+    failed_at = db.Column(db.Float, nullable=False)  # Unix time
+
+    __table_args__ = (
+        db.Index('ix_login_failures_key_failed_at', 'throttle_key', 'failed_at'),
+        db.Index('ix_login_failures_failed_at', 'failed_at'),
+    )
+
+# User Presence Model (last heartbeat per user, written in batches by the presence tracker)
+class UserPresence(db.Model):
+    __tablename__ = 'user_presence'
+
+    user_id = db.Column(db.Integer, primary_key=True)
+    last_seen = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_user_presence_last_seen', 'last_seen'),
+    )
+
 # Initialize Database
 def init_db(app):
     """Initialize the database with the Flask app context."""
@@ -0,0 +1,112 @@
+from datetime import datetime
+import logging
+
+from sqlalchemy import func, select, update
+
+from db_engines import engines
+from db_retry import retry_on_lock
+from models import User, db
+from scheduler import scheduler
+from session_store import revoke_user_sessions
+from unit_of_work import after_commit, commit_or_flush
+from user_search import user_search_index
+from utils import identity_cache, invalidate_identity
+
+logger = logging.getLogger(__name__)
+
+# users.moderation_status: NULL while in good standing, so the partial index only holds moderated users
+STATUS_SUSPENDED = 'suspended'
+STATUS_BANNED = 'banned'
+
+DEFAULT_LIFT_BATCH_SIZE = 500
+SUSPENSION_LIFTED_MESSAGE = 'Your suspension has ended. Welcome back!'
+
+
+def ban_user(user):
+    """
+    Bans a user in the current unit of work. Their sessions are revoked and
+    they leave search results once it commits.
+    """
+    user.is_banned = True
+    user.moderation_status = STATUS_BANNED
+    user.suspended_until = None
+    commit_or_flush()
+    invalidate_identity(user.id)
+    after_commit(revoke_user_sessions, user.id)
+    after_commit(user_search_index.remove_user, user.id)
+
+
+def suspend_user(user, until):
+    """Suspends a user until `until` (a ban is kept as is); sessions are revoked once it commits."""
+    if user.moderation_status != STATUS_BANNED:
+        user.moderation_status = STATUS_SUSPENDED
+        user.suspended_until = until
+    commit_or_flush()
+    invalidate_identity(user.id)
+    after_commit(revoke_user_sessions, user.id)
+
+
+def count_moderated_users(session=None):
+    """
+    Returns {'banned': n, 'suspended': n}, counting only suspensions still
+    running. Both counts scan just the partial moderation index.
+    """
+    session = session or db.session
+    users = User.__table__
+    banned = session.execute(
+        select(func.count()).select_from(users).where(users.c.moderation_status == STATUS_BANNED)
+    ).scalar()
+    suspended = session.execute(
+        select(func.count()).select_from(users)
+        .where(users.c.moderation_status == STATUS_SUSPENDED, users.c.suspended_until > datetime.utcnow())
+    ).scalar()
+    return {'banned': banned, 'suspended': suspended}
+
+
+@retry_on_lock(rollback_session=False)
+def _lift_batch(batch_size):
+    users = User.__table__
+    now = datetime.utcnow()
+    expired = (users.c.moderation_status == STATUS_SUSPENDED, users.c.suspended_until <= now)
+    # Selected and updated in one transaction, so a user re-suspended meanwhile is not lifted
+    with engines.get_engine().begin() as connection:
+        user_ids = connection.execute(
+            select(users.c.id).where(*expired).order_by(users.c.suspended_until).limit(batch_size)
+        ).scalars().all()
+        if user_ids:
+            connection.execute(
+                update(users).where(users.c.id.in_(user_ids), *expired)
+                .values(moderation_status=None, suspended_until=None, updated_at=now)
+            )
+    return user_ids
+
+
+def lift_expired_suspensions(batch_size=DEFAULT_LIFT_BATCH_SIZE, notify=None):
+    """
+    Clears suspensions that have run out, one batch per transaction, and
+    tells each batch of users with one bulk notification insert. Returns
+    the number of suspensions lifted.
+    """
+    if notify is None:
+        from notifications import create_notifications as notify
+
+    lifted = 0
+    while True:
+        user_ids = _lift_batch(batch_size)
+        if not user_ids:
+            break
+        for user_id in user_ids:
+            identity_cache.invalidate(user_id)
+        notify(user_ids, SUSPENSION_LIFTED_MESSAGE, 'suspension_lifted')
+        lifted += len(user_ids)
+        if len(user_ids) < batch_size:
+            break
+    if lifted:
+        logger.info(f"Lifted {lifted} expired suspensions")
+    return lifted
+
+
+@scheduler.job('lift-expired-suspensions', interval=300, timeout=300)
+def lift_expired_suspensions_job():
+    """Ends expired suspensions within minutes, instead of leaving them set forever."""
+    lift_expired_suspensions()
@@ -1,16 +1,20 @@
 
-from app import db
-from models import Notification
+from db_retry import retry_on_lock
+from messages import get_message, remove_message
+from models import Notification, db
+from sqlalchemy import select
+import sharding
+from unit_of_work import after_commit, commit_or_flush, current_unit_of_work, transactional
 from datetime import datetime
 import logging
 from flask import jsonify
-from models import Message, FlaggedContent
+from models import FlaggedContent
 from flask import Flask
 app = Flask(__name__)
 
 logger = logging.getLogger(__name__)
 
-def create_notification(user_id, message, notif_type, is_read=False):
+def create_notification(user_id, message, notif_type=None, is_read=False, notification_type=None):
     """
     Create a notification for a user.
     
@@ -19,29 +23,57 @@ def create_notification(user_id, message, notif_type, is_read=False):
     - message: The message content of the notification.
     - notif_type: Type of notification ('error', 'report', 'admin', 'ban', etc.)
     - is_read: Whether the notification has been read by the user.
+    - notification_type: Alias of notif_type, as used by the flagging routes.
     """
     try:
-        # Creating the notification object
-        notification = Notification(
-            user_id=user_id,
-            message=message,
-            type=notif_type,
-            is_read=is_read,
-            created_at=datetime.utcnow()
-        )
-        
-        # Add to the session and commit to the database
-        db.session.add(notification)
-        db.session.commit()
-        logger.info(f"Notification created for user {user_id}: {message}")
+        _insert_notifications([user_id], message, notif_type or notification_type, is_read)
+        after_commit(logger.info, f"Notification created for user {user_id}: {message}")
         return True
     
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error creating notification for user {user_id}: {str(e)}")
+        if current_unit_of_work() is not None:
+            raise  # the rollback discarded the whole request's writes
         return False
 
 
+def create_notifications(user_ids, message, notif_type, is_read=False):
+    """
+    Create the same notification for several users in one batched INSERT.
+    
+    Parameters:
+    - user_ids: IDs of the users receiving the notification.
+    - message: The message content of the notification.
+    - notif_type: Type of notification ('error', 'report', 'admin', 'ban', etc.)
+    - is_read: Whether the notifications start out read.
+    """
+    user_ids = list(dict.fromkeys(user_ids))
+    if not user_ids:
+        return True
+    try:
+        _insert_notifications(user_ids, message, notif_type, is_read)
+        after_commit(logger.info, f"Notification created for {len(user_ids)} users: {message}")
+        return True
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error creating notifications for {len(user_ids)} users: {str(e)}")
+        if current_unit_of_work() is not None:
+            raise  # the rollback discarded the whole request's writes
+        return False
+
+
+@retry_on_lock(rollback_session=False)
+def _insert_notifications(user_ids, message, notif_type, is_read):
+    # One executemany per shard the recipients live on
+    created_at = datetime.utcnow()
+    sharding.insert_rows('notifications', [
+        {'user_id': user_id, 'message': message, 'type': notif_type, 'is_read': is_read, 'created_at': created_at}
+        for user_id in user_ids
+    ])
+
+
 def get_user_notifications(user_id, limit=10, unread_only=False):
     """
     Retrieve notifications for a specific user.
@@ -52,19 +84,18 @@ def get_user_notifications(user_id, limit=10, unread_only=False):
     - unread_only: Filter to only show unread notifications if True.
     """
     try:
-        query = db.session.query(Notification).filter(Notification.user_id == user_id)
+        notifications = Notification.__table__
+        query = select(notifications).where(notifications.c.user_id == user_id)
         
         # Optionally filter unread notifications
         if unread_only:
-            query = query.filter(Notification.is_read == False)
+            query = query.where(notifications.c.is_read == False)
         
         # Order by creation time (most recent first)
-        query = query.order_by(Notification.created_at.desc()).limit(limit)
-        
-        notifications = query.all()
+        query = query.order_by(notifications.c.created_at.desc()).limit(limit)
         
-        # Return notifications
-        return notifications
+        # All of a user's notifications live on one shard
+        return sharding.execute_on_shard(sharding.get_shard_map().shard_for_user(user_id), query)
     
     except Exception as e:
         logger.error(f"Error retrieving notifications for user {user_id}: {str(e)}")
@@ -78,12 +109,13 @@ def mark_notification_as_read(notification_id):
     Parameters:
     - notification_id: The ID of the notification to mark as read.
     """
+    @retry_on_lock(rollback_session=False)
+    def mark_read():
+        return sharding.update_row_by_id('notifications', notification_id, {'is_read': True})
+
     try:
-        notification = Notification.query.get(notification_id)
-        if notification:
-            notification.is_read = True
-            db.session.commit()
-            logger.info(f"Notification {notification_id} marked as read.")
+        if mark_read():
+            after_commit(logger.info, f"Notification {notification_id} marked as read.")
             return True
         else:
             logger.warning(f"Notification {notification_id} not found.")
@@ -91,6 +123,8 @@ def mark_notification_as_read(notification_id):
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error marking notification {notification_id} as read: {str(e)}")
+        if current_unit_of_work() is not None:
+            raise  # the rollback discarded the whole request's writes
         return False
 
 
@@ -101,12 +135,13 @@ def delete_notification(notification_id):
     Parameters:
     - notification_id: The ID of the notification to delete.
     """
+    @retry_on_lock(rollback_session=False)
+    def delete():
+        return sharding.delete_row_by_id('notifications', notification_id)
+
     try:
-        notification = Notification.query.get(notification_id)
-        if notification:
-            db.session.delete(notification)
-            db.session.commit()
-            logger.info(f"Notification {notification_id} deleted.")
+        if delete():
+            after_commit(logger.info, f"Notification {notification_id} deleted.")
             return True
         else:
             logger.warning(f"Notification {notification_id} not found.")
@@ -114,6 +149,8 @@ def delete_notification(notification_id):
     except Exception as e:
         db.session.rollback()
         logger.error(f"Error deleting notification {notification_id}: {str(e)}")
+        if current_unit_of_work() is not None:
+            raise  # the rollback discarded the whole request's writes
         return False
 
 
@@ -185,8 +222,10 @@ def get_all_notifications(limit=10):
     - limit: Limit the number of notifications returned.
     """
     try:
-        notifications = db.session.query(Notification).order_by(Notification.created_at.desc()).limit(limit).all()
-        return notifications
+        # Newest `limit` from each shard, merged
+        notifications = Notification.__table__
+        query = select(notifications).order_by(notifications.c.created_at.desc()).limit(limit)
+        return sharding.scatter_top(query, limit, key=lambda notification: notification.created_at)
     except Exception as e:
         logger.error(f"Error retrieving all notifications: {str(e)}")
         return []
@@ -194,9 +233,12 @@ def get_all_notifications(limit=10):
 
 def flag_content(message_id, user_id, reason):
     # Flag the message in the database
-    flag = FlaggedContent(message_id=message_id, user_id=user_id, reason=reason)
-    db.session.add(flag)
-    db.session.commit()
+    @retry_on_lock
+    def save_flag():
+        db.session.add(FlaggedContent(message_id=message_id, user_id=user_id, reason=reason))
+        commit_or_flush()
+
+    save_flag()
 
     # Create notification for admin about the flagged content
     create_notification(
@@ -213,11 +255,10 @@ def flag_content(message_id, user_id, reason):
     )
 
 @app.route('/delete_message/<int:message_id>', methods=['POST'])
+@transactional
 def delete_message(message_id):
-    message = Message.query.get(message_id)
-    if message:
-        db.session.delete(message)
-        db.session.commit()
+    message = get_message(message_id)
+    if message and remove_message(message_id):
 
         # Notify admin about the deletion
         create_notification(
@@ -0,0 +1,174 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import logging
+import multiprocessing
+import os
+import threading
+import time
+
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import check_password_hash, generate_password_hash
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_HASH_METHOD = 'scrypt'        # PASSWORD_HASH_METHOD: any werkzeug method, e.g. 'pbkdf2:sha256:600000'
+DEFAULT_HASH_EXECUTOR = 'process'     # PASSWORD_HASH_EXECUTOR: 'process', 'thread' or 'inline'
+DEFAULT_HASH_TIMEOUT_SECONDS = 5.0    # PASSWORD_HASH_TIMEOUT
+
+
+class HashingPoolSaturated(ServiceUnavailable):
+    """Raised (and answered with 503) when too many hashes are already queued."""
+
+    description = 'Too many sign-ins are being processed right now. Please try again shortly.'
+
+    def __init__(self):
+        super().__init__(retry_after=1)
+
+
+def _hash_params(password_hash):
+    # werkzeug hashes look like 'method:params$salt$hash'
+    return password_hash.split('$', 1)[0]
+
+
+class PasswordHasher:
+    """
+    Runs werkzeug's password KDFs on a dedicated pool (processes by default,
+    so hashing does not hold the GIL of the web workers). At most
+    PASSWORD_HASH_QUEUE_SIZE hashes are queued or running at once; past
+    that, callers get HashingPoolSaturated instead of waiting.
+    """
+
+    def __init__(self):
+        self.method = DEFAULT_HASH_METHOD
+        self.executor_type = DEFAULT_HASH_EXECUTOR
+        self.workers = os.cpu_count() or 1
+        self.queue_size = self.workers * 4
+        self.timeout = DEFAULT_HASH_TIMEOUT_SECONDS
+        self._executor = None
+        self._executor_pid = None
+        self._executor_lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._current_params = None
+        self.metrics_lock = threading.Lock()
+        self.metrics = {
+            "submitted": 0,
+            "completed": 0,
+            "rejected": 0,
+            "timeouts": 0,
+            "rehashed": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+            "total_ms": 0.0,
+            "max_ms": 0.0,
+        }
+
+    def init_app(self, app):
+        self.shutdown()
+        self.method = app.config.get('PASSWORD_HASH_METHOD', DEFAULT_HASH_METHOD)
+        self.executor_type = app.config.get('PASSWORD_HASH_EXECUTOR', DEFAULT_HASH_EXECUTOR)
+        if self.executor_type not in ('process', 'thread', 'inline'):
+            raise ValueError(f"Unknown password hash executor '{self.executor_type}'")
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS') or os.cpu_count() or 1
+        self.queue_size = app.config.get('PASSWORD_HASH_QUEUE_SIZE') or self.workers * 4
+        self.timeout = app.config.get('PASSWORD_HASH_TIMEOUT', DEFAULT_HASH_TIMEOUT_SECONDS)
+        self._slots = threading.BoundedSemaphore(self.queue_size)
+        self._current_params = None
+        app.extensions['password_hasher'] = self
+
+    def _get_executor(self):
+        # Created on first use in each process: a pool inherited over fork has no workers
+        with self._executor_lock:
+            if self._executor is None or self._executor_pid != os.getpid():
+                if self.executor_type == 'process':
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers, mp_context=multiprocessing.get_context('spawn')
+                    )
+                else:
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+                self._executor_pid = os.getpid()
+            return self._executor
+
+    def shutdown(self):
+        with self._executor_lock:
+            if self._executor is not None and self._executor_pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            with self.metrics_lock:
+                self.metrics["rejected"] += 1
+            logger.warning(f"Password hashing pool saturated ({self.queue_size} queued)")
+            raise HashingPoolSaturated()
+
+        with self.metrics_lock:
+            self.metrics["submitted"] += 1
+            self.metrics["in_flight"] += 1
+            self.metrics["max_in_flight"] = max(self.metrics["max_in_flight"], self.metrics["in_flight"])
+        start = time.perf_counter()
+        try:
+            if self.executor_type == 'inline':
+                return func(*args)
+            try:
+                return self._get_executor().submit(func, *args).result(timeout=self.timeout)
+            except FutureTimeoutError:
+                with self.metrics_lock:
+                    self.metrics["timeouts"] += 1
+                raise HashingPoolSaturated()
+        finally:
+            elapsed_ms = (time.perf_counter() - start) * 1000
+            # The slot is freed even after a timeout, so the queue bound is soft for stuck hashes
+            self._slots.release()
+            with self.metrics_lock:
+                self.metrics["in_flight"] -= 1
+                self.metrics["completed"] += 1
+                self.metrics["total_ms"] += elapsed_ms
+                self.metrics["max_ms"] = max(self.metrics["max_ms"], elapsed_ms)
+
+    def hash_password(self, password):
+        """Hashes a password with the configured method."""
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify_password(self, password_hash, password):
+        """Checks a password against a stored hash."""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different method or work factor than configured."""
+        if self._current_params is None:
+            # Resolve defaults (e.g. 'scrypt' -> 'scrypt:32768:8:1') from a throwaway hash
+            self._current_params = _hash_params(self.hash_password(''))
+        return _hash_params(password_hash) != self._current_params
+
+    def rehash_if_needed(self, password_hash, password):
+        """
+        After a successful login, returns a new hash when the stored one is
+        outdated, else None. Skipped (None) while the pool is saturated.
+        """
+        try:
+            if not self.needs_rehash(password_hash):
+                return None
+            new_hash = self.hash_password(password)
+        except HashingPoolSaturated:
+            return None
+        with self.metrics_lock:
+            self.metrics["rehashed"] += 1
+        return new_hash
+
+    def get_metrics(self):
+        """Returns pool settings, queue depth and latency counters."""
+        with self.metrics_lock:
+            metrics = dict(self.metrics)
+        completed = metrics["completed"]
+        metrics.update({
+            "method": self.method,
+            "executor": self.executor_type,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "avg_ms": round(metrics["total_ms"] / completed, 2) if completed else 0.0,
+        })
+        return metrics
+
+
+# Shared hasher; configured by password_hasher.init_app(app)
+password_hasher = PasswordHasher()
@@ -0,0 +1,217 @@
+import atexit
+from datetime import datetime, timedelta
+import logging
+import os
+import threading
+import time
+
+from sqlalchemy import bindparam, select, union, update
+from sqlalchemy.dialects import postgresql, sqlite
+
+from db_engines import engines
+from db_retry import retry_on_lock
+from models import Message, User, UserPresence
+import sharding
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_PRESENCE_TTL_SECONDS = 120    # PRESENCE_TTL_SECONDS: a user is online this long after their last request
+DEFAULT_PRESENCE_FLUSH_SECONDS = 15   # PRESENCE_FLUSH_SECONDS: how often last-seen and last-login times are written
+MAX_CONTACTS = 500
+CONTACTS_CACHE_SECONDS = 300
+CONTACTS_CACHE_MAX_USERS = 10000
+
+_UPSERTS = {'sqlite': sqlite.insert, 'postgresql': postgresql.insert}
+
+
+class PresenceTracker:
+    """
+    Last-seen heartbeats held in memory. Requests only update a dict; a
+    background thread in each process writes the pending last-seen times to
+    user_presence and login times to users.last_login every
+    PRESENCE_FLUSH_SECONDS, one batched statement each. Status lookups read
+    this process's heartbeats and fall back to user_presence for users last
+    seen by other workers.
+    """
+
+    def __init__(self):
+        self.ttl = DEFAULT_PRESENCE_TTL_SECONDS
+        self.flush_seconds = DEFAULT_PRESENCE_FLUSH_SECONDS
+        self._app = None
+        self._lock = threading.Lock()
+        self._last_seen = {}       # user_id -> last heartbeat in this process (UTC)
+        self._pending_seen = {}    # user_id -> last heartbeat not yet written
+        self._pending_logins = {}  # user_id -> login time not yet written
+        self._contacts = {}        # user_id -> (contact ids, monotonic expiry)
+        self._flusher_pid = None
+        self.metrics = {"heartbeats": 0, "flushes": 0, "rows_written": 0, "flush_errors": 0}
+
+    def init_app(self, app):
+        self.ttl = app.config.get('PRESENCE_TTL_SECONDS', DEFAULT_PRESENCE_TTL_SECONDS)
+        self.flush_seconds = app.config.get('PRESENCE_FLUSH_SECONDS', DEFAULT_PRESENCE_FLUSH_SECONDS)
+        self._app = app
+
+    def touch(self, user_id, when=None):
+        """Records a heartbeat (any authenticated request); no database access."""
+        when = when or datetime.utcnow()
+        with self._lock:
+            self._last_seen[user_id] = when
+            self._pending_seen[user_id] = when
+            self.metrics["heartbeats"] += 1
+        self._ensure_flusher()
+
+    def record_login(self, user_id, when=None):
+        """Records a successful login; users.last_login is written on the next flush."""
+        when = when or datetime.utcnow()
+        with self._lock:
+            self._pending_logins[user_id] = when
+        self.touch(user_id, when)
+
+    def _ensure_flusher(self):
+        # One flusher per process, started on first use (threads do not survive a fork)
+        if self._flusher_pid == os.getpid() or self._app is None:
+            return
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+        threading.Thread(target=self._run_flusher, args=(self._app,), name='presence-flush', daemon=True).start()
+        # The flusher is a daemon thread, so write what is pending when the worker exits
+        atexit.register(self._flush_at_exit, self._app)
+
+    def _flush_at_exit(self, app):
+        try:
+            with app.app_context():
+                self.flush()
+        except Exception as e:
+            logger.error(f"Presence flush at exit failed: {str(e)}")
+
+    def _run_flusher(self, app):
+        while True:
+            time.sleep(self.flush_seconds)
+            try:
+                with app.app_context():
+                    self.flush()
+            except Exception as e:
+                logger.error(f"Presence flush failed: {str(e)}")
+
+    @retry_on_lock(rollback_session=False)
+    def _write(self, seen, logins):
+        engine = engines.get_engine()
+        with engine.begin() as connection:
+            if seen:
+                upsert = _UPSERTS[engine.dialect.name](UserPresence.__table__)
+                connection.execute(
+                    upsert.on_conflict_do_update(
+                        index_elements=['user_id'], set_={'last_seen': upsert.excluded.last_seen}
+                    ),
+                    [{'user_id': user_id, 'last_seen': last_seen} for user_id, last_seen in seen.items()],
+                )
+            if logins:
+                users = User.__table__
+                connection.execute(
+                    update(users).where(users.c.id == bindparam('user_id'))
+                    .values(last_login=bindparam('login_at')),
+                    [{'user_id': user_id, 'login_at': login_at} for user_id, login_at in logins.items()],
+                )
+
+    def flush(self):
+        """Writes pending heartbeats and logins in one transaction; returns the number of rows written."""
+        with self._lock:
+            seen, self._pending_seen = self._pending_seen, {}
+            logins, self._pending_logins = self._pending_logins, {}
+            # Users gone quiet are already in user_presence, so memory only holds recent ones
+            cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+            self._last_seen = {user_id: when for user_id, when in self._last_seen.items() if when > cutoff}
+        if not seen and not logins:
+            return 0
+        try:
+            self._write(seen, logins)
+        except Exception as e:
+            # Keep them for the next flush, unless newer times came in meanwhile
+            with self._lock:
+                for pending, batch in ((self._pending_seen, seen), (self._pending_logins, logins)):
+                    for user_id, when in batch.items():
+                        if user_id not in pending or when > pending[user_id]:
+                            pending[user_id] = when
+                self.metrics["flush_errors"] += 1
+            logger.error(f"Failed to write presence: {str(e)}")
+            return 0
+        with self._lock:
+            self.metrics["flushes"] += 1
+            self.metrics["rows_written"] += len(seen) + len(logins)
+        return len(seen) + len(logins)
+
+    def last_seen(self, user_ids):
+        """Returns {user_id: last seen (UTC) or None}, from memory first, then user_presence."""
+        user_ids = list(dict.fromkeys(user_ids))
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        with self._lock:
+            result = {user_id: self._last_seen.get(user_id) for user_id in user_ids}
+        # Users seen here recently are known online; only ask the table about the rest
+        unknown = [user_id for user_id, when in result.items() if when is None or when <= cutoff]
+        if unknown:
+            presence = UserPresence.__table__
+            with engines.get_engine().connect() as connection:
+                for row in connection.execute(
+                    select(presence.c.user_id, presence.c.last_seen).where(presence.c.user_id.in_(unknown))
+                ):
+                    if result[row.user_id] is None or row.last_seen > result[row.user_id]:
+                        result[row.user_id] = row.last_seen
+        return result
+
+    def online_status(self, user_ids):
+        """Returns {user_id: {'online': bool, 'last_seen': ISO time or None}}."""
+        cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+        return {
+            user_id: {'online': when is not None and when > cutoff,
+                      'last_seen': when.isoformat() if when else None}
+            for user_id, when in self.last_seen(user_ids).items()
+        }
+
+    def contact_ids(self, user_id):
+        """
+        The users `user_id` has exchanged direct messages with (at most
+        MAX_CONTACTS), from one indexed query per shard, cached for a few
+        minutes.
+        """
+        now = time.monotonic()
+        with self._lock:
+            cached = self._contacts.get(user_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        messages = Message.__table__
+        # Direct messages only: group messages have no receiver
+        direct = messages.c.group_id.is_(None)
+        partners = union(
+            select(messages.c.receiver_id.label('user_id'))
+            .where(messages.c.sender_id == user_id, direct, messages.c.receiver_id.isnot(None)),
+            select(messages.c.sender_id.label('user_id')).where(messages.c.receiver_id == user_id, direct),
+        ).limit(MAX_CONTACTS)
+        contacts = set()
+        for index in range(sharding.get_shard_map().num_shards):
+            contacts.update(row.user_id for row in sharding.execute_on_shard(index, partners))
+        contacts.discard(user_id)
+        contacts.discard(None)
+        contacts = sorted(contacts)[:MAX_CONTACTS]
+
+        with self._lock:
+            if len(self._contacts) >= CONTACTS_CACHE_MAX_USERS:
+                self._contacts = {key: entry for key, entry in self._contacts.items() if entry[1] > now}
+            self._contacts[user_id] = (contacts, now + CONTACTS_CACHE_SECONDS)
+        return contacts
+
+    def contacts_status(self, user_id):
+        """Online status of everyone `user_id` has messaged with."""
+        return self.online_status(self.contact_ids(user_id))
+
+    def get_metrics(self):
+        with self._lock:
+            return dict(self.metrics, tracked_users=len(self._last_seen),
+                        pending=len(self._pending_seen) + len(self._pending_logins))
+
+
+# Shared tracker; configured by presence_tracker.init_app(app)
+presence_tracker = PresenceTracker()
@@ -0,0 +1,171 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from collections import Counter
+import logging
+import re
+import threading
+import time
+
+from flask import request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_REPEAT_THRESHOLD = 10      # QUERY_REPEAT_THRESHOLD: same fingerprint this often in one request
+DEFAULT_SLOW_QUERY_MS = 100        # SLOW_QUERY_MS
+MAX_SLOW_QUERIES_PER_REQUEST = 20
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\(\s*(?:\?|%s|:\w+)(?:\s*,\s*(?:\?|%s|:\w+))*\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+# Stats for the request (or track_queries block) currently running
+_current_stats = ContextVar('query_stats', default=None)
+
+_route_stats = {}
+_route_stats_lock = threading.Lock()
+
+
+def fingerprint(statement):
+    """
+    Normalizes a SQL statement so queries that differ only in their
+    parameters compare equal: literals become ?, IN lists collapse to (?)
+    and whitespace/case are folded.
+    """
+    statement = _STRING_LITERAL.sub('?', statement)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    statement = _PLACEHOLDER_LIST.sub('(?)', statement)
+    return _WHITESPACE.sub(' ', statement).strip().lower()
+
+
+class QueryStats:
+    """Queries run during one request or track_queries() block."""
+
+    def __init__(self, slow_query_ms=DEFAULT_SLOW_QUERY_MS):
+        self.slow_query_ms = slow_query_ms
+        self.count = 0
+        self.total_ms = 0.0
+        self.fingerprints = Counter()
+        self.slow_queries = []
+
+    def record(self, statement, elapsed_ms):
+        self.count += 1
+        self.total_ms += elapsed_ms
+        key = fingerprint(statement)
+        self.fingerprints[key] += 1
+        if elapsed_ms >= self.slow_query_ms and len(self.slow_queries) < MAX_SLOW_QUERIES_PER_REQUEST:
+            self.slow_queries.append({"fingerprint": key, "ms": round(elapsed_ms, 2)})
+
+    def repeated(self, threshold):
+        """Fingerprints run more than `threshold` times, most repeated first."""
+        return [(key, count) for key, count in self.fingerprints.most_common() if count > threshold]
+
+    @property
+    def max_repeats(self):
+        return max(self.fingerprints.values(), default=0)
+
+
+@contextmanager
+def track_queries(slow_query_ms=DEFAULT_SLOW_QUERY_MS):
+    """
+    Collects every query run inside the block, on any engine. Useful in
+    tests to pin a code path's query budget:
+
+        with track_queries() as stats:
+            get_admin_dashboard_stats()
+        assert stats.count <= 6
+    """
+    stats = QueryStats(slow_query_ms)
+    token = _current_stats.set(stats)
+    try:
+        yield stats
+    finally:
+        _current_stats.reset(token)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current_stats.get() is not None:
+        conn.info.setdefault('query_start_times', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _current_stats.get()
+    start_times = conn.info.get('query_start_times')
+    if stats is None or not start_times:
+        return
+    stats.record(statement, (time.perf_counter() - start_times.pop()) * 1000)
+
+
+def _record_route(route, stats, repeated):
+    with _route_stats_lock:
+        route_stats = _route_stats.setdefault(
+            route, {"requests": 0, "queries": 0, "db_ms": 0.0, "max_queries": 0, "slow_queries": 0, "n_plus_one": 0}
+        )
+        route_stats["requests"] += 1
+        route_stats["queries"] += stats.count
+        route_stats["db_ms"] += stats.total_ms
+        route_stats["max_queries"] = max(route_stats["max_queries"], stats.count)
+        route_stats["slow_queries"] += len(stats.slow_queries)
+        route_stats["n_plus_one"] += int(bool(repeated))
+
+
+def get_route_query_stats():
+    """Per-route totals since startup, with averages per request."""
+    with _route_stats_lock:
+        return {
+            route: {
+                **stats,
+                "db_ms": round(stats["db_ms"], 2),
+                "avg_queries": round(stats["queries"] / stats["requests"], 2),
+                "avg_db_ms": round(stats["db_ms"] / stats["requests"], 2),
+            }
+            for route, stats in _route_stats.items()
+        }
+
+
+def init_app(app):
+    """
+    Tracks queries per request. After each request the route totals are
+    updated, slow statements and repeated fingerprints (likely N+1 loops)
+    are logged, and with SERVER_TIMING_HEADER on a Server-Timing header
+    reports the query count and database time to the browser.
+    """
+    repeat_threshold = app.config.get('QUERY_REPEAT_THRESHOLD', DEFAULT_REPEAT_THRESHOLD)
+    slow_query_ms = app.config.get('SLOW_QUERY_MS', DEFAULT_SLOW_QUERY_MS)
+    server_timing = app.config.get('SERVER_TIMING_HEADER', False)
+
+    @app.before_request
+    def _start_query_tracking():
+        stats = QueryStats(slow_query_ms)
+        request.environ['query_stats'] = (stats, _current_stats.set(stats))
+
+    @app.after_request
+    def _report_queries(response):
+        tracked = request.environ.get('query_stats')
+        if not tracked:
+            return response
+        stats = tracked[0]
+        route = request.url_rule.rule if request.url_rule else '<unmatched>'
+
+        for slow in stats.slow_queries:
+            logger.warning(f"Slow query on {route} ({slow['ms']} ms): {slow['fingerprint'][:200]}")
+        repeated = stats.repeated(repeat_threshold)
+        for key, count in repeated:
+            logger.warning(f"Possible N+1 on {route}: query ran {count} times in one request: {key[:200]}")
+
+        _record_route(route, stats, repeated)
+
+        if server_timing:
+            response.headers.add('Server-Timing', f'db;dur={stats.total_ms:.1f};desc="{stats.count} queries"')
+        return response
+
+    @app.teardown_request
+    def _stop_query_tracking(exc=None):
+        tracked = request.environ.pop('query_stats', None)
+        if tracked:
+            _current_stats.reset(tracked[1])
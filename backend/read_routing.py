@@ -0,0 +1,105 @@
+from contextlib import contextmanager
+from functools import wraps
+import logging
+
+from flask import g, has_app_context
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import Session
+
+from db_engines import engines
+
+logger = logging.getLogger(__name__)
+
+
+def read_only_sqlite_uri(db_url):
+    """
+    Derives a read-only URI for a file-backed SQLite database, e.g.
+    sqlite:///database.db -> sqlite:///file:database.db?mode=ro&uri=true.
+    Returns None for in-memory or non-SQLite databases.
+    """
+    url = make_url(db_url)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return None
+    if url.query.get('mode') == 'ro':
+        return db_url
+    database = url.database if url.database.startswith('file:') else f"file:{url.database}"
+    return url.set(database=database, query={**url.query, 'mode': 'ro', 'uri': 'true'}).render_as_string(hide_password=False)
+
+
+def _read_engine_factory(app):
+    """
+    Chooses the URL of the engine used for analytics reads.
+
+    SQLALCHEMY_READ_DATABASE_URI can point at a replica or a snapshot copy.
+    Otherwise a file-backed SQLite primary is opened a second time in
+    read-only mode (in WAL mode such readers never take the write lock), and
+    any other backend gets a separate pool on the primary URL. In-memory
+    SQLite cannot be opened twice, so it shares the primary engine.
+    """
+    read_url = app.config.get('SQLALCHEMY_READ_DATABASE_URI')
+    if not read_url:
+        primary_url = engines.get_engine('primary').url
+        if primary_url.get_backend_name() == 'sqlite':
+            read_url = read_only_sqlite_uri(primary_url.render_as_string(hide_password=False))
+        else:
+            read_url = primary_url.render_as_string(hide_password=False)
+    return read_url, app.config.get('SQLALCHEMY_READ_ENGINE_OPTIONS', {})
+
+
+def _configure_read_engine(engine):
+    if engine.dialect.name == 'sqlite':
+        @event.listens_for(engine, 'connect')
+        def _set_query_only(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA query_only = ON')
+            cursor.close()
+
+
+engines.register('read', _read_engine_factory, _configure_read_engine)
+
+
+def get_read_engine(app=None):
+    """Returns the app's read-only engine, creating it on first use."""
+    return engines.get_engine('read', app)
+
+
+@contextmanager
+def get_read_session():
+    """
+    Context manager for a session bound to the read-only engine.
+    Nothing is ever committed; the session is always closed.
+    """
+    session = Session(bind=get_read_engine(), autoflush=False)
+    try:
+        yield session
+    finally:
+        session.rollback()
+        session.close()
+
+
+def read_session():
+    """
+    Returns the session that analytics code should read from.
+    Inside a @uses_read_engine request this is the read-only session,
+    otherwise the regular Flask-SQLAlchemy session.
+    """
+    if has_app_context() and 'read_session' in g:
+        return g.read_session
+    from models import db
+    return db.session
+
+
+def uses_read_engine(f):
+    """Marks a view or helper as read-only so its queries go to the read engine."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if 'read_session' in g:
+            return f(*args, **kwargs)
+        with get_read_session() as session:
+            g.read_session = session
+            try:
+                return f(*args, **kwargs)
+            finally:
+                g.pop('read_session', None)
+    return decorated
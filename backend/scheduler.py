@@ -0,0 +1,329 @@
+from datetime import datetime, timedelta
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# Extra lease time past a job's timeout before another worker may take over
+LEASE_GRACE_SECONDS = 60
+
+# How often the scheduler thread wakes up to look for due jobs
+TICK_SECONDS = 5
+
+
+class CronSchedule:
+    """
+    Minimal five-field cron expression: minute hour day-of-month month day-of-week.
+    Each field accepts '*', 'n', 'a-b', 'a,b,c' and a '/step' suffix.
+    Day-of-week is 0-6 with 0 = Sunday (7 is also accepted as Sunday).
+    """
+
+    FIELD_RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 6)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f"Cron expression needs 5 fields: '{expression}'")
+        self.expression = expression
+        self.minutes, self.hours, self.days, self.months, self.weekdays = (
+            self._parse_field(field, low, high, index == 4)
+            for index, (field, (low, high)) in enumerate(zip(fields, self.FIELD_RANGES))
+        )
+        # Standard cron: when both day fields are restricted, either may match
+        self.any_day = fields[2] == '*'
+        self.any_weekday = fields[4] == '*'
+
+    @staticmethod
+    def _parse_field(field, low, high, is_weekday):
+        values = set()
+        for part in field.split(','):
+            step = 1
+            if '/' in part:
+                part, step_text = part.split('/', 1)
+                step = int(step_text)
+                if step < 1:
+                    raise ValueError(f"Invalid step in cron field '{field}'")
+            if part == '*':
+                start, end = low, high
+            elif '-' in part:
+                start_text, end_text = part.split('-', 1)
+                start, end = int(start_text), int(end_text)
+            else:
+                start = int(part)
+                end = high if step > 1 else start
+            if is_weekday:
+                # Allow 7 as an alias for Sunday
+                start, end = min(start, 7), min(end, 7)
+                if not 0 <= start <= end <= 7:
+                    raise ValueError(f"Invalid cron field '{field}'")
+                values.update(day % 7 for day in range(start, end + 1, step))
+                continue
+            if not low <= start <= end <= high:
+                raise ValueError(f"Invalid cron field '{field}'")
+            values.update(range(start, end + 1, step))
+        return frozenset(values)
+
+    def _day_matches(self, when):
+        # Python: Monday = 0; cron: Sunday = 0
+        weekday = (when.weekday() + 1) % 7
+        day_ok = when.day in self.days
+        weekday_ok = weekday in self.weekdays
+        if self.any_day or self.any_weekday:
+            return day_ok and weekday_ok
+        return day_ok or weekday_ok
+
+    def next_after(self, when):
+        """Returns the first matching minute strictly after `when`."""
+        candidate = when.replace(second=0, microsecond=0) + timedelta(minutes=1)
+        # Four years is enough to find any valid date, including Feb 29
+        limit = candidate + timedelta(days=366 * 4)
+        while candidate < limit:
+            if candidate.month not in self.months:
+                year = candidate.year + (candidate.month == 12)
+                month = candidate.month % 12 + 1
+                candidate = candidate.replace(year=year, month=month, day=1, hour=0, minute=0)
+                continue
+            if not self._day_matches(candidate):
+                candidate = candidate.replace(hour=0, minute=0) + timedelta(days=1)
+                continue
+            if candidate.hour not in self.hours:
+                candidate = candidate.replace(minute=0) + timedelta(hours=1)
+                continue
+            if candidate.minute not in self.minutes:
+                candidate += timedelta(minutes=1)
+                continue
+            return candidate
+        raise ValueError(f"Cron expression never matches: '{self.expression}'")
+
+    def __repr__(self):
+        return f"cron({self.expression})"
+
+
+class IntervalSchedule:
+    """Runs a job every fixed number of seconds."""
+
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError("Interval must be positive")
+        self.seconds = seconds
+
+    def next_after(self, when):
+        return when + timedelta(seconds=self.seconds)
+
+    def __repr__(self):
+        return f"every {self.seconds}s"
+
+
+class Job:
+    """A named unit of periodic work."""
+
+    def __init__(self, name, func, schedule, timeout):
+        self.name = name
+        self.func = func
+        self.schedule = schedule
+        self.timeout = timeout
+        self.next_run = None
+        self.worker = None
+        self.stats = {
+            "runs": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "skipped": 0,
+            "last_status": None,
+            "last_run_at": None,
+            "last_duration_ms": None,
+        }
+
+
+class Scheduler:
+    """
+    In-process job scheduler.
+
+    Every worker may run a scheduler thread; a row in the `job_leases` table
+    makes sure only one of them runs a given job at a time.
+    """
+
+    def __init__(self):
+        self.jobs = {}
+        self.app = None
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._thread = None
+        self._stop = threading.Event()
+
+    def job(self, name, interval=None, cron=None, timeout=300):
+        """
+        Decorator registering a function as a scheduled job.
+        Pass either `interval` (seconds) or `cron` (five-field expression).
+        """
+        if (interval is None) == (cron is None):
+            raise ValueError("Give exactly one of interval or cron")
+        schedule = IntervalSchedule(interval) if interval is not None else CronSchedule(cron)
+
+        def decorator(func):
+            if name in self.jobs:
+                raise ValueError(f"Job '{name}' is already registered")
+            self.jobs[name] = Job(name, func, schedule, timeout)
+            return func
+        return decorator
+
+    def init_app(self, app):
+        self.app = app
+        app.extensions['scheduler'] = self
+        if app.config.get('SCHEDULER_ENABLED'):
+            self.start()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        now = datetime.utcnow()
+        for job in self.jobs.values():
+            job.next_run = job.schedule.next_after(now)
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run_loop, name='scheduler', daemon=True)
+        self._thread.start()
+        logger.info(f"Scheduler started with {len(self.jobs)} jobs as {self.owner}")
+
+    def stop(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join(timeout=TICK_SECONDS * 2)
+
+    def _run_loop(self):
+        while not self._stop.wait(TICK_SECONDS):
+            now = datetime.utcnow()
+            for job in list(self.jobs.values()):
+                if job.next_run and job.next_run <= now:
+                    job.next_run = job.schedule.next_after(now)
+                    try:
+                        self.run_job(job.name)
+                    except Exception as e:
+                        logger.error(f"Scheduler failed to run job {job.name}: {str(e)}")
+
+    def run_job(self, name, force=False):
+        """
+        Runs a job now, if this worker can take its lease.
+        With force=True the lease is ignored (used by the CLI).
+        Returns the job's status: 'ok', 'failed', 'timeout' or 'skipped'.
+        """
+        job = self.jobs[name]
+        if job.worker is not None and job.worker.is_alive():
+            # A previous run timed out but has not finished yet
+            job.stats["skipped"] += 1
+            return 'skipped'
+        lease_seconds = job.timeout + LEASE_GRACE_SECONDS
+
+        with self.app.app_context():
+            acquired = acquire_lease(name, self.owner, lease_seconds)
+            if not acquired and not force:
+                job.stats["skipped"] += 1
+                return 'skipped'
+
+            started_at = datetime.utcnow()
+            start = time.perf_counter()
+            status, error = self._run_with_timeout(job)
+            duration_ms = int((time.perf_counter() - start) * 1000)
+
+            job.stats["runs"] += 1
+            job.stats["last_status"] = status
+            job.stats["last_run_at"] = started_at
+            job.stats["last_duration_ms"] = duration_ms
+            if status == 'failed':
+                job.stats["failures"] += 1
+            elif status == 'timeout':
+                job.stats["timeouts"] += 1
+
+            # A job that timed out may still be running: keep its lease until it expires
+            if acquired:
+                record_run(name, self.owner, started_at, duration_ms, status, error,
+                           release=status != 'timeout')
+
+        if status == 'ok':
+            logger.info(f"Job {name} finished in {duration_ms} ms")
+        else:
+            logger.error(f"Job {name} {status} after {duration_ms} ms: {error}")
+        return status
+
+    def _run_with_timeout(self, job):
+        """Runs the job in a worker thread, waiting at most job.timeout seconds."""
+        outcome = {}
+        app = self.app
+
+        def target():
+            try:
+                with app.app_context():
+                    job.func()
+                outcome['status'] = 'ok'
+            except Exception as e:
+                outcome['status'] = 'failed'
+                outcome['error'] = str(e)
+
+        worker = job.worker = threading.Thread(target=target, name=f"job-{job.name}", daemon=True)
+        worker.start()
+        worker.join(job.timeout)
+        if worker.is_alive():
+            return 'timeout', f"exceeded {job.timeout}s"
+        return outcome.get('status', 'failed'), outcome.get('error')
+
+
+def acquire_lease(name, owner, seconds):
+    """
+    Takes the lease on a job for `seconds`.
+    Succeeds when no one holds it, it has expired, or we already hold it.
+    """
+    from sqlalchemy import insert, or_, update
+    from sqlalchemy.exc import IntegrityError
+    from models import JobLease, db
+
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=seconds)
+    table = JobLease.__table__
+
+    with db.engine.begin() as connection:
+        result = connection.execute(
+            update(table)
+            .where(table.c.name == name)
+            .where(or_(table.c.expires_at < now, table.c.owner == owner))
+            .values(owner=owner, expires_at=expires_at)
+        )
+        if result.rowcount == 1:
+            return True
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(insert(table).values(name=name, owner=owner, expires_at=expires_at))
+        return True
+    except IntegrityError:
+        # Someone else holds a live lease
+        return False
+
+
+def record_run(name, owner, started_at, duration_ms, status, error=None, release=True):
+    """Stores last-run metrics for a job and optionally releases its lease."""
+    from sqlalchemy import update
+    from models import JobLease, db
+
+    table = JobLease.__table__
+    values = {
+        'last_started_at': started_at,
+        'last_duration_ms': duration_ms,
+        'last_status': status,
+        'last_error': error,
+        'run_count': table.c.run_count + 1,
+    }
+    if release:
+        values['expires_at'] = datetime.utcnow()
+
+    try:
+        with db.engine.begin() as connection:
+            connection.execute(
+                update(table).where(table.c.name == name, table.c.owner == owner).values(**values)
+            )
+    except Exception as e:
+        logger.error(f"Failed to record run of job {name}: {str(e)}")
+
+
+# Shared scheduler; modules register their jobs with @scheduler.job(...)
+scheduler = Scheduler()
@@ -0,0 +1,197 @@
+from datetime import datetime, timedelta
+import logging
+import secrets
+
+from flask.sessions import SecureCookieSession, SessionInterface, session_json_serializer
+from sqlalchemy import delete, select, update
+
+from db_engines import engines
+from db_retry import retry_on_lock
+from models import ServerSession
+from scheduler import scheduler
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_SESSION_REFRESH_SECONDS = 3600  # SESSION_REFRESH_SECONDS: how stale a stored expiry may get before rewriting it
+DEFAULT_SWEEP_BATCH_SIZE = 1000
+
+
+class StoredSession(SecureCookieSession):
+    """A session whose data lives in the sessions table; the cookie only holds its id."""
+
+    def __init__(self, initial=None, sid=None, expires_at=None):
+        super().__init__(initial)
+        self.new = sid is None
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.expires_at = expires_at
+        # Who the stored session belonged to when this request opened it
+        self.opened_user_id = _session_user_id(initial or {})
+
+    def rotate(self):
+        """Moves the session to a fresh id; the caller deletes the old row."""
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+
+
+def _session_user_id(session):
+    # flask-login keeps '_user_id'; older routes store 'user_id'
+    user_id = session.get('_user_id', session.get('user_id'))
+    try:
+        return int(user_id) if user_id is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+@retry_on_lock(rollback_session=False)
+def _write_session(session, expires_at):
+    """
+    Stores the session; returns False if a known session no longer exists
+    (revoked or swept meanwhile), which is never re-created.
+    """
+    table = ServerSession.__table__
+    values = {
+        'user_id': _session_user_id(session),
+        'data': session_json_serializer.dumps(dict(session)).encode('utf-8'),
+        'expires_at': expires_at,
+        'updated_at': datetime.utcnow(),
+    }
+    with engines.get_engine().begin() as connection:
+        if session.new:
+            connection.execute(table.insert().values(sid=session.sid, **values))
+            return True
+        # Re-inserting a revoked session would undo the sign-out (bans, password resets)
+        return connection.execute(
+            update(table).where(table.c.sid == session.sid).values(**values)
+        ).rowcount > 0
+
+
+@retry_on_lock(rollback_session=False)
+def _delete_session(sid):
+    table = ServerSession.__table__
+    with engines.get_engine().begin() as connection:
+        connection.execute(delete(table).where(table.c.sid == sid))
+
+
+class DatabaseSessionInterface(SessionInterface):
+    """
+    Server-side sessions in the sessions table. Opening a session is one
+    primary-key read; a session is only written when its data changes, or
+    when its stored expiry is more than SESSION_REFRESH_SECONDS behind, so
+    most requests never write. Anonymous visitors get no row at all.
+    A stored session gets a new id whenever its user changes (sign-in,
+    sign-out, switching accounts), so an id planted before sign-in never
+    becomes an authenticated session.
+    """
+
+    serializer = session_json_serializer
+
+    def __init__(self, refresh_seconds=DEFAULT_SESSION_REFRESH_SECONDS):
+        self.refresh = timedelta(seconds=refresh_seconds)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if not sid:
+            return StoredSession()
+        table = ServerSession.__table__
+        with engines.get_engine().connect() as connection:
+            row = connection.execute(
+                select(table.c.data, table.c.expires_at)
+                .where(table.c.sid == sid, table.c.expires_at > datetime.utcnow())
+            ).first()
+        if row is None:
+            # Unknown or expired: start over with a fresh id rather than adopting the client's
+            return StoredSession()
+        try:
+            data = self.serializer.loads(row.data.decode('utf-8'))
+        except ValueError:
+            logger.warning("Discarding unreadable session data")
+            return StoredSession()
+        return StoredSession(data, sid=sid, expires_at=row.expires_at)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        def delete_cookie():
+            response.delete_cookie(name, domain=domain, path=path,
+                                   secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app),
+                                   httponly=self.get_cookie_httponly(app))
+
+        if not session:
+            if session.modified and not session.new:
+                _delete_session(session.sid)
+                delete_cookie()
+            return
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        expires_at = datetime.utcnow() + app.permanent_session_lifetime
+        if not (session.new or session.modified or session.expires_at is None
+                or expires_at - session.expires_at > self.refresh):
+            return
+
+        if not session.new and _session_user_id(session) != session.opened_user_id:
+            old_sid = session.sid
+            session.rotate()
+            _delete_session(old_sid)
+
+        if not _write_session(session, expires_at):
+            # Revoked while this request ran: the client starts over with a fresh anonymous session
+            delete_cookie()
+            return
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
+
+
+def init_app(app):
+    app.session_interface = DatabaseSessionInterface(
+        app.config.get('SESSION_REFRESH_SECONDS', DEFAULT_SESSION_REFRESH_SECONDS)
+    )
+
+
+def revoke_user_sessions(user_id):
+    """Signs a user out everywhere by deleting all their sessions; returns how many there were."""
+    table = ServerSession.__table__
+
+    @retry_on_lock(rollback_session=False)
+    def revoke():
+        with engines.get_engine().begin() as connection:
+            return connection.execute(delete(table).where(table.c.user_id == user_id)).rowcount
+
+    count = revoke()
+    if count:
+        logger.info(f"Revoked {count} sessions of user {user_id}")
+    return count
+
+
+def sweep_expired_sessions(batch_size=DEFAULT_SWEEP_BATCH_SIZE):
+    """Deletes expired sessions in batches (one short transaction each); returns how many."""
+    table = ServerSession.__table__
+    expired = select(table.c.sid).where(table.c.expires_at <= datetime.utcnow()).limit(batch_size)
+    swept = 0
+    while True:
+        with engines.get_engine().begin() as connection:
+            count = connection.execute(delete(table).where(table.c.sid.in_(expired))).rowcount
+        swept += count
+        if count < batch_size:
+            break
+    if swept:
+        logger.info(f"Swept {swept} expired sessions")
+    return swept
+
+
+@scheduler.job('sweep-expired-sessions', interval=900, timeout=300)
+def sweep_expired_sessions_job():
+    """Removes expired sessions so the table only holds live ones."""
+    sweep_expired_sessions()
@@ -0,0 +1,407 @@
+import bisect
+from contextlib import contextmanager
+from collections import defaultdict
+import hashlib
+import heapq
+import logging
+
+from flask import current_app, has_app_context
+from sqlalchemy import bindparam, delete, func, literal_column, select, update
+
+from db_engines import engines
+
+logger = logging.getLogger(__name__)
+
+# Row ids on shard i are congruent to i modulo ID_STRIDE, so any id names its shard
+ID_STRIDE = 64
+MAX_SHARDS = ID_STRIDE
+
+# Tables partitioned across shards (everything else stays on the primary database)
+SHARDED_TABLES = ('messages', 'notifications')
+
+DEFAULT_REBALANCE_BATCH_SIZE = 500
+
+
+def _hash64(key):
+    return int.from_bytes(hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest(), 'big')
+
+
+def jump_hash(key, num_buckets):
+    """
+    Jump consistent hash (Lamping & Veach): maps a 64-bit key to one of
+    `num_buckets` buckets so that going from n to n + 1 buckets moves only
+    1/(n + 1) of the keys.
+    """
+    bucket, j = -1, 0
+    while j < num_buckets:
+        bucket = j
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        j = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+def conversation_key(user_a, user_b=None):
+    """Both directions of a direct conversation share a key (and so a shard)."""
+    if user_b is None:
+        return str(user_a)
+    low, high = sorted((user_a, user_b))
+    return f"{low}:{high}"
+
+
+class ShardMap:
+    """
+    Shard layout from SHARD_DATABASE_URIS: shard i is stored at urls[i].
+    The entry 'primary' (or the primary database URI itself) keeps that
+    shard in the main database; with no shards configured everything is a
+    single shard on the primary.
+    """
+
+    def __init__(self, urls=None):
+        self.urls = list(urls) if urls else ['primary']
+        if len(self.urls) > MAX_SHARDS:
+            raise ValueError(f"At most {MAX_SHARDS} shards are supported")
+
+    @property
+    def num_shards(self):
+        return len(self.urls)
+
+    def shard_for_key(self, key):
+        return jump_hash(_hash64(key), self.num_shards)
+
+    def shard_for_user(self, user_id):
+        return self.shard_for_key(f"user:{user_id}")
+
+    def shard_for_conversation(self, user_a, user_b=None):
+        return self.shard_for_key(f"conversation:{conversation_key(user_a, user_b)}")
+
+    def shard_for_group(self, group_id):
+        """All of a group's messages live on one shard, stored once whatever the group's size."""
+        return self.shard_for_key(f"group:{group_id}")
+
+    def shard_for_row(self, table_name, row):
+        """Returns the shard a row belongs on, from its routing columns."""
+        if table_name == 'messages':
+            if row.get('group_id') is not None:
+                return self.shard_for_group(row['group_id'])
+            return self.shard_for_conversation(row['sender_id'], row['receiver_id'])
+        return self.shard_for_user(row['user_id'])
+
+    def shard_for_id(self, row_id):
+        """Returns the shard holding `row_id`, or None if no shard can."""
+        if self.num_shards == 1:
+            return 0
+        index = row_id % ID_STRIDE
+        return index if index < self.num_shards else None
+
+    def is_placed(self, table_name, row, index):
+        """True if the row is on its shard with an id that routes back to it."""
+        if self.num_shards == 1:
+            return True
+        return self.shard_for_row(table_name, row) == index and row['id'] % ID_STRIDE == index
+
+
+def _shard_engine_factory(url):
+    def factory(app):
+        if url in ('primary', app.config.get('SQLALCHEMY_DATABASE_URI')):
+            return None, {}
+        return url, {}
+    return factory
+
+
+def _create_shard_tables(engine):
+    from models import db
+    for table_name in SHARDED_TABLES:
+        db.metadata.tables[table_name].create(engine, checkfirst=True)
+
+
+def init_app(app):
+    """Builds the shard map and registers an engine per shard ('shard-0', ...)."""
+    shard_map = ShardMap(app.config.get('SHARD_DATABASE_URIS'))
+    app.extensions['shard_map'] = shard_map
+    for index, url in enumerate(shard_map.urls):
+        engines.register(f'shard-{index}', _shard_engine_factory(url), _create_shard_tables)
+    logger.info(f"Sharding {', '.join(SHARDED_TABLES)} across {shard_map.num_shards} shard(s)")
+
+
+def get_shard_map():
+    """Returns the app's shard map (a single primary shard if sharding was never set up)."""
+    if has_app_context() and 'shard_map' in current_app.extensions:
+        return current_app.extensions['shard_map']
+    return ShardMap()
+
+
+def shard_engine(index):
+    if has_app_context() and 'shard_map' in current_app.extensions:
+        return engines.get_engine(f'shard-{index}')
+    return engines.get_engine('primary')
+
+
+def _table(table_name):
+    from models import db
+    return db.metadata.tables[table_name]
+
+
+def _next_id(table, index):
+    # Evaluated inside the INSERT, which already holds the shard's write lock
+    return select(
+        literal_column(f"(COALESCE(MAX(id), 0) / {ID_STRIDE} + 1) * {ID_STRIDE} + {index}")
+    ).select_from(table).scalar_subquery()
+
+
+@contextmanager
+def _shard_writer(index):
+    """
+    Connection for writes to one shard. A shard stored in the primary
+    database joins db.session's transaction (and so the request's unit of
+    work) instead of contending with it for the write lock. Other shards
+    enlist in the unit of work, so they commit or roll back with the
+    request; outside one they commit straight away.
+    """
+    from unit_of_work import commit_or_flush, current_unit_of_work, note_write
+    engine = shard_engine(index)
+    if engine is engines.get_engine('primary'):
+        from models import db
+        try:
+            yield db.session
+            note_write()
+            commit_or_flush()
+        except Exception:
+            # Inside a unit of work the unit decides; outside, this write owns the transaction
+            if current_unit_of_work() is None:
+                db.session.rollback()
+            raise
+        return
+    uow = current_unit_of_work()
+    if uow is None:
+        with engine.begin() as connection:
+            yield connection
+    else:
+        yield uow.enlist(engine)
+        note_write()
+
+
+@contextmanager
+def _shard_reader(index):
+    from unit_of_work import current_unit_of_work
+    engine = shard_engine(index)
+    if engine is engines.get_engine('primary'):
+        from read_routing import read_session
+        yield read_session()
+        return
+    uow = current_unit_of_work()
+    if uow is not None and engine in uow.connections:
+        # See the request's own uncommitted writes
+        yield uow.connections[engine]
+    else:
+        with engine.connect() as connection:
+            yield connection
+
+
+def _insert_statement(table, index):
+    statement = table.insert()
+    if get_shard_map().num_shards > 1:
+        statement = statement.values(id=_next_id(table, index))
+    return statement
+
+
+def insert_row(table_name, row):
+    """Inserts one row (a dict) into the shard it routes to and returns its id."""
+    index = get_shard_map().shard_for_row(table_name, row)
+    with _shard_writer(index) as connection:
+        return connection.execute(_insert_statement(_table(table_name), index), row).lastrowid
+
+
+def insert_rows(table_name, rows):
+    """Inserts many rows (dicts) into the shards they route to, one executemany per shard."""
+    shard_map = get_shard_map()
+    table = _table(table_name)
+    by_shard = defaultdict(list)
+    for row in rows:
+        by_shard[shard_map.shard_for_row(table_name, row)].append(row)
+    for index, shard_rows in by_shard.items():
+        with _shard_writer(index) as connection:
+            connection.execute(_insert_statement(table, index), shard_rows)
+
+
+def execute_on_shard(index, statement, params=None):
+    """Runs a read on one shard and returns its rows."""
+    with _shard_reader(index) as connection:
+        return connection.execute(statement, params or {}).fetchall()
+
+
+def execute_write(index, statement, params=None):
+    """Runs an UPDATE/DELETE on one shard and returns the affected row count."""
+    with _shard_writer(index) as connection:
+        return connection.execute(statement, params or {}).rowcount
+
+
+def get_rows_by_id(table_name, row_ids):
+    """Fetches rows by id with one query per shard involved; returns {id: row}."""
+    shard_map = get_shard_map()
+    table = _table(table_name)
+    by_shard = defaultdict(list)
+    for row_id in set(row_ids):
+        index = shard_map.shard_for_id(row_id)
+        if index is not None:
+            by_shard[index].append(row_id)
+    rows = {}
+    for index, ids in by_shard.items():
+        for row in execute_on_shard(index, select(table).where(table.c.id.in_(ids))):
+            rows[row.id] = row
+    return rows
+
+
+def update_row_by_id(table_name, row_id, values):
+    """Updates one row on the shard its id names; returns True if it existed."""
+    index = get_shard_map().shard_for_id(row_id)
+    if index is None:
+        return False
+    table = _table(table_name)
+    return execute_write(index, update(table).where(table.c.id == row_id).values(**values)) > 0
+
+
+def delete_row_by_id(table_name, row_id):
+    """Deletes one row from the shard its id names; returns True if it existed."""
+    index = get_shard_map().shard_for_id(row_id)
+    if index is None:
+        return False
+    table = _table(table_name)
+    return execute_write(index, delete(table).where(table.c.id == row_id)) > 0
+
+
+def scatter(statement, params=None):
+    """Runs a read on every shard and returns all rows (in shard order)."""
+    rows = []
+    for index in range(get_shard_map().num_shards):
+        rows.extend(execute_on_shard(index, statement, params))
+    return rows
+
+
+def scatter_sum(statement, params=None):
+    """Sums a single-value aggregate (COUNT, SUM) over every shard."""
+    return sum(row[0] or 0 for row in scatter(statement, params))
+
+
+def scatter_top(statement, limit, key, params=None):
+    """
+    Merges per-shard top-N results: `statement` must already be ordered by
+    `key` descending and limited to `limit` rows on each shard.
+    """
+    return heapq.nlargest(limit, scatter(statement, params), key=key)
+
+
+def count_rows(table_name):
+    """Total row count of a sharded table."""
+    return scatter_sum(select(func.count()).select_from(_table(table_name)))
+
+
+def rebalance(batch_size=DEFAULT_REBALANCE_BATCH_SIZE, dry_run=False):
+    """
+    Moves every row that is not on the shard the current shard map routes
+    it to (after adding shards, or for rows written before sharding) and
+    gives it an id on its new shard. References to moved messages follow
+    them: flagged_content.message_id and group read cursors (whose cached
+    unread counts are dropped, to be recounted on read). New message ids
+    start above every archived id, so they never shadow an archived message.
+    Meant to run offline: copies commit before the source rows are deleted,
+    so stop the app and back up the shards first.
+
+    Returns {table_name: rows moved (or, with dry_run, to be moved)}.
+    """
+    shard_map = get_shard_map()
+    primary = engines.get_engine('primary')
+    flags = _table('flagged_content')
+    partitions = _table('message_archive_partitions')
+    # Flags are re-pointed by flag id at the end: a moved message's new id
+    # may equal an id that another message is about to move away from
+    with primary.connect() as connection:
+        flag_targets = dict(connection.execute(select(flags.c.id, flags.c.message_id)).fetchall())
+        archived_max_id = connection.execute(select(func.max(partitions.c.max_message_id))).scalar() or 0
+    message_ids = {}
+    group_message_ids = defaultdict(dict)
+    moved = {}
+    for table_name in SHARDED_TABLES:
+        table = _table(table_name)
+        id_floor = archived_max_id if table_name == 'messages' else 0
+        next_ids = {}
+        moved[table_name] = 0
+        for source in range(shard_map.num_shards):
+            source_engine = shard_engine(source)
+            last_id = 0
+            while True:
+                with source_engine.connect() as connection:
+                    batch = connection.execute(
+                        select(table).where(table.c.id > last_id).order_by(table.c.id).limit(batch_size)
+                    ).mappings().all()
+                if not batch:
+                    break
+                last_id = batch[-1]['id']
+
+                by_target = defaultdict(list)
+                for row in batch:
+                    if not shard_map.is_placed(table_name, row, source):
+                        by_target[shard_map.shard_for_row(table_name, row)].append(dict(row))
+                for target, rows in by_target.items():
+                    moved[table_name] += len(rows)
+                    if dry_run:
+                        continue
+                    new_ids = {}
+                    with shard_engine(target).begin() as connection:
+                        if target not in next_ids:
+                            highest = max(connection.execute(select(func.max(table.c.id))).scalar() or 0, id_floor)
+                            next_ids[target] = (highest // ID_STRIDE + 1) * ID_STRIDE + target
+                        for row in rows:
+                            new_ids[row['id']] = next_ids[target]
+                            if row.get('group_id') is not None:
+                                group_message_ids[row['group_id']][row['id']] = next_ids[target]
+                            row['id'] = next_ids[target]
+                            next_ids[target] += ID_STRIDE
+                        connection.execute(table.insert(), rows)
+                    if table_name == 'messages':
+                        message_ids.update(new_ids)
+                    with source_engine.begin() as connection:
+                        connection.execute(delete(table).where(table.c.id.in_(list(new_ids))))
+            logger.info(f"Rebalanced {table_name} on shard {source}")
+
+    remapped = [
+        {'flag_id': flag_id, 'new_message_id': message_ids[message_id]}
+        for flag_id, message_id in flag_targets.items() if message_id in message_ids
+    ]
+    if remapped:
+        with primary.begin() as connection:
+            connection.execute(
+                update(flags).where(flags.c.id == bindparam('flag_id')).values(message_id=bindparam('new_message_id')),
+                remapped
+            )
+    if group_message_ids:
+        _remap_read_cursors(primary, group_message_ids)
+    return moved
+
+
+def _remap_read_cursors(primary, group_message_ids):
+    """
+    Moves group read cursors onto the new ids of the messages they had read
+    through; {group_id: {old message id: new id}} lists the moved messages.
+    """
+    cursors = _table('group_read_cursors')
+    updates = []
+    with primary.begin() as connection:
+        for group_id, new_ids in group_message_ids.items():
+            old_ids = sorted(new_ids)
+            rows = connection.execute(
+                select(cursors.c.user_id, cursors.c.last_read_message_id).where(cursors.c.group_id == group_id)
+            ).fetchall()
+            for user_id, last_read in rows:
+                read = bisect.bisect_right(old_ids, last_read)
+                # Moved messages get ids above the group's unmoved ones, so the cursor can
+                # stay below them (nothing moved was read) or sit on the last one read
+                last_read = new_ids[old_ids[read - 1]] if read else min(last_read, min(new_ids.values()) - 1)
+                updates.append({'cursor_user_id': user_id, 'cursor_group_id': group_id, 'last_read': last_read})
+        if updates:
+            connection.execute(
+                update(cursors)
+                .where(cursors.c.user_id == bindparam('cursor_user_id'),
+                       cursors.c.group_id == bindparam('cursor_group_id'))
+                .values(last_read_message_id=bindparam('last_read'), unread_count=None, counted_through_id=None),
+                updates
+            )
@@ -0,0 +1,417 @@
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import logging
+import time
+
+import numpy as np
+from sqlalchemy import bindparam, func, select
+from werkzeug.security import generate_password_hash
+
+from db_engines import engines
+from models import ActivityLog, FlaggedContent, Group, GroupMembership, Message, Notification, User
+import sharding
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the generate-data command
+DEFAULT_BATCH_SIZE = 20000
+DEFAULT_ZIPF_EXPONENT = 1.1   # activity skew: the k-th most active user is ~k^-s as active as the first
+DEFAULT_DAYS = 365
+DEFAULT_SEED = 42
+
+FIRST_NAMES = ['James', 'Mary', 'Wei', 'Aisha', 'Carlos', 'Yuki', 'Olga', 'Kwame', 'Priya', 'Liam',
+               'Sofia', 'Mateo', 'Chloe', 'Omar', 'Ingrid', 'Ravi', 'Fatima', 'Noah', 'Hana', 'Lucas']
+LAST_NAMES = ['Smith', 'Garcia', 'Chen', 'Okafor', 'Silva', 'Tanaka', 'Ivanova', 'Mensah', 'Patel', 'Murphy',
+              'Rossi', 'Lopez', 'Martin', 'Haddad', 'Larsen', 'Kumar', 'Khan', 'Brown', 'Kim', 'Muller']
+WORDS = ('hey hi ok sure thanks see you tomorrow meeting lunch later call me running late sounds good '
+         'what about the project deadline friday weekend plans coffee at noon did you get my email '
+         'great idea let me check sorry can not make it happy birthday congrats').split()
+FLAG_REASONS = ['spam', 'harassment', 'inappropriate content', 'scam', 'hate speech', 'other']
+NOTIFICATION_TYPES = ['message', 'admin_alert', 'flagged_content', 'report', 'ban', 'suspend']
+ACTIVITY_ACTIONS = ['login', 'logout', 'send_message', 'update_profile', 'join_group', 'leave_group', 'flag_content']
+
+# Pre-built message bodies, picked at random (building text per row would dominate the run time)
+CONTENT_POOL_SIZE = 10000
+
+
+class PowerLawSampler:
+    """Draws user ids so that activity follows a Zipf-like law over a shuffled ranking of users."""
+
+    def __init__(self, rng, user_ids, exponent):
+        self.rng = rng
+        self.user_ids = rng.permutation(np.asarray(user_ids))
+        weights = 1.0 / np.arange(1, len(self.user_ids) + 1) ** exponent
+        self.cumulative = np.cumsum(weights / weights.sum())
+
+    def sample(self, size):
+        ranks = np.searchsorted(self.cumulative, self.rng.random(size), side='right')
+        return self.user_ids[np.minimum(ranks, len(self.user_ids) - 1)]
+
+
+def _rng(seed, stream):
+    # One independent stream per table, so changing one count does not reshuffle the others
+    return np.random.default_rng([seed, stream])
+
+
+def _random_times(rng, size, start, end):
+    span_us = int((end - start).total_seconds() * 1e6)
+    return np.datetime64(start, 'us') + rng.integers(span_us, size=size).astype('timedelta64[us]')
+
+
+def _format_times(times):
+    # The DATETIME text SQLAlchemy stores for SQLite, built for a whole batch at once
+    if not len(times):
+        return []
+    return np.char.replace(np.datetime_as_string(times, unit='us'), 'T', ' ').tolist()
+
+
+def _format_time(when):
+    return when.strftime('%Y-%m-%d %H:%M:%S.%f')
+
+
+def _batches(total, batch_size):
+    for offset in range(0, total, batch_size):
+        yield offset, min(batch_size, total - offset)
+
+
+class BulkInserter:
+    """
+    Inserts tuples with one driver-level executemany per batch, skipping
+    SQLAlchemy's per-row parameter processing, so values must already be
+    in storage form (timestamps as text, booleans as 0/1). Each batch
+    commits on its own.
+    """
+
+    def __init__(self, table, columns):
+        self.table = table
+        self.columns = tuple(columns)
+        self._statements = {}
+
+    def _statement(self, engine):
+        if engine not in self._statements:
+            compiled = self.table.insert().values({name: bindparam(name) for name in self.columns}).compile(
+                dialect=engine.dialect)
+            if list(compiled.positiontup or ()) != list(self.columns):
+                raise ValueError(f"Bulk inserts need a positional paramstyle (got '{engine.dialect.paramstyle}')")
+            self._statements[engine] = str(compiled)
+        return self._statements[engine]
+
+    def insert(self, rows, engine=None):
+        engine = engine or engines.get_engine()
+        with engine.begin() as connection:
+            connection.exec_driver_sql(self._statement(engine), rows)
+        return len(rows)
+
+
+class ShardedBulkInserter(BulkInserter):
+    """
+    BulkInserter for a sharded table. Rows are routed with the shard map
+    (memoized per routing key) and given ids here, in each shard's id
+    sequence, so the load must run while the app is stopped. Keeps the
+    range of ids it handed out on each shard.
+    """
+
+    def __init__(self, table, columns, routing_key):
+        super().__init__(table, ('id',) + tuple(columns))
+        self.routing_key = routing_key
+        self.shard_map = sharding.get_shard_map()
+        self.stride = sharding.ID_STRIDE if self.shard_map.num_shards > 1 else 1
+        self._shard_of = {}
+        self.id_ranges = {}  # shard index -> [first id, last id]
+
+    def _shard(self, row):
+        key = self.routing_key(row)
+        index = self._shard_of.get(key)
+        if index is None:
+            index = self._shard_of[key] = self.shard_map.shard_for_key(key)
+        return index
+
+    def _allocate(self, index, count):
+        offset = index if self.stride > 1 else 0
+        if index in self.id_ranges:
+            first = self.id_ranges[index][1] + self.stride
+        else:
+            current = _max_id(self.table, sharding.shard_engine(index))
+            first = (current // self.stride + 1) * self.stride + offset
+            self.id_ranges[index] = [first, first]
+        last = first + (count - 1) * self.stride
+        self.id_ranges[index][1] = last
+        return range(first, last + 1, self.stride)
+
+    def insert(self, rows, engine=None):
+        by_shard = {}
+        if self.shard_map.num_shards == 1:
+            by_shard[0] = rows
+        else:
+            for row in rows:
+                by_shard.setdefault(self._shard(row), []).append(row)
+        for index, shard_rows in by_shard.items():
+            super().insert(
+                [(row_id,) + row for row_id, row in zip(self._allocate(index, len(shard_rows)), shard_rows)],
+                sharding.shard_engine(index),
+            )
+        return len(rows)
+
+
+def _table_engines(table):
+    if table.name in sharding.SHARDED_TABLES:
+        return {sharding.shard_engine(index) for index in range(sharding.get_shard_map().num_shards)}
+    return {engines.get_engine()}
+
+
+def _count_rows(table):
+    total = 0
+    for engine in _table_engines(table):
+        with engine.connect() as connection:
+            total += connection.execute(select(func.count()).select_from(table)).scalar()
+    return total
+
+
+def _max_id(table, engine=None):
+    with (engine or engines.get_engine()).connect() as connection:
+        return connection.execute(select(func.coalesce(func.max(table.c.id), 0))).scalar()
+
+
+@contextmanager
+def secondary_indexes_dropped(tables):
+    """
+    Drops the tables' secondary indexes for the duration of a bulk load and
+    rebuilds them afterwards: building an index once is several times
+    faster than maintaining it through millions of random inserts.
+    """
+    dropped = []
+    for table in tables:
+        for engine in _table_engines(table):
+            for index in table.indexes:
+                index.drop(engine, checkfirst=True)
+                dropped.append((index, engine))
+    try:
+        yield
+    finally:
+        started = time.perf_counter()
+        for index, engine in dropped:
+            index.create(engine, checkfirst=True)
+        if dropped:
+            logger.info(f"Rebuilt {len(dropped)} indexes in {time.perf_counter() - started:.1f} s")
+
+
+class _Progress:
+    def __init__(self, name):
+        self.name = name
+        self.rows = 0
+        self.started = time.perf_counter()
+
+    def add(self, count):
+        self.rows += count
+
+    def finish(self):
+        elapsed = time.perf_counter() - self.started
+        logger.info(f"{self.name}: {self.rows} rows in {elapsed:.1f} s ({self.rows / max(elapsed, 1e-9):,.0f} rows/s)")
+        return self.rows
+
+
+def generate_users(count, seed, start, end, batch_size):
+    """Inserts users with ids after the current maximum; returns their ids."""
+    rng = _rng(seed, 1)
+    first_id = _max_id(User.__table__) + 1
+    # One cheap shared hash: every generated user's password is 'password'
+    password_hash = generate_password_hash('password', method='pbkdf2:sha256:1000')
+    suspended_until = _format_time(end + timedelta(days=30))
+    end_time = np.datetime64(end, 'us')
+    inserter = BulkInserter(User.__table__, (
+        'id', 'username', 'email', 'first_name', 'last_name', 'password_hash', 'security_question',
+        'security_answer_hash', 'role', 'is_banned', 'moderation_status', 'suspended_until', 'last_login',
+        'created_at', 'updated_at',
+    ))
+    progress = _Progress('users')
+    for offset, size in _batches(count, batch_size):
+        created = _random_times(rng, size, start, end)
+        status = rng.random(size)
+        last_login = _format_times(created + ((end_time - created) * rng.random(size)).astype('timedelta64[us]'))
+        created = _format_times(created)
+        first_names = rng.integers(len(FIRST_NAMES), size=size).tolist()
+        last_names = rng.integers(len(LAST_NAMES), size=size).tolist()
+        rows = []
+        for i, user_id in enumerate(range(first_id + offset, first_id + offset + size)):
+            # The first generated user is an admin, then about 1 in 1000; 0.5% banned, 0.5% suspended
+            rows.append((
+                user_id, f'user{user_id}', f'user{user_id}@example.com', FIRST_NAMES[first_names[i]],
+                LAST_NAMES[last_names[i]], password_hash, 'What was the name of your first pet?', password_hash,
+                'admin' if user_id == first_id or status[i] < 0.001 else 'user',
+                int(0.001 <= status[i] < 0.006),
+                'banned' if 0.001 <= status[i] < 0.006 else 'suspended' if 0.006 <= status[i] < 0.011 else None,
+                suspended_until if 0.006 <= status[i] < 0.011 else None,
+                last_login[i], created[i], created[i],
+            ))
+        progress.add(inserter.insert(rows))
+    progress.finish()
+    return np.arange(first_id, first_id + count)
+
+
+def generate_messages(count, user_ids, seed, start, end, batch_size, exponent):
+    """
+    Inserts direct messages with power-law senders and receivers onto their
+    shards. Returns {shard index: [first id, last id]} of the new messages.
+    """
+    rng = _rng(seed, 2)
+    senders = PowerLawSampler(rng, user_ids, exponent)
+    receivers = PowerLawSampler(rng, user_ids, exponent)
+    content = [' '.join(rng.choice(WORDS, size=rng.integers(2, 16))) for _ in range(CONTENT_POOL_SIZE)]
+    inserter = ShardedBulkInserter(
+        Message.__table__, ('sender_id', 'receiver_id', 'content', 'created_at', 'deleted'),
+        routing_key=lambda row: f"conversation:{sharding.conversation_key(row[0], row[1])}",
+    )
+    progress = _Progress('messages')
+    for _, size in _batches(count, batch_size):
+        sender_ids = senders.sample(size)
+        receiver_ids = receivers.sample(size)
+        # Nobody messages themselves: move those to the next user over
+        same = sender_ids == receiver_ids
+        receiver_ids[same] = user_ids[(np.searchsorted(user_ids, receiver_ids[same]) + 1) % len(user_ids)]
+        texts = rng.integers(CONTENT_POOL_SIZE, size=size).tolist()
+        progress.add(inserter.insert([
+            (sender, receiver, content[text], created, 0)
+            for sender, receiver, text, created in zip(
+                sender_ids.tolist(), receiver_ids.tolist(), texts, _format_times(_random_times(rng, size, start, end)))
+        ]))
+    progress.finish()
+    return inserter.id_ranges
+
+
+def generate_groups(count, user_ids, seed, start, end, batch_size, exponent):
+    """Inserts groups whose sizes follow a Pareto law, and their memberships. Returns both counts."""
+    rng = _rng(seed, 3)
+    creators = PowerLawSampler(rng, user_ids, exponent)
+    first_id = _max_id(Group.__table__) + 1
+    creator_ids = creators.sample(count).tolist()
+    created = _format_times(_random_times(rng, count, start, end))
+    groups = BulkInserter(Group.__table__, ('id', 'name', 'created_by', 'created_at'))
+    for offset, size in _batches(count, batch_size):
+        groups.insert([
+            (first_id + i, f'group-{first_id + i}', creator_ids[i], created[i]) for i in range(offset, offset + size)
+        ])
+
+    # Most groups are small and a few are huge; the creator is always a member
+    sizes = np.minimum(np.ceil(rng.pareto(1.5, size=count) * 3 + 1).astype(int), len(user_ids)).tolist()
+    memberships = BulkInserter(GroupMembership.__table__, ('group_id', 'user_id'))
+    progress = _Progress('group memberships')
+    rows = []
+    for i, size in enumerate(sizes):
+        members = set(rng.choice(user_ids, size=size, replace=False).tolist())
+        members.add(creator_ids[i])
+        rows.extend((first_id + i, user_id) for user_id in sorted(members))
+        if len(rows) >= batch_size:
+            progress.add(memberships.insert(rows))
+            rows = []
+    if rows:
+        progress.add(memberships.insert(rows))
+    return count, progress.finish()
+
+
+def generate_flags(count, user_ids, message_id_ranges, seed, start, end, batch_size):
+    """Flags random messages among those just generated (drawn from each shard's new id range)."""
+    if not message_id_ranges:
+        return 0
+    rng = _rng(seed, 4)
+    stride = sharding.ID_STRIDE if sharding.get_shard_map().num_shards > 1 else 1
+    # Per shard: first id and number of ids, all of which exist (the generator's ids have no gaps)
+    ranges = [(first, (last - first) // stride + 1) for _, (first, last) in sorted(message_id_ranges.items())]
+    sizes = np.array([size for _, size in ranges], dtype=float)
+    reviewer = int(user_ids[0])  # the generated admin
+    inserter = BulkInserter(FlaggedContent.__table__, (
+        'message_id', 'user_id', 'reason', 'created_at', 'reviewed', 'reviewed_by', 'reviewed_at',
+    ))
+    progress = _Progress('flags')
+    for _, size in _batches(count, batch_size):
+        shards = rng.choice(len(ranges), size=size, p=sizes / sizes.sum()).tolist()
+        positions = rng.random(size).tolist()
+        reporters = rng.choice(user_ids, size=size).tolist()
+        reasons = rng.integers(len(FLAG_REASONS), size=size).tolist()
+        reviewed = (rng.random(size) < 0.6).tolist()
+        created = _random_times(rng, size, start, end)
+        reviewed_at = _format_times(created + np.timedelta64(6, 'h'))
+        created = _format_times(created)
+        rows = []
+        for i in range(size):
+            first, shard_size = ranges[shards[i]]
+            rows.append((
+                first + int(positions[i] * shard_size) * stride, reporters[i], FLAG_REASONS[reasons[i]], created[i],
+                int(reviewed[i]), reviewer if reviewed[i] else None, reviewed_at[i] if reviewed[i] else None,
+            ))
+        progress.add(inserter.insert(rows))
+    return progress.finish()
+
+
+def generate_notifications(count, user_ids, seed, start, end, batch_size, exponent):
+    rng = _rng(seed, 5)
+    recipients = PowerLawSampler(rng, user_ids, exponent)
+    inserter = ShardedBulkInserter(
+        Notification.__table__, ('user_id', 'type', 'message', 'is_read', 'created_at'),
+        routing_key=lambda row: f"user:{row[0]}",
+    )
+    progress = _Progress('notifications')
+    for _, size in _batches(count, batch_size):
+        kinds = rng.integers(len(NOTIFICATION_TYPES), size=size).tolist()
+        read = (rng.random(size) < 0.7).tolist()
+        progress.add(inserter.insert([
+            (user_id, NOTIFICATION_TYPES[kind], f'Synthetic {NOTIFICATION_TYPES[kind]} notification', int(is_read),
+             created)
+            for user_id, kind, is_read, created in zip(
+                recipients.sample(size).tolist(), kinds, read, _format_times(_random_times(rng, size, start, end)))
+        ]))
+    return progress.finish()
+
+
+def generate_activity_logs(count, user_ids, seed, start, end, batch_size, exponent):
+    rng = _rng(seed, 6)
+    actors = PowerLawSampler(rng, user_ids, exponent)
+    inserter = BulkInserter(ActivityLog.__table__, ('user_id', 'action', 'timestamp'))
+    progress = _Progress('activity logs')
+    for _, size in _batches(count, batch_size):
+        actions = rng.integers(len(ACTIVITY_ACTIONS), size=size).tolist()
+        progress.add(inserter.insert([
+            (user_id, ACTIVITY_ACTIONS[action], timestamp)
+            for user_id, action, timestamp in zip(
+                actors.sample(size).tolist(), actions, _format_times(_random_times(rng, size, start, end)))
+        ]))
+    return progress.finish()
+
+
+def generate_dataset(users=1000, messages=10000, groups=100, flags=100, notifications=1000, activity_logs=1000,
+                     seed=DEFAULT_SEED, days=DEFAULT_DAYS, end=None, batch_size=DEFAULT_BATCH_SIZE,
+                     exponent=DEFAULT_ZIPF_EXPONENT, drop_indexes=None):
+    """
+    Appends a synthetic dataset with batched executemany inserts; run it
+    with the app stopped. The same seed, counts and `end` (default: the
+    start of today, UTC) produce the same rows on the same starting data.
+
+    Secondary indexes are dropped during the load and rebuilt at the end
+    when `drop_indexes` is true, or by default when the load at least
+    doubles the messages table. Returns {table: rows added}.
+    """
+    if users < 2:
+        raise ValueError("At least 2 users are needed to generate messages")
+    end = end or datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    start = end - timedelta(days=days)
+    tables = [User.__table__, Message.__table__, GroupMembership.__table__, FlaggedContent.__table__,
+              Notification.__table__, ActivityLog.__table__]
+    if drop_indexes is None:
+        drop_indexes = messages >= _count_rows(Message.__table__)
+
+    started = time.perf_counter()
+    with secondary_indexes_dropped(tables if drop_indexes else []):
+        user_ids = generate_users(users, seed, start, end, batch_size)
+        counts = {'users': len(user_ids)}
+        message_id_ranges = generate_messages(messages, user_ids, seed, start, end, batch_size, exponent)
+        counts['messages'] = messages
+        counts['groups'], counts['group_memberships'] = generate_groups(
+            groups, user_ids, seed, start, end, batch_size, exponent)
+        counts['flagged_content'] = generate_flags(flags, user_ids, message_id_ranges, seed, start, end, batch_size)
+        counts['notifications'] = generate_notifications(
+            notifications, user_ids, seed, start, end, batch_size, exponent)
+        counts['activity_logs'] = generate_activity_logs(
+            activity_logs, user_ids, seed, start, end, batch_size, exponent)
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    logger.info(f"Generated {total} rows in {elapsed:.1f} s ({total / max(elapsed, 1e-9):,.0f} rows/s overall)")
+    return counts
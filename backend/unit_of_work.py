@@ -0,0 +1,143 @@
+from contextlib import contextmanager
+from functools import wraps
+import logging
+
+from flask import g, has_app_context
+from sqlalchemy import event
+
+from models import db
+
+logger = logging.getLogger(__name__)
+
+
+class UnitOfWork:
+    """Writes enlisted by one request (or job), committed together at the end."""
+
+    def __init__(self):
+        self.hooks = []
+        # True once the transaction has sent writes to the database, after
+        # which a failed statement can no longer be retried on its own
+        self.has_writes = False
+        # Open transactions on databases other than db.session's (e.g. shards), by engine
+        self.connections = {}
+
+    def enlist(self, engine):
+        """Returns a connection to `engine` whose transaction commits or rolls back with this unit of work."""
+        connection = self.connections.get(engine)
+        if connection is None:
+            connection = engine.connect()
+            connection.begin()
+            self.connections[engine] = connection
+        return connection
+
+    def _end_connections(self, commit):
+        connections, self.connections = self.connections, {}
+        for engine, connection in connections.items():
+            try:
+                if commit:
+                    connection.commit()
+                else:
+                    connection.rollback()
+            except Exception as e:
+                logger.error(f"Failed to {'commit' if commit else 'roll back'} {engine.url}: {str(e)}")
+            finally:
+                connection.close()
+
+
+def current_unit_of_work():
+    """Returns the active unit of work, or None."""
+    if has_app_context():
+        return g.get('unit_of_work')
+    return None
+
+
+@contextmanager
+def unit_of_work():
+    """
+    Runs the block as one transaction: helpers that call commit_or_flush()
+    only flush, and db.session is committed once when the block exits
+    (rolled back if it raises). after_commit() hooks run after that commit.
+    Nested blocks join the outer unit of work.
+
+    Connections enlisted for other databases (shards) commit right after
+    db.session and roll back with it. This is not two-phase commit: if a
+    shard fails to commit after db.session did, that shard's writes are
+    lost and the error is logged.
+    """
+    current = current_unit_of_work()
+    if current is not None:
+        yield current
+        return
+
+    uow = g.unit_of_work = UnitOfWork()
+    try:
+        yield uow
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        uow._end_connections(commit=False)
+        raise
+    finally:
+        g.pop('unit_of_work', None)
+    uow._end_connections(commit=True)
+
+    for hook, args, kwargs in uow.hooks:
+        try:
+            hook(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"after_commit hook {getattr(hook, '__name__', hook)} failed: {str(e)}")
+
+
+def transactional(f):
+    """Decorator that runs a view inside a unit of work (one commit per request)."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        with unit_of_work():
+            return f(*args, **kwargs)
+    return decorated
+
+
+def commit_or_flush():
+    """
+    Commits db.session, or inside a unit of work flushes it and leaves the
+    commit to the end of the request.
+    """
+    if current_unit_of_work() is not None:
+        db.session.flush()
+    else:
+        db.session.commit()
+
+
+def after_commit(hook, *args, **kwargs):
+    """
+    Runs `hook(*args, **kwargs)` once the current unit of work commits, or
+    right away outside one. Hooks are dropped if the transaction rolls back.
+    """
+    uow = current_unit_of_work()
+    if uow is None:
+        hook(*args, **kwargs)
+    else:
+        uow.hooks.append((hook, args, kwargs))
+
+
+def note_write():
+    """Records that the current unit of work wrote outside the ORM (e.g. raw SQL)."""
+    uow = current_unit_of_work()
+    if uow is not None:
+        uow.has_writes = True
+
+
+@event.listens_for(db.session, 'after_flush')
+def _after_flush(session, flush_context):
+    uow = current_unit_of_work()
+    if uow is not None and session is db.session():
+        uow.has_writes = True
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _after_rollback(session):
+    uow = current_unit_of_work()
+    if uow is not None and session is db.session():
+        uow.hooks.clear()
+        uow.has_writes = False
+        uow._end_connections(commit=False)
@@ -1,8 +1,21 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash
+from flask import Blueprint, jsonify, render_template, request, redirect, url_for, flash
 from flask_login import login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
+from active_users import maybe_flush_active_user_sketches, record_active_user
+from db_retry import retry_on_lock
+from group_membership import (
+    add_members, create_group as create_group_with_members, existing_user_ids, is_member, remove_members,
+)
+from group_messages import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, get_group_messages, mark_group_read, post_group_message, unread_counts,
+)
+from login_throttling import account_key, ip_key, login_throttle
 from models import User, db, Group, GroupMembership
+from password_hashing import password_hasher
+from presence import MAX_CONTACTS, presence_tracker
+from session_store import revoke_user_sessions
+from unit_of_work import transactional
+from user_search import DEFAULT_SEARCH_LIMIT, user_search_index
 from app import db
 from app import chat_bp
 from models import Group, GroupMembership
@@ -10,6 +23,14 @@ from models import Group, GroupMembership
 # Blueprint setup
 user_auth_bp = Blueprint('user_auth_bp', __name__)
 group_bp = Blueprint('group_bp', __name__)
+dashboard_bp = Blueprint('dashboard', __name__)
+
+# Most results a single search may ask for
+MAX_SEARCH_LIMIT = 50
+# Most members a single bulk add/remove may name
+MAX_BULK_MEMBERS = 100000
+# Longest group message accepted
+MAX_GROUP_MESSAGE_LENGTH = 5000
 
 # Registration Route
 @user_auth_bp.route('/register', methods=['GET', 'POST'])
@@ -30,12 +51,16 @@ def register():
             flash('Email already registered.', 'error')
             return redirect(url_for('user_auth_bp.register'))
 
-        try:
+        # Hashed on the hashing pool; a 503 is returned if it is saturated
+        password_hash = password_hasher.hash_password(password)
+
+        @retry_on_lock
+        def save_user():
             new_user = User(
                 first_name=first_name,
                 last_name=last_name,
                 email=email,
-                password_hash=generate_password_hash(password),
+                password_hash=password_hash,
                 maiden_name=maiden_name,
                 role='user',
                 created_at=datetime.utcnow(),
@@ -43,6 +68,11 @@ def register():
             )
             db.session.add(new_user)
             db.session.commit()
+            return new_user
+
+        try:
+            new_user = save_user()
+            user_search_index.add_user(new_user.id, new_user.username, new_user.first_name, new_user.last_name)
 
             flash('Registration successful. Please log in.', 'success')
             return redirect(url_for('user_auth_bp.login'))
@@ -61,27 +91,50 @@ def login():
         username = request.form.get('username')  # Changed from 'email' to 'username'
         password = request.form.get('password')
 
+        # Throttled attempts are turned away before any lookup or hashing
+        throttle_keys = (account_key('login', username), ip_key(request.remote_addr))
+        retry_after = login_throttle.retry_after(*throttle_keys)
+        if retry_after:
+            flash(f'Too many failed attempts. Please try again in {retry_after} seconds.', 'error')
+            return redirect(url_for('user_auth_bp.login'))
+
         # Fetch user by username
         user = User.query.filter_by(username=username).first()  # Changed to filter by username
 
-        if user and check_password_hash(user.password_hash, password):
+        if user and password_hasher.verify_password(user.password_hash, password):
+            login_throttle.record_success(throttle_keys[0])
+
             # Check if the account is banned or suspended
             if user.is_banned:
                 flash('Your account has been banned.', 'error')
                 return redirect(url_for('user_auth_bp.login'))
 
-            if user.suspended_until and user.suspended_until > datetime.utcnow():
+            if user.is_suspended:
                 flash('Your account is suspended.', 'error')
                 return redirect(url_for('user_auth_bp.login'))
 
             # If everything is fine, log the user in
             login_user(user)
-            user.last_login = datetime.utcnow()
-            db.session.commit()
+
+            # Upgrade hashes made with an older method or work factor while we have the password
+            new_hash = password_hasher.rehash_if_needed(user.password_hash, password)
+
+            @retry_on_lock
+            def save_new_hash():
+                user.password_hash = new_hash
+                db.session.commit()
+
+            if new_hash:
+                save_new_hash()
+            # last_login is written in the presence tracker's next batch, not here
+            presence_tracker.record_login(user.id)
+            record_active_user(user.id)
+            maybe_flush_active_user_sketches()
             flash('Logged in successfully.', 'success')
             return redirect(url_for('dashboard')) 
 
         # If invalid credentials, show an error
+        login_throttle.record_failure(*throttle_keys)
         flash('Invalid username or password.', 'error')
         return redirect(url_for('user_auth_bp.login'))
 
@@ -109,16 +162,33 @@ def reset_password():
             flash('All fields are required.', 'error')
             return redirect(url_for('user_auth_bp.reset_password'))
 
+        # Guessing security answers is throttled like guessing passwords
+        throttle_keys = (account_key('reset', email), ip_key(request.remote_addr))
+        retry_after = login_throttle.retry_after(*throttle_keys)
+        if retry_after:
+            flash(f'Too many failed attempts. Please try again in {retry_after} seconds.', 'error')
+            return redirect(url_for('user_auth_bp.reset_password'))
+
         user = User.query.filter_by(email=email, maiden_name=maiden_name).first()
 
         if not user:
+            login_throttle.record_failure(*throttle_keys)
             flash('Incorrect details. Please try again.', 'error')
             return redirect(url_for('user_auth_bp.reset_password'))
 
-        try:
-            user.password_hash = generate_password_hash(new_password)
+        password_hash = password_hasher.hash_password(new_password)
+
+        @retry_on_lock
+        def save_password():
+            user.password_hash = password_hash
             db.session.commit()
 
+        try:
+            save_password()
+            login_throttle.record_success(throttle_keys[0])
+            # Sessions opened with the old password should not outlive it
+            revoke_user_sessions(user.id)
+
             flash('Password reset successful. Please log in.', 'success')
             return redirect(url_for('user_auth_bp.login'))
         except Exception as e:
@@ -135,6 +205,45 @@ def reset_password():
 def profile():
     return render_template('profile.html', user=current_user)
 
+@dashboard_bp.route('/search_user')
+@login_required
+def search_user():
+    """Typeahead search over usernames and names (`username` or `query` parameter)."""
+    query = request.args.get('username') or request.args.get('query') or ''
+    limit = min(request.args.get('limit', DEFAULT_SEARCH_LIMIT, type=int), MAX_SEARCH_LIMIT)
+    results = user_search_index.search(query, limit)
+    if not results:
+        return jsonify({"success": False, "message": "No users found.", "results": []}), 200
+    return jsonify({
+        "success": True,
+        "user": results[0],
+        "message": f"{len(results)} user(s) found.",
+        "results": results,
+    }), 200
+
+@dashboard_bp.route('/presence/heartbeat', methods=['POST'])
+@login_required
+def presence_heartbeat():
+    """Keeps an idle chat client online (every authenticated request already counts)."""
+    presence_tracker.touch(current_user.id)
+    return jsonify({"success": True}), 200
+
+@dashboard_bp.route('/presence/contacts')
+@login_required
+def contacts_presence():
+    """Online status of the current user's contacts, or of `user_ids` (comma-separated)."""
+    user_ids = [int(part) for part in request.args.get('user_ids', '').split(',') if part.strip().isdigit()]
+    if user_ids:
+        statuses = presence_tracker.online_status(user_ids[:MAX_CONTACTS])
+    else:
+        statuses = presence_tracker.contacts_status(current_user.id)
+    contacts = [{"user_id": user_id, **status} for user_id, status in statuses.items()]
+    return jsonify({
+        "success": True,
+        "online": sum(contact["online"] for contact in contacts),
+        "contacts": contacts,
+    }), 200
+
 @chat_bp.route('/dashboard')
 @login_required
 def dashboard():
@@ -154,34 +263,26 @@ def create_group():
         flash("Group already exists.", "error")
         return redirect(url_for('chat'))
 
-    group = Group(name=group_name, created_by=current_user.id)
-    db.session.add(group)
-    db.session.commit()
-
-    membership = GroupMembership(group_id=group.id, user_id=current_user.id)
-    db.session.add(membership)
-    db.session.commit()
+    # The group and its creator's membership are committed together
+    create_group_with_members(group_name, current_user.id)
 
     flash("Group created successfully!", "success")
     return redirect(url_for('chat'))
 
 @group_bp.route('/leave_group/<int:group_id>', methods=['POST'])
 @login_required
+@transactional
 def leave_group(group_id):
-    membership = GroupMembership.query.filter_by(group_id=group_id, user_id=current_user.id).first()
-
-    if not membership:
+    if not remove_members(group_id, [current_user.id]):
         flash("You're not a member of this group.", "error")
         return redirect(url_for('chat'))
 
-    db.session.delete(membership)
-    db.session.commit()
-
     flash("You have left the group.", "success")
     return redirect(url_for('chat'))
 
 @group_bp.route('/kick_member/<int:group_id>/<int:user_id>', methods=['POST'])
 @login_required
+@transactional
 def kick_member(group_id, user_id):
     group = Group.query.get_or_404(group_id)
 
@@ -189,14 +290,88 @@ def kick_member(group_id, user_id):
         flash("Only admins can remove members.", "error")
         return redirect(url_for('chat'))
 
-    membership = GroupMembership.query.filter_by(group_id=group_id, user_id=user_id).first()
-
-    if not membership:
+    if not remove_members(group_id, [user_id]):
         flash("User not in group.", "error")
         return redirect(url_for('chat'))
 
-    db.session.delete(membership)
-    db.session.commit()
-
     flash("User removed from group.", "success")
-    return redirect(url_for('chat'))
\ No newline at end of file
+    return redirect(url_for('chat'))
+
+@group_bp.route('/groups/<int:group_id>/members', methods=['POST', 'DELETE'])
+@login_required
+@transactional
+def bulk_update_members(group_id):
+    """Adds (POST) or removes (DELETE) many members at once: JSON {"user_ids": [...]}."""
+    group = Group.query.get_or_404(group_id)
+    if current_user.role != 'admin' and group.created_by != current_user.id:
+        return jsonify({"success": False, "message": "Only admins and the group's creator can manage members."}), 403
+
+    user_ids = (request.get_json(silent=True) or {}).get('user_ids')
+    if not isinstance(user_ids, list) or not all(isinstance(user_id, int) for user_id in user_ids):
+        return jsonify({"success": False, "message": "user_ids must be a list of user ids."}), 400
+    if len(user_ids) > MAX_BULK_MEMBERS:
+        return jsonify({"success": False, "message": f"At most {MAX_BULK_MEMBERS} users per request."}), 400
+
+    if request.method == 'POST':
+        added = add_members(group_id, existing_user_ids(user_ids))
+        return jsonify({"success": True, "added": added}), 200
+    removed = remove_members(group_id, user_ids)
+    return jsonify({"success": True, "removed": removed}), 200
+
+@group_bp.route('/groups/<int:group_id>/messages', methods=['POST'])
+@login_required
+def post_to_group(group_id):
+    """Posts a message to a group: JSON {"content": "..."}. Stored once, whatever the group's size."""
+    if not is_member(group_id, current_user.id):
+        return jsonify({"success": False, "message": "You're not a member of this group."}), 403
+
+    content = ((request.get_json(silent=True) or {}).get('content') or '').strip()
+    if not content or len(content) > MAX_GROUP_MESSAGE_LENGTH:
+        return jsonify({"success": False, "message": f"Message must be 1-{MAX_GROUP_MESSAGE_LENGTH} characters."}), 400
+
+    message_id = post_group_message(group_id, current_user.id, content)
+    record_active_user(current_user.id)
+    return jsonify({"success": True, "message_id": message_id}), 201
+
+@group_bp.route('/groups/<int:group_id>/messages')
+@login_required
+def list_group_messages(group_id):
+    """A page of a group's messages, newest first; ?before=<id> pages back."""
+    if not is_member(group_id, current_user.id):
+        return jsonify({"success": False, "message": "You're not a member of this group."}), 403
+
+    limit = min(max(request.args.get('limit', DEFAULT_PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+    before_id = request.args.get('before', type=int)
+    rows = get_group_messages(group_id, limit=limit, before_id=before_id)
+    return jsonify({
+        "success": True,
+        "messages": [
+            {"id": row.id, "sender_id": row.sender_id, "content": row.content,
+             "created_at": row.created_at.isoformat()}
+            for row in rows
+        ],
+        "next_before": rows[-1].id if rows else None,
+    }), 200
+
+@group_bp.route('/groups/<int:group_id>/read', methods=['POST'])
+@login_required
+def mark_group_messages_read(group_id):
+    """Moves the caller's read cursor: JSON {"message_id": id}, or up to the newest message."""
+    if not is_member(group_id, current_user.id):
+        return jsonify({"success": False, "message": "You're not a member of this group."}), 403
+
+    message_id = (request.get_json(silent=True) or {}).get('message_id')
+    if message_id is not None and not isinstance(message_id, int):
+        return jsonify({"success": False, "message": "message_id must be a message id."}), 400
+    unread = mark_group_read(group_id, current_user.id, message_id)
+    return jsonify({"success": True, "unread": unread}), 200
+
+@group_bp.route('/groups/unread')
+@login_required
+def group_unread_counts():
+    """Unread message counts for each of the caller's groups."""
+    counts = unread_counts(current_user.id)
+    return jsonify({
+        "success": True,
+        "groups": [{"group_id": group_id, **entry} for group_id, entry in counts.items()],
+    }), 200
@@ -0,0 +1,185 @@
+from bisect import bisect_left, insort
+import logging
+import threading
+import time
+
+from flask import current_app
+from sqlalchemy import select
+
+from models import User
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_SEARCH_LIMIT = 10
+DEFAULT_SYNC_SECONDS = 5        # USER_SEARCH_SYNC_SECONDS: how often to pick up users registered by other workers
+DEFAULT_REBUILD_SECONDS = 600   # USER_SEARCH_REBUILD_SECONDS: full rebuild (bans, renames) in the background
+
+def _fold(text):
+    return (text or '').strip().casefold()
+
+
+def _full_name(first_name, last_name):
+    return ' '.join(part for part in (first_name, last_name) if part)
+
+
+class UserSearchIndex:
+    """
+    In-memory prefix index over usernames and names of users who are not
+    banned. Keys are case-folded and kept in sorted lists of (key, user_id),
+    so a prefix is a bisect plus a scan of only the first K matches: lookups
+    cost O(log n + K) whatever the number of users.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._usernames = []   # (folded username, user_id)
+        self._names = []       # (folded first name / last name / full name, user_id)
+        self._users = {}       # user_id -> (username, full name, name keys)
+        self._max_user_id = 0
+        self._built_at = None
+        self._synced_at = 0.0
+        self._rebuilding = False
+
+    @staticmethod
+    def _name_keys(first_name, last_name):
+        keys = {_fold(first_name), _fold(last_name), _fold(_full_name(first_name, last_name))}
+        keys.discard('')
+        return keys
+
+    def _insert(self, user_id, username, first_name, last_name):
+        name_keys = self._name_keys(first_name, last_name)
+        self._users[user_id] = (username, _full_name(first_name, last_name), name_keys)
+        if username:
+            insort(self._usernames, (_fold(username), user_id))
+        for key in name_keys:
+            insort(self._names, (key, user_id))
+        self._max_user_id = max(self._max_user_id, user_id)
+
+    def _remove(self, entries, key, user_id):
+        position = bisect_left(entries, (key, user_id))
+        if position < len(entries) and entries[position] == (key, user_id):
+            del entries[position]
+
+    def add_user(self, user_id, username, first_name, last_name):
+        """Adds (or re-indexes) a user; call once a registration or rename commits."""
+        with self._lock:
+            self.remove_user(user_id)
+            self._insert(user_id, username, first_name, last_name)
+
+    def remove_user(self, user_id):
+        """Drops a user from results, e.g. once a ban commits."""
+        with self._lock:
+            entry = self._users.pop(user_id, None)
+            if entry is None:
+                return
+            username, _, name_keys = entry
+            if username:
+                self._remove(self._usernames, _fold(username), user_id)
+            for key in name_keys:
+                self._remove(self._names, key, user_id)
+
+    def _load(self, query):
+        from read_routing import read_session
+
+        users = User.__table__
+        return read_session().execute(
+            query.with_only_columns(users.c.id, users.c.username, users.c.first_name, users.c.last_name)
+            .where(users.c.is_banned.isnot(True))
+            .order_by(users.c.id)
+        ).fetchall()
+
+    def rebuild(self):
+        """Reloads every user that is not banned and swaps the new index in."""
+        started = time.perf_counter()
+        rows = self._load(select(User.__table__))
+        usernames, names, users = [], [], {}
+        for row in rows:
+            name_keys = self._name_keys(row.first_name, row.last_name)
+            users[row.id] = (row.username, _full_name(row.first_name, row.last_name), name_keys)
+            if row.username:
+                usernames.append((_fold(row.username), row.id))
+            names.extend((key, row.id) for key in name_keys)
+        usernames.sort()
+        names.sort()
+        with self._lock:
+            self._usernames, self._names, self._users = usernames, names, users
+            self._max_user_id = max(users, default=0)
+            self._built_at = self._synced_at = time.monotonic()
+        logger.info(f"Built user search index: {len(users)} users in {(time.perf_counter() - started) * 1000:.0f} ms")
+
+    def _sync(self):
+        """Picks up users registered since the last sync with one indexed range query."""
+        users = User.__table__
+        for row in self._load(select(users).where(users.c.id > self._max_user_id)):
+            self.add_user(row.id, row.username, row.first_name, row.last_name)
+        self._synced_at = time.monotonic()
+
+    def _rebuild_in_background(self, app):
+        def target():
+            try:
+                with app.app_context():
+                    self.rebuild()
+            except Exception as e:
+                logger.error(f"User search index rebuild failed: {str(e)}")
+            finally:
+                self._rebuilding = False
+
+        self._rebuilding = True
+        threading.Thread(target=target, name='user-search-rebuild', daemon=True).start()
+
+    def _refresh(self):
+        config = current_app.config
+        now = time.monotonic()
+        if self._built_at is None:
+            with self._lock:
+                if self._built_at is None:
+                    self.rebuild()
+            return
+        if not self._rebuilding and now - self._built_at > config.get('USER_SEARCH_REBUILD_SECONDS', DEFAULT_REBUILD_SECONDS):
+            self._rebuild_in_background(current_app._get_current_object())
+        if now - self._synced_at > config.get('USER_SEARCH_SYNC_SECONDS', DEFAULT_SYNC_SECONDS):
+            self._sync()
+
+    @staticmethod
+    def _scan(entries, prefix, limit, seen):
+        matches = []
+        position = bisect_left(entries, (prefix,))
+        while position < len(entries) and len(matches) < limit:
+            key, user_id = entries[position]
+            if not key.startswith(prefix):
+                break
+            if user_id not in seen:
+                seen.add(user_id)
+                matches.append(user_id)
+            position += 1
+        return matches
+
+    def search(self, query, limit=DEFAULT_SEARCH_LIMIT):
+        """
+        Returns up to `limit` users whose username or name starts with
+        `query` (case-insensitive): an exact username first, then username
+        prefix matches, then name matches, each in alphabetical order.
+        """
+        prefix = _fold(query)
+        if not prefix:
+            return []
+        self._refresh()
+        with self._lock:
+            seen = set()
+            user_ids = self._scan(self._usernames, prefix, limit, seen)
+            if len(user_ids) < limit:
+                user_ids += self._scan(self._names, prefix, limit - len(user_ids), seen)
+            results = [
+                {'id': user_id, 'username': self._users[user_id][0], 'full_name': self._users[user_id][1]}
+                for user_id in user_ids
+            ]
+        return results
+
+    def __len__(self):
+        return len(self._users)
+
+
+# Shared per-process index, built on the first search
+user_search_index = UserSearchIndex()
+
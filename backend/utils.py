@@ -0,0 +1,142 @@
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+import logging
+import threading
+import time
+
+from flask import g, has_app_context
+from sqlalchemy import select
+
+from models import User, db
+from unit_of_work import after_commit
+
+logger = logging.getLogger(__name__)
+
+# Defaults, overridable in app config
+DEFAULT_IDENTITY_CACHE_TTL_SECONDS = 60    # IDENTITY_CACHE_TTL
+DEFAULT_IDENTITY_CACHE_MAX_ENTRIES = 10000  # IDENTITY_CACHE_MAX_ENTRIES
+
+# Memo marker for users changed by the current request (until its commit clears the process cache)
+_CHANGED = object()
+
+
+class Identity(namedtuple('Identity', ['user_id', 'role', 'is_banned', 'suspended_until'])):
+    """The fields authorization checks need, without loading the whole user."""
+
+    @property
+    def is_admin(self):
+        return self.role == 'admin'
+
+    @property
+    def is_suspended(self):
+        return self.suspended_until is not None and self.suspended_until > datetime.utcnow()
+
+
+class IdentityCache:
+    """
+    Per-process cache of user id -> Identity with a TTL, in front of a
+    request-local memo, so a request loads a given user at most once and
+    most auth checks are dictionary lookups. Entries are dropped when a ban,
+    suspension or role change commits (in this process; other processes
+    pick it up when the TTL expires).
+    """
+
+    def __init__(self):
+        self.ttl = DEFAULT_IDENTITY_CACHE_TTL_SECONDS
+        self.max_entries = DEFAULT_IDENTITY_CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.metrics = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def init_app(self, app):
+        self.ttl = app.config.get('IDENTITY_CACHE_TTL', DEFAULT_IDENTITY_CACHE_TTL_SECONDS)
+        self.max_entries = app.config.get('IDENTITY_CACHE_MAX_ENTRIES', DEFAULT_IDENTITY_CACHE_MAX_ENTRIES)
+        self.clear()
+
+    def request_memo(self):
+        """The current request's user id -> Identity memo (None outside an app context)."""
+        if not has_app_context():
+            return None
+        if 'identities' not in g:
+            g.identities = {}
+        return g.identities
+
+    def _load(self, user_id):
+        users = User.__table__
+        row = db.session.execute(
+            select(users.c.id, users.c.role, users.c.is_banned, users.c.suspended_until).where(users.c.id == user_id)
+        ).first()
+        return Identity(row.id, row.role, bool(row.is_banned), row.suspended_until) if row else None
+
+    def get(self, user_id):
+        """Returns the Identity of a user, or None if there is no such user."""
+        memo = self.request_memo()
+        if memo is not None and user_id in memo:
+            if memo[user_id] is not _CHANGED:
+                return memo[user_id]
+            # Bypass the process cache, which still holds the committed values
+            memo[user_id] = self._load(user_id)
+            return memo[user_id]
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.metrics["hits"] += 1
+                identity = entry[0]
+            else:
+                self.metrics["misses"] += 1
+                identity = None
+
+        if identity is None:
+            identity = self._load(user_id)
+            if identity is not None:
+                with self._lock:
+                    self._entries[user_id] = (identity, now + self.ttl)
+                    self._entries.move_to_end(user_id)
+                    while len(self._entries) > self.max_entries:
+                        self._entries.popitem(last=False)
+        if memo is not None:
+            memo[user_id] = identity
+        return identity
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self.metrics["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_metrics(self):
+        with self._lock:
+            return dict(self.metrics, entries=len(self._entries), ttl=self.ttl)
+
+
+# Shared cache; configured by identity_cache.init_app(app)
+identity_cache = IdentityCache()
+
+
+def get_identity(user_id):
+    """Returns the cached Identity of a user, or None."""
+    return identity_cache.get(user_id)
+
+
+def invalidate_identity(user_id):
+    """
+    Call whenever a user's role, ban or suspension changes: this request
+    reloads the user on its next check, and the process cache drops it once
+    the change commits (so a concurrent request cannot re-cache old values).
+    """
+    memo = identity_cache.request_memo()
+    if memo is not None:
+        memo[user_id] = _CHANGED
+    after_commit(identity_cache.invalidate, user_id)
+
+
+def verify_admin(user_id):
+    """Check if the user is an admin."""
+    identity = get_identity(user_id)
+    return identity is not None and identity.is_admin
@@ -160,7 +160,7 @@ function deleteFlaggedMessage(messageId) {
 }
 
 // Fetch real analytics data from backend
-fetch('/api/analytics')
+fetch('/analytics/api/analytics')
   .then(response => response.json())
   .then(data => {
     // Update stat counters
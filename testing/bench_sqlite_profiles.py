@@ -0,0 +1,118 @@
+"""
+Benchmark of the SQLite PRAGMA profiles in db_engines.SQLITE_PRAGMA_PROFILES.
+
+Runs concurrent chat-style writers (one small INSERT + COMMIT each, like a
+message send) and readers (recent inbox page) against a fresh database per
+profile, and reports throughput and lock errors.
+
+Usage (from the repository root):
+    PYTHONPATH=backend python testing/bench_sqlite_profiles.py --duration 5 --writers 4 --readers 8
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+
+from db_engines import SQLITE_PRAGMA_PROFILES, apply_sqlite_pragmas
+
+SCHEMA = """
+    CREATE TABLE messages (
+        id INTEGER PRIMARY KEY,
+        sender_id INTEGER NOT NULL,
+        receiver_id INTEGER,
+        content TEXT NOT NULL,
+        created_at DATETIME,
+        deleted BOOLEAN DEFAULT 0
+    );
+    CREATE INDEX ix_messages_receiver_created_live ON messages (receiver_id, created_at) WHERE deleted = 0;
+"""
+
+NUM_USERS = 1000
+
+
+def connect(path, pragmas):
+    # The driver's default 5s lock timeout, as the app gets; busy_timeout overrides it
+    connection = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+    apply_sqlite_pragmas(connection, pragmas)
+    return connection
+
+
+def writer(path, pragmas, stop, counters):
+    connection = connect(path, pragmas)
+    while not stop.is_set():
+        try:
+            connection.execute(
+                "INSERT INTO messages (sender_id, receiver_id, content, created_at) "
+                "VALUES (?, ?, ?, datetime('now'))",
+                (random.randrange(NUM_USERS), random.randrange(NUM_USERS), 'x' * 100)
+            )
+            connection.commit()
+            counters['writes'] += 1
+        except sqlite3.OperationalError:
+            connection.rollback()
+            counters['write_errors'] += 1
+    connection.close()
+
+
+def reader(path, pragmas, stop, counters):
+    connection = connect(path, pragmas)
+    while not stop.is_set():
+        try:
+            connection.execute(
+                "SELECT id, sender_id, content FROM messages WHERE receiver_id = ? AND deleted = 0 "
+                "ORDER BY created_at DESC LIMIT 50",
+                (random.randrange(NUM_USERS),)
+            ).fetchall()
+            counters['reads'] += 1
+        except sqlite3.OperationalError:
+            counters['read_errors'] += 1
+    connection.close()
+
+
+def run_profile(name, duration, num_writers, num_readers):
+    pragmas = SQLITE_PRAGMA_PROFILES[name]
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'bench.db')
+        setup = connect(path, pragmas)
+        setup.executescript(SCHEMA)
+        setup.close()
+
+        stop = threading.Event()
+        # One counter dict per thread, summed at the end
+        per_thread = [{'writes': 0, 'write_errors': 0, 'reads': 0, 'read_errors': 0}
+                      for _ in range(num_writers + num_readers)]
+        threads = [
+            threading.Thread(target=writer if i < num_writers else reader, args=(path, pragmas, stop, counters))
+            for i, counters in enumerate(per_thread)
+        ]
+        for thread in threads:
+            thread.start()
+        time.sleep(duration)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+    totals = {key: sum(counters[key] for counters in per_thread) for key in per_thread[0]}
+    return {key: value / duration if not key.endswith('errors') else value for key, value in totals.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=5.0, help="seconds per profile")
+    parser.add_argument('--writers', type=int, default=4)
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--profiles', nargs='*', default=list(SQLITE_PRAGMA_PROFILES))
+    args = parser.parse_args()
+
+    print(f"{'profile':<12} {'writes/s':>10} {'reads/s':>10} {'write errs':>11} {'read errs':>10}")
+    for name in args.profiles:
+        result = run_profile(name, args.duration, args.writers, args.readers)
+        print(f"{name:<12} {result['writes']:>10.0f} {result['reads']:>10.0f} "
+              f"{result['write_errors']:>11} {result['read_errors']:>10}")
+
+
+if __name__ == '__main__':
+    main()
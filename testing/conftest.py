@@ -0,0 +1,69 @@
+import pytest
+from flask import Flask
+
+from db_engines import engines
+from models import User, db
+import sharding
+
+
+def user_row(user_id, **overrides):
+    """A users row with every required column filled in; keyword arguments replace the defaults."""
+    row = {'id': user_id, 'username': f'user{user_id}', 'email': f'user{user_id}@example.com',
+           'first_name': 'Test', 'last_name': 'User', 'password_hash': 'x', 'security_question': 'q',
+           'security_answer_hash': 'x', 'role': 'user', 'is_banned': False}
+    row.update(overrides)
+    return row
+
+
+def configure_app(tmp_path, shard_count=1, config=None):
+    """A Flask app on SQLite files under tmp_path, before the engine registry and shard map are initialised."""
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    app.config['SHARD_DATABASE_URIS'] = ['primary'] + [f"sqlite:///{tmp_path / f'shard{index}.db'}"
+                                                       for index in range(1, shard_count)]
+    app.config['MESSAGE_ARCHIVE_DIR'] = str(tmp_path / 'archive')
+    app.config.update(config or {})
+    return app
+
+
+def make_app(tmp_path, shard_count=1, config=None):
+    """configure_app with the engine registry and shard map initialised, for tests that need several apps."""
+    app = configure_app(tmp_path, shard_count, config)
+    engines.init_app(app, db)
+    sharding.init_app(app)
+    return app
+
+
+@pytest.fixture
+def shard_count():
+    """Number of shards the app is split across (the primary database is always shard 0)."""
+    return 1
+
+
+@pytest.fixture
+def app_config():
+    """Extra app config, overridden by modules that test a configurable feature."""
+    return {}
+
+
+@pytest.fixture
+def user_rows():
+    """Users inserted before each test."""
+    return []
+
+
+@pytest.fixture
+def flask_app(tmp_path, shard_count, app_config):
+    """The configured app alone, for tests that initialise the database extensions themselves."""
+    return configure_app(tmp_path, shard_count, app_config)
+
+
+@pytest.fixture
+def app(tmp_path, shard_count, app_config, user_rows):
+    app = make_app(tmp_path, shard_count, app_config)
+    with app.app_context():
+        db.metadata.create_all(db.engine)
+        if user_rows:
+            with engines.get_engine().begin() as connection:
+                connection.execute(User.__table__.insert(), user_rows)
+        yield app
@@ -0,0 +1,83 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+import active_users
+from active_users import (
+    active_user_series, count_active_users, count_active_users_past, estimate_retention, flush_active_user_sketches,
+    record_active_user,
+)
+from db_engines import engines
+from hyperloglog import HyperLogLog
+from messages import store_message
+from models import ActiveUserSketch
+
+
+@pytest.fixture(autouse=True)
+def empty_buffer(monkeypatch):
+    monkeypatch.setattr(active_users, '_pending_sketches', {})
+    monkeypatch.setattr(active_users, '_pending_events', 0)
+
+
+def stored_days():
+    with engines.get_engine().connect() as connection:
+        return connection.execute(select(func.count()).select_from(ActiveUserSketch.__table__)).scalar()
+
+
+def test_flushes_merge_into_the_stored_sketch(app):
+    today = datetime.utcnow().date()
+    yesterday = today - timedelta(days=1)
+    for user_id in range(1, 51):
+        record_active_user(user_id)
+    for user_id in range(1, 31):
+        record_active_user(user_id, yesterday)
+
+    # Buffered activity is counted before it is flushed
+    assert count_active_users_past(1) == pytest.approx(50, abs=1)
+    assert flush_active_user_sketches() == 2
+    assert stored_days() == 2 and active_users._pending_sketches == {}
+    assert flush_active_user_sketches() == 0
+
+    # Another flush for the same day (e.g. from another worker) merges instead of overwriting
+    for user_id in range(40, 81):
+        record_active_user(user_id)
+    assert flush_active_user_sketches() == 1
+    assert stored_days() == 2
+    assert count_active_users(today, today) == pytest.approx(80, abs=1)
+    assert count_active_users_past(2) == pytest.approx(80, abs=1)
+
+
+def test_failed_flush_keeps_the_activity(app, monkeypatch):
+    record_active_user(1)
+    with monkeypatch.context() as patch:
+        patch.setattr(HyperLogLog, 'to_bytes', lambda self: None)  # violates NOT NULL
+        assert flush_active_user_sketches() == 0
+    assert count_active_users_past(1) == pytest.approx(1, abs=0.5)
+    assert flush_active_user_sketches() == 1 and stored_days() == 1
+
+
+def test_series_and_retention(app):
+    today = datetime.utcnow().date()
+    yesterday = today - timedelta(days=1)
+    for user_id in range(1, 31):
+        record_active_user(user_id, yesterday)
+    for user_id in range(21, 61):
+        record_active_user(user_id, today)
+    flush_active_user_sketches()
+
+    daily = active_user_series(days=3)
+    assert [point['day'] for point in daily] == [(today - timedelta(days=i)).isoformat() for i in (2, 1, 0)]
+    assert [point['count'] for point in daily] == pytest.approx([0, 30, 40], abs=1)
+    rolling = active_user_series(days=2, window=2)
+    assert [point['count'] for point in rolling] == pytest.approx([30, 60], abs=1)
+
+    retention = estimate_retention(yesterday, days=2)
+    assert retention['cohort_size'] == pytest.approx(30, abs=1)
+    assert [point['count'] for point in retention['retained']] == pytest.approx([10, 0], abs=1)
+    assert estimate_retention(today - timedelta(days=5))['cohort_size'] == 0
+
+
+def test_storing_a_message_records_the_sender(app):
+    store_message(7, 8, 'hi')
+    assert count_active_users_past(1) == pytest.approx(1, abs=0.5)
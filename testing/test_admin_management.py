@@ -0,0 +1,73 @@
+from types import SimpleNamespace
+
+import pytest
+from flask import get_flashed_messages
+from sqlalchemy import select
+
+pytest.importorskip('flask_login')
+
+import admin_management
+from conftest import user_row
+from messages import get_message, store_message
+from models import FlaggedContent, User, db
+
+
+@pytest.fixture
+def user_rows():
+    return [user_row(1, role='admin'), user_row(2), user_row(3)]
+
+
+@pytest.fixture
+def app(app, monkeypatch):
+    app.secret_key = 'test'
+    app.config['LOGIN_DISABLED'] = True
+    app.add_url_rule('/admin/flagged-content', 'admin_bp.flagged_content', lambda: 'ok')
+    monkeypatch.setattr(admin_management, 'current_user', SimpleNamespace(id=1))
+    return app
+
+
+def flag(message_id, reporter_id=3):
+    flagged_content = FlaggedContent(message_id=message_id, user_id=reporter_id, reason='spam')
+    db.session.add(flagged_content)
+    db.session.commit()
+    return flagged_content.id
+
+
+def sender_status(user_id):
+    users = User.__table__
+    return db.session.execute(select(users.c.is_banned, users.c.moderation_status).where(users.c.id == user_id)).one()
+
+
+def test_review_deletes_the_message(app):
+    message_id = store_message(2, 3, 'buy now')
+    flag_id = flag(message_id)
+
+    with app.test_request_context():
+        body, status = admin_management.review_flagged_content(flag_id, 'delete', 1)
+    assert (body, status) == ({'message': 'Action taken: Message deleted'}, 200)
+    assert get_message(message_id).deleted and get_message(message_id).deleted_at is not None
+    assert db.session.get(FlaggedContent, flag_id).reviewed_by == 1
+
+
+def test_review_bans_the_sender(app):
+    flag_id = flag(store_message(2, 3, 'buy now'))
+
+    with app.test_request_context():
+        assert admin_management.review_flagged_content(flag_id, 'ban', 1)[1] == 200
+        assert admin_management.review_flagged_content(flag_id, 'shout', 1)[1] == 400
+    assert tuple(sender_status(2)) == (True, 'banned')
+
+
+@pytest.mark.parametrize('action, flashed', [('delete', 'Message deleted'), ('ban', 'User banned')])
+def test_flag_action_route(app, action, flashed):
+    message_id = store_message(2, 3, 'buy now')
+    flag_id = flag(message_id)
+
+    with app.test_request_context(method='POST', data={'action': action}):
+        response = admin_management.flag_action(flag_id)
+        assert response.status_code == 302
+        assert get_flashed_messages(with_categories=True) == [('success', f'{flashed} on message {message_id}')]
+    db.session.expire_all()
+    assert db.session.get(FlaggedContent, flag_id).reviewed
+    assert get_message(message_id).deleted == (action == 'delete')
+    assert tuple(sender_status(2)) == ((True, 'banned') if action == 'ban' else (False, None))
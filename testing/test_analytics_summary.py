@@ -0,0 +1,75 @@
+from datetime import datetime
+
+import pytest
+
+from conftest import user_row
+from db_engines import engines
+from models import FlaggedContent
+from query_instrumentation import track_queries
+import analytics_summary
+import sharding
+
+
+@pytest.fixture
+def shard_count():
+    return 2
+
+
+@pytest.fixture
+def app_config():
+    return {'ANALYTICS_CACHE_TTL': 60}
+
+
+@pytest.fixture
+def user_rows():
+    return [user_row(i) for i in range(1, 5)]
+
+
+@pytest.fixture
+def app(app):
+    @app.route('/analytics/api/analytics')
+    def summary():
+        return analytics_summary.analytics_summary_response()
+
+    analytics_summary.invalidate_analytics_cache()
+    sharding.insert_rows('messages', [
+        {'sender_id': sender, 'receiver_id': receiver, 'content': 'hi', 'created_at': datetime.utcnow(),
+         'deleted': False}
+        for sender, receiver in [(1, 2), (2, 1), (3, 4), (1, 3), (2, 4)]
+    ])
+    yield app
+    analytics_summary.invalidate_analytics_cache()
+
+
+def test_summary_covers_every_shard_and_is_served_from_cache(app):
+    client = app.test_client()
+    response = client.get('/analytics/api/analytics')
+    assert response.status_code == 200
+    assert response.json['total_users'] == 4 and response.json['total_messages'] == 5
+    assert response.json['messages_per_day']['counts'][-1] == 5
+    assert response.headers['Cache-Control'] == 'private, no-cache'
+
+    with app.app_context(), engines.get_engine().begin() as connection:
+        connection.execute(FlaggedContent.__table__.insert().values(message_id=1, user_id=2, reason='spam'))
+    with track_queries() as stats:
+        cached = client.get('/analytics/api/analytics')
+    # Within the TTL the stored payload is returned without touching the database
+    assert stats.count == 0
+    assert cached.json == response.json and cached.headers['ETag'] == response.headers['ETag']
+
+    analytics_summary.invalidate_analytics_cache()
+    fresh = client.get('/analytics/api/analytics')
+    assert fresh.json['total_flagged'] == 1 and fresh.json['flag_breakdown'] == {'spam': 1}
+    assert fresh.headers['ETag'] != response.headers['ETag']
+
+
+def test_matching_etag_gets_a_304(app):
+    client = app.test_client()
+    etag = client.get('/analytics/api/analytics').headers['ETag']
+
+    not_modified = client.get('/analytics/api/analytics', headers={'If-None-Match': etag})
+    assert not_modified.status_code == 304 and not_modified.data == b''
+    assert not_modified.headers['ETag'] == etag
+
+    changed = client.get('/analytics/api/analytics', headers={'If-None-Match': '"stale"'})
+    assert changed.status_code == 200 and changed.json['total_users'] == 4
@@ -0,0 +1,116 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+
+import api_db_management
+import sharding
+
+
+@pytest.fixture
+def shard_count():
+    return 2
+
+
+def test_notifications_are_written_to_and_read_from_the_users_shard(app):
+    shard_map = sharding.get_shard_map()
+    user_ids = range(1, 9)
+    assert len({shard_map.shard_for_user(user_id) for user_id in user_ids}) == 2
+
+    for user_id in user_ids:
+        notification_id = api_db_management.create_notification(user_id, f'hello {user_id}', 'admin')
+        assert shard_map.shard_for_id(notification_id) == shard_map.shard_for_user(user_id)
+    api_db_management.create_notification(5, 'again')
+
+    for user_id in user_ids:
+        rows = api_db_management.get_user_notifications(user_id)
+        assert [row.message for row in rows][-1] == f'hello {user_id}'
+        assert rows.rowcount == (2 if user_id == 5 else 1)
+    assert [row.type for row in api_db_management.get_user_notifications(5)] == ['info', 'admin']
+
+
+def test_interaction_trends_cover_every_shard(app):
+    pairs = [(1, 2, 12), (3, 4, 15), (5, 6, 11), (2, 1, 3), (7, 8, 10)]
+    sharding.insert_rows('messages', [
+        {'sender_id': sender, 'receiver_id': receiver, 'group_id': None, 'content': 'hi',
+         'created_at': datetime.utcnow(), 'deleted': False}
+        for sender, receiver, count in pairs for _ in range(count)
+    ] + [
+        {'sender_id': 1, 'receiver_id': None, 'group_id': 3, 'content': 'hi', 'created_at': datetime.utcnow(),
+         'deleted': False}
+        for _ in range(20)
+    ])
+    shard_map = sharding.get_shard_map()
+    assert len({shard_map.shard_for_conversation(sender, receiver) for sender, receiver, _ in pairs[:3]}) == 2
+
+    trends = api_db_management.get_user_interaction_trends()
+    assert [tuple(row) for row in trends] == [(3, 4, 15), (1, 2, 12), (5, 6, 11)]
+
+
+@pytest.fixture
+def scratch(app):
+    api_db_management.execute_query("CREATE TABLE scratch (id INTEGER PRIMARY KEY, name TEXT)")
+    return app
+
+
+def test_executemany_reports_rowcount_and_reads_are_buffered(scratch):
+    result = api_db_management.execute_query(
+        "INSERT INTO scratch (name) VALUES (:name)", [{'name': f'n{i}'} for i in range(25)]
+    )
+    assert result == [] and result.rowcount == 25
+
+    rows = api_db_management.execute_query("SELECT * FROM scratch WHERE id > :after ORDER BY id", {'after': 20})
+    assert isinstance(rows, api_db_management.QueryResult)
+    assert [row.name for row in rows] == ['n20', 'n21', 'n22', 'n23', 'n24'] and rows.rowcount == 5
+    assert rows.elapsed_ms >= 0
+    assert api_db_management.execute_query("SELECT name FROM scratch WHERE id = 3", one=True).name == 'n2'
+
+
+def test_streamed_reads_fetch_lazily(scratch):
+    api_db_management.execute_query("INSERT INTO scratch (name) VALUES (:name)", [{'name': str(i)} for i in range(10)])
+    queries = api_db_management.get_query_metrics()['queries']
+
+    rows = api_db_management.execute_query("SELECT name FROM scratch ORDER BY id", stream=True, batch_size=3)
+    assert not isinstance(rows, list)
+    assert api_db_management.get_query_metrics()['queries'] == queries  # nothing runs until iterated
+    assert [row.name for row in rows] == [str(i) for i in range(10)]
+    assert api_db_management.get_query_metrics()['queries'] == queries + 1
+
+
+def test_statement_cache_hits_and_evicts(monkeypatch):
+    monkeypatch.setattr(api_db_management, 'STATEMENT_CACHE_SIZE', 2)
+    monkeypatch.setattr(api_db_management, '_statement_cache', api_db_management.OrderedDict())
+    before = api_db_management.get_query_metrics()
+
+    first = api_db_management.get_statement("SELECT 1")
+    assert api_db_management.get_statement("SELECT 1") is first
+    api_db_management.get_statement("SELECT 2")
+    api_db_management.get_statement("SELECT 1")  # most recently used, so "SELECT 2" is evicted next
+    api_db_management.get_statement("SELECT 3")
+    assert list(api_db_management._statement_cache) == ["SELECT 1", "SELECT 3"]
+
+    after = api_db_management.get_query_metrics()
+    assert after['statement_cache_hits'] - before['statement_cache_hits'] == 2
+    assert after['statement_cache_misses'] - before['statement_cache_misses'] == 3
+
+
+def test_errors_propagate_and_are_counted(app):
+    errors = api_db_management.get_query_metrics()['errors']
+    with pytest.raises(OperationalError):
+        api_db_management.execute_query("SELECT * FROM missing_table")
+    with pytest.raises(OperationalError):
+        list(api_db_management.execute_query("SELECT * FROM missing_table", stream=True))
+    assert api_db_management.get_query_metrics()['errors'] == errors + 2
+
+
+def test_nested_sessions_are_independent(scratch):
+    with api_db_management.get_db_session() as outer:
+        outer.execute(text("INSERT INTO scratch (name) VALUES ('outer')"))
+        with api_db_management.get_db_session() as inner:
+            assert inner is not outer
+            inner.execute(text("SELECT 1"))
+        # Closing the inner session leaves the outer one usable
+        outer.execute(text("INSERT INTO scratch (name) VALUES ('outer again')"))
+    assert [row.name for row in api_db_management.execute_query("SELECT name FROM scratch ORDER BY id")] == [
+        'outer', 'outer again']
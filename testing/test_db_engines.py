@@ -0,0 +1,60 @@
+import threading
+
+import pytest
+from sqlalchemy import exc, text
+
+from db_engines import EngineRegistry, InstrumentedQueuePool
+from models import db
+
+
+@pytest.fixture
+def app_config():
+    # DB_POOL_TIMEOUT is in whole seconds: the primary engine's options are coerced to int
+    return {'DB_POOL_SIZE': 1, 'DB_MAX_OVERFLOW': 0, 'DB_POOL_TIMEOUT': 1}
+
+
+def test_registry_creates_named_engines_once(flask_app, tmp_path):
+    registry = EngineRegistry()
+    configured = []
+    registry.register('reports', lambda app: (f"sqlite:///{tmp_path / 'reports.db'}", {}), configure=configured.append)
+    registry.register('alias', lambda app: (None, {}))
+    registry.init_app(flask_app, db)
+
+    with flask_app.app_context():
+        reports = registry.get_engine('reports')
+        assert registry.get_engine('reports') is reports and configured == [reports]
+        assert isinstance(reports.pool, InstrumentedQueuePool)
+        assert registry.get_engine('alias') is registry.get_engine('primary') is db.engine
+        assert set(registry.all_engines()) == {'primary', 'reports', 'alias'}
+        assert set(registry.distinct_engines()) == {'primary', 'reports'}
+        with pytest.raises(KeyError):
+            registry.get_engine('missing')
+        registry.dispose()
+
+
+def test_pool_stats_count_checkouts_waits_and_timeouts(flask_app):
+    registry = EngineRegistry()
+    registry.init_app(flask_app, db)
+    with flask_app.app_context():
+        engine = registry.get_engine()
+        held = engine.connect()
+        held.execute(text("SELECT 1"))
+
+        # The only connection is taken: a second checkout times out
+        with pytest.raises(exc.TimeoutError):
+            engine.connect()
+
+        # ...and one that gets it back while waiting counts as a wait
+        release = threading.Timer(0.05, held.close)
+        release.start()
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        release.join()
+
+        stats = registry.pool_stats()['primary']
+        assert stats['pool_class'] == 'InstrumentedQueuePool' and stats['size'] == 1
+        assert stats['connections_created'] == 1
+        assert stats['checkouts'] == 3 and stats['timeouts'] == 1
+        assert stats['waits'] == 2 and stats['max_wait_ms'] >= 40
+        assert stats['checked_out'] == 0
+        registry.dispose()
@@ -0,0 +1,153 @@
+import sqlite3
+import threading
+import time
+
+import pytest
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from conftest import user_row
+import db_retry
+from db_engines import SQLITE_PRAGMA_PROFILES, engines, install_sqlite_pragmas
+from db_retry import get_retry_metrics, is_lock_error, retry_on_lock
+import messages
+from models import User, db
+import notifications
+import sharding
+
+
+def locked_error():
+    return OperationalError("INSERT ...", {}, sqlite3.OperationalError("database is locked"))
+
+
+def test_is_lock_error():
+    assert is_lock_error(locked_error())
+    assert is_lock_error(sqlite3.OperationalError("database table is locked"))
+    assert not is_lock_error(OperationalError("SELECT", {}, sqlite3.OperationalError("no such table: users")))
+    assert not is_lock_error(IntegrityError("INSERT", {}, sqlite3.IntegrityError("UNIQUE constraint failed")))
+    assert not is_lock_error(ValueError("database is locked"))
+
+
+def test_retries_until_success(monkeypatch):
+    monkeypatch.setattr(db_retry.time, 'sleep', lambda seconds: None)
+    attempts = []
+
+    @retry_on_lock(rollback_session=False)
+    def write():
+        attempts.append(1)
+        if len(attempts) < 3:
+            raise locked_error()
+        return 'ok'
+
+    assert write() == 'ok'
+    assert len(attempts) == 3
+    unit = get_retry_metrics()['units'][f"{__name__}.test_retries_until_success.<locals>.write"]
+    assert unit == {'calls': 1, 'retries': 2, 'recovered': 1, 'gave_up': 0}
+
+
+def test_gives_up_after_deadline():
+    attempts = []
+
+    @retry_on_lock(deadline=0.05, base_delay=0.01, max_delay=0.01, rollback_session=False)
+    def write():
+        attempts.append(1)
+        raise locked_error()
+
+    with pytest.raises(OperationalError):
+        write()
+    assert len(attempts) > 1
+    unit = get_retry_metrics()['units'][f"{__name__}.test_gives_up_after_deadline.<locals>.write"]
+    assert unit['gave_up'] == 1
+
+
+def test_other_errors_are_not_retried():
+    attempts = []
+
+    @retry_on_lock(rollback_session=False)
+    def write():
+        attempts.append(1)
+        raise ValueError("bad input")
+
+    with pytest.raises(ValueError):
+        write()
+    assert len(attempts) == 1
+
+
+@pytest.mark.parametrize("profile", sorted(SQLITE_PRAGMA_PROFILES))
+def test_sqlite_busy_timeout_leaves_room_for_retries(profile):
+    assert SQLITE_PRAGMA_PROFILES[profile]['busy_timeout'] * 4 <= db_retry.DEFAULT_DEADLINE_SECONDS * 1000
+
+
+def test_retries_a_really_locked_database(tmp_path):
+    path = tmp_path / 'locked.db'
+    engine = create_engine(f"sqlite:///{path}")
+    install_sqlite_pragmas(engine, {'SQLITE_PRAGMA_PROFILE': 'performance'})
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (x INTEGER)"))
+
+    # Another process holds the write lock for longer than SQLite's busy_timeout
+    holder = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+    holder.execute("BEGIN IMMEDIATE")
+    holder.execute("INSERT INTO t VALUES (0)")
+    release = threading.Timer(0.6, holder.execute, args=("COMMIT",))
+    release.start()
+
+    @retry_on_lock(rollback_session=False)
+    def write():
+        with engine.begin() as connection:
+            connection.execute(text("INSERT INTO t VALUES (1)"))
+
+    started = time.monotonic()
+    try:
+        write()
+    finally:
+        release.join()
+        holder.close()
+    assert time.monotonic() - started < db_retry.DEFAULT_DEADLINE_SECONDS
+    unit = get_retry_metrics()['units'][f"{__name__}.test_retries_a_really_locked_database.<locals>.write"]
+    assert unit['retries'] >= 1 and unit['recovered'] == 1 and unit['gave_up'] == 0
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM t")).scalar() == 2
+    engine.dispose()
+
+
+def fail_once(monkeypatch, module, name):
+    real = getattr(module, name)
+    failures = [locked_error()]
+
+    def flaky(*args, **kwargs):
+        if failures:
+            raise failures.pop()
+        return real(*args, **kwargs)
+    monkeypatch.setattr(module, name, flaky)
+
+
+@pytest.mark.parametrize('shard_count', [2])
+@pytest.mark.parametrize('write', ['remove_message', 'notify'])
+def test_retried_shard_write_keeps_the_outer_units_changes(app, monkeypatch, write):
+    monkeypatch.setattr(db_retry.time, 'sleep', lambda seconds: None)
+    shard_map = sharding.get_shard_map()
+    user_id = next(user_id for user_id in range(2, 100) if shard_map.shard_for_conversation(1, user_id) != 0
+                   and shard_map.shard_for_user(user_id) != 0)
+    with engines.get_engine().begin() as connection:
+        connection.execute(User.__table__.insert(), [user_row(1), user_row(user_id)])
+    message_id = messages.store_message(1, user_id, 'hi')
+    fail_once(monkeypatch, sharding, 'execute_write' if write == 'remove_message' else 'insert_rows')
+
+    @retry_on_lock
+    def review():
+        # Pending (unflushed) change of the outer unit, like flag.reviewed in the admin review
+        db.session.get(User, 1).is_banned = True
+        if write == 'remove_message':
+            assert messages.remove_message(message_id)
+        else:
+            notifications._insert_notifications([user_id], 'reviewed', 'admin', False)
+        db.session.commit()
+
+    review()
+    db.session.expire_all()
+    assert db.session.get(User, 1).is_banned
+    if write == 'remove_message':
+        assert messages.get_message(message_id).deleted
+    else:
+        assert [row.message for row in notifications.get_user_notifications(user_id)] == ['reviewed']
@@ -0,0 +1,71 @@
+import time
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from conftest import user_row
+from db_engines import engines
+from models import Group, GroupMembership
+import group_membership
+from group_membership import MemberSet, add_members, create_group, is_member, membership_cache, remove_members
+from unit_of_work import unit_of_work
+
+
+@pytest.fixture
+def user_rows():
+    return [user_row(i, is_banned=i == 9) for i in range(1, 11)]
+
+
+@pytest.fixture
+def app(app):
+    membership_cache.init_app(app)
+    return app
+
+
+def count(table):
+    with engines.get_engine().connect() as connection:
+        return connection.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_member_sets_pick_bitmap_or_sorted_array():
+    dense = MemberSet(range(0, 200000, 2))
+    sparse = MemberSet([5, 10**9, 3, 5])
+    assert dense._bitmap is not None and sparse._ids is not None
+    assert len(dense) == 100000 and len(sparse) == 3
+    assert 199998 in dense and 199999 not in dense and 10**7 not in dense and -1 not in dense
+    assert 10**9 in sparse and 4 not in sparse
+    assert sparse.user_ids() == [3, 5, 10**9] and dense.user_ids()[:3] == [0, 2, 4]
+    assert dense.nbytes == 25000
+
+    started = time.perf_counter()
+    for user_id in range(100000):
+        user_id in dense
+    assert time.perf_counter() - started < 1
+
+
+def test_create_group_commits_once_and_bulk_changes_invalidate_cache(app):
+    with unit_of_work():
+        group_id = create_group('big', 1, [2, 3])
+        assert count(Group.__table__) == 0  # not committed until the unit of work ends
+    assert is_member(group_id, 1) and is_member(group_id, 3) and not is_member(group_id, 4)
+
+    with unit_of_work():
+        assert add_members(group_id, [3, 4, 5, 5]) == 2
+        assert not is_member(group_id, 4)  # cached set is replaced once the change commits
+    assert is_member(group_id, 4) and group_membership.count_members(group_id) == 5
+
+    with unit_of_work():
+        assert remove_members(group_id, [1, 4, 8]) == 2
+    assert group_membership.get_member_ids(group_id) == [2, 3, 5]
+    assert group_membership.get_user_group_ids(2) == [group_id]
+    assert group_membership.existing_user_ids([12, 9, 7, 1, 7]) == [7, 1]
+
+
+def test_memberships_are_unique(app):
+    with engines.get_engine().begin() as connection:
+        connection.execute(GroupMembership.__table__.insert().values(group_id=1, user_id=1))
+    with pytest.raises(IntegrityError):
+        with engines.get_engine().begin() as connection:
+            connection.execute(GroupMembership.__table__.insert().values(group_id=1, user_id=1))
+    assert count(GroupMembership.__table__) == 1
@@ -0,0 +1,158 @@
+import sqlite3
+
+import pytest
+from sqlalchemy import event, func, select
+
+from conftest import user_row
+from db_engines import engines
+from group_membership import add_members, create_group, membership_cache
+from group_messages import (
+    UNREAD_COUNT_CAP, get_group_messages, mark_group_read, post_group_message, unread_counts,
+)
+from models import GroupReadCursor, Message, db
+import sharding
+
+
+@pytest.fixture
+def shard_count():
+    return 2
+
+
+@pytest.fixture
+def app_config():
+    return {'GROUP_FANOUT_ON_WRITE_MAX_MEMBERS': 5}
+
+
+@pytest.fixture
+def user_rows():
+    return [user_row(i) for i in range(1, 21)]
+
+
+@pytest.fixture
+def app(app):
+    membership_cache.init_app(app)
+    return app
+
+
+def unread(user_id):
+    return {group_id: entry['unread'] for group_id, entry in unread_counts(user_id).items()}
+
+
+def test_posting_to_a_large_group_is_one_insert(app):
+    group_id = create_group('big', 1, range(2, 21))
+    index = sharding.get_shard_map().shard_for_group(group_id)
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement.split()[0].upper())
+
+    engines_seen = {sharding.shard_engine(i) for i in range(2)}
+    for engine in engines_seen:
+        event.listen(engine, 'before_cursor_execute', record)
+    try:
+        message_id = post_group_message(group_id, 1, 'hello everyone')
+    finally:
+        for engine in engines_seen:
+            event.remove(engine, 'before_cursor_execute', record)
+
+    assert [s for s in statements if s != 'SELECT'] == ['INSERT']
+    assert sharding.get_shard_map().shard_for_id(message_id) == index
+    messages = Message.__table__
+    with sharding.shard_engine(index).connect() as connection:
+        assert connection.execute(select(func.count()).select_from(messages)).scalar() == 1
+    assert unread(2) == {group_id: 1} and unread(1) == {group_id: 0}
+
+
+def test_small_groups_keep_counters_current(app):
+    group_id = create_group('small', 1, [2, 3])
+    first_id, _ = [post_group_message(group_id, 1, content) for content in ('a', 'b')]
+    assert mark_group_read(group_id, 2) == 0
+    assert mark_group_read(group_id, 3, message_id=first_id) == 1
+
+    post_group_message(group_id, 1, 'c')
+    post_group_message(group_id, 2, 'd')
+    cursors = GroupReadCursor.__table__
+    with engines.get_engine().connect() as connection:
+        stored = dict(connection.execute(select(cursors.c.user_id, cursors.c.unread_count)).fetchall())
+    # Member 2 does not count their own message
+    assert stored[2] == 1
+    assert unread(2) == {group_id: 1} and unread(3) == {group_id: 3}
+
+    # Counters that miss a post (here: the group grew past the fan-out size) are recounted on read
+    add_members(group_id, [4, 5, 6, 7])
+    post_group_message(group_id, 1, 'e')
+    assert unread(2) == {group_id: 2} and unread(4) == {group_id: 5}
+
+
+def test_read_cursor_never_moves_back_and_counts_are_capped(app):
+    group_id = create_group('busy', 1, range(2, 10))
+    sharding.insert_rows('messages', [
+        {'sender_id': 1, 'receiver_id': None, 'group_id': group_id, 'content': str(i), 'deleted': False}
+        for i in range(UNREAD_COUNT_CAP + 10)
+    ])
+    assert unread(2) == {group_id: UNREAD_COUNT_CAP}
+    assert mark_group_read(group_id, 2) == 0
+    assert mark_group_read(group_id, 2, message_id=0) == 0
+    assert unread_counts(2)[group_id]['last_read_message_id'] == unread_counts(2)[group_id]['latest_message_id']
+
+
+def test_group_pages_are_newest_first(app):
+    group_id = create_group('paged', 1, [2])
+    ids = [post_group_message(group_id, 1 + i % 2, f'm{i}') for i in range(7)]
+    first = get_group_messages(group_id, limit=3)
+    assert [row.id for row in first] == ids[:-4:-1]
+    second = get_group_messages(group_id, limit=3, before_id=first[-1].id)
+    assert [row.id for row in second] == ids[-4:-7:-1]
+    assert [row.id for row in get_group_messages(group_id, before_id=second[-1].id)] == ids[:1]
+
+
+def test_lock_error_on_counters_does_not_repeat_the_insert(app):
+    group_id = create_group('retry', 1, [2])
+    post_group_message(group_id, 1, 'a')
+    mark_group_read(group_id, 2)
+    failures = []
+
+    def lock_cursor_update_once(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith('UPDATE group_read_cursors') and not failures:
+            failures.append(statement)
+            raise sqlite3.OperationalError('database is locked')
+
+    event.listen(db.engine, 'before_cursor_execute', lock_cursor_update_once)
+    try:
+        post_group_message(group_id, 1, 'b')
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', lock_cursor_update_once)
+
+    assert len(failures) == 1
+    assert [row.content for row in get_group_messages(group_id)] == ['b', 'a']
+    cursors = GroupReadCursor.__table__
+    with engines.get_engine().connect() as connection:
+        assert connection.execute(select(cursors.c.unread_count).where(cursors.c.user_id == 2)).scalar() == 1
+
+
+def test_unread_counts_take_a_fixed_number_of_statements(app):
+    group_ids = [create_group(f'g{i}', 1, [2]) for i in range(30)]
+    for group_id in group_ids[::2]:
+        post_group_message(group_id, 1, 'hi')
+    for group_id in group_ids[::4]:
+        mark_group_read(group_id, 2)
+    for group_id in group_ids[::2]:
+        post_group_message(group_id, 1, 'again')
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    shard_engines = {sharding.shard_engine(i) for i in range(2)}
+    for engine in shard_engines:
+        event.listen(engine, 'before_cursor_execute', record)
+    try:
+        counts = unread(2)
+    finally:
+        for engine in shard_engines:
+            event.remove(engine, 'before_cursor_execute', record)
+
+    # Groups read after the first post have one unread (a stored counter), the other posted-to groups two
+    assert counts == {group_id: [1, 0, 2, 0][i % 4] for i, group_id in enumerate(group_ids)}
+    # Memberships and cursors, then the latest ids and the recounts on each shard
+    assert len(statements) <= 2 + 2 * 2
@@ -0,0 +1,40 @@
+from datetime import datetime, timezone
+import numpy as np
+import pytest
+from histograms import bucket_edges, bucket_events
+
+def epoch(*args):
+    return int(datetime(*args, tzinfo=timezone.utc).timestamp())
+
+def test_day_edges_align_to_midnight():
+    """Day buckets start at midnight even when the range does not."""
+    edges = bucket_edges(datetime(2024, 1, 1, 15, 30), datetime(2024, 1, 4), 'day')
+    assert edges.tolist() == [epoch(2024, 1, d) for d in range(1, 5)]
+
+def test_week_edges_start_on_monday():
+    """Week buckets start on Monday."""
+    edges = bucket_edges(datetime(2024, 1, 10), datetime(2024, 1, 20), 'week')
+    assert edges[0] == epoch(2024, 1, 8)
+
+def test_month_edges_follow_calendar():
+    """Month buckets follow calendar months of different lengths."""
+    edges = bucket_edges(datetime(2024, 1, 15), datetime(2024, 3, 1), 'month')
+    assert edges.tolist() == [epoch(2024, 1, 1), epoch(2024, 2, 1), epoch(2024, 3, 1)]
+
+def test_too_many_buckets_rejected():
+    """Minute buckets over several years are refused."""
+    with pytest.raises(ValueError):
+        bucket_edges(datetime(2020, 1, 1), datetime(2024, 1, 1), 'minute')
+
+def test_bucket_events_counts_and_drops_out_of_range():
+    """Events are counted per bucket; events outside the range are ignored."""
+    edges = np.array([0, 10, 20, 30])
+    counts = bucket_events([-5, 0, 9, 10, 25, 29, 30, 100], edges)
+    assert counts.tolist() == [2, 1, 2]
+
+def test_bucket_events_breakdown():
+    """Counts can be split into one series per key."""
+    edges = np.array([0, 10, 20])
+    keys, counts = bucket_events([1, 2, 15, 3], edges, keys=['b', 'a', 'a', 'b'])
+    assert keys.tolist() == ['a', 'b']
+    assert counts.tolist() == [[1, 1], [2, 0]]
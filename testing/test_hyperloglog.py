@@ -0,0 +1,47 @@
+import pytest
+from hyperloglog import HyperLogLog
+
+def test_empty_sketch_counts_zero():
+    """An empty sketch estimates zero distinct values."""
+    assert HyperLogLog().count() == 0
+
+def test_duplicates_are_not_counted_twice():
+    """Adding the same ids repeatedly does not change the estimate."""
+    sketch = HyperLogLog()
+    for _ in range(5):
+        for user_id in range(100):
+            sketch.add(user_id)
+    assert sketch.count() == pytest.approx(100, rel=0.05)
+
+@pytest.mark.parametrize("n", [1000, 50000])
+def test_count_within_error_bounds(n):
+    """Estimates stay within a few standard errors of the true count."""
+    sketch = HyperLogLog()
+    for user_id in range(n):
+        sketch.add(user_id)
+    assert sketch.count() == pytest.approx(n, rel=0.06)
+
+def test_merge_estimates_union():
+    """Merged sketches estimate the size of the union of overlapping sets."""
+    monday, tuesday = HyperLogLog(), HyperLogLog()
+    for user_id in range(0, 6000):
+        monday.add(user_id)
+    for user_id in range(3000, 9000):
+        tuesday.add(user_id)
+    assert HyperLogLog.union([monday, tuesday]).count() == pytest.approx(9000, rel=0.06)
+
+def test_serialization_round_trip():
+    """Sketches survive to_bytes()/from_bytes() and stay compact."""
+    sketch = HyperLogLog()
+    for user_id in range(200):
+        sketch.add(user_id)
+    blob = sketch.to_bytes()
+    assert len(blob) < 4096
+    restored = HyperLogLog.from_bytes(blob)
+    assert restored.registers == sketch.registers
+    assert restored.count() == sketch.count()
+
+def test_merge_rejects_mismatched_precision():
+    """Sketches with different precision cannot be merged."""
+    with pytest.raises(ValueError):
+        HyperLogLog(12).merge(HyperLogLog(10))
@@ -0,0 +1,70 @@
+import pytest
+from flask import Flask
+from sqlalchemy import update
+
+from conftest import user_row
+from models import User, db
+from query_instrumentation import track_queries
+from unit_of_work import unit_of_work
+from utils import get_identity, identity_cache, invalidate_identity, verify_admin
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'identity.db'}"
+    db.init_app(app)
+    identity_cache.init_app(app)
+    with app.app_context():
+        User.__table__.create(db.engine)
+        db.session.execute(User.__table__.insert(), [user_row(1, role='admin'), user_row(2)])
+        db.session.commit()
+    return app
+
+
+def set_user(user_id, **values):
+    db.session.execute(update(User.__table__).where(User.__table__.c.id == user_id).values(**values))
+
+
+def test_repeated_checks_load_a_user_once(app):
+    with app.test_request_context():
+        with track_queries() as stats:
+            assert verify_admin(1)
+            assert verify_admin(1)
+            assert not verify_admin(2)
+            assert not verify_admin(999)
+        assert stats.count == 3
+
+    # A later request is served from the process cache
+    with app.test_request_context():
+        with track_queries() as stats:
+            assert verify_admin(1)
+        assert stats.count == 0
+
+
+def test_changes_apply_once_committed(app):
+    with app.test_request_context():
+        assert not get_identity(2).is_banned
+
+    with app.test_request_context():
+        with unit_of_work():
+            set_user(2, is_banned=True)
+            invalidate_identity(2)
+            # This request sees its own change; other requests keep the committed state until commit
+            assert get_identity(2).is_banned
+            assert identity_cache._entries[2][0].is_banned is False
+        assert 2 not in identity_cache._entries
+
+    with app.test_request_context():
+        assert get_identity(2).is_banned
+
+
+def test_entries_expire_after_ttl(app):
+    app.config['IDENTITY_CACHE_TTL'] = 0
+    identity_cache.init_app(app)
+    with app.test_request_context():
+        assert verify_admin(1)
+        set_user(1, role='user')
+        db.session.commit()
+    with app.test_request_context():
+        assert not verify_admin(1)
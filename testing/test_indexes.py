@@ -0,0 +1,67 @@
+import pytest
+from sqlalchemy import create_engine, text
+from models import db
+
+# (hot query, parameters, index it must use)
+HOT_QUERIES = [
+    ("SELECT * FROM notifications WHERE user_id = :user_id AND is_read = 0 "
+     "ORDER BY created_at DESC LIMIT 10",
+     {'user_id': 1}, 'ix_notifications_unread'),
+    ("SELECT * FROM notifications WHERE user_id = :user_id ORDER BY created_at DESC LIMIT 10",
+     {'user_id': 1}, 'ix_notifications_user_created'),
+    ("SELECT * FROM notifications ORDER BY created_at DESC LIMIT 10",
+     {}, 'ix_notifications_created_at'),
+    ("SELECT * FROM messages WHERE sender_id = :a AND receiver_id = :b ORDER BY created_at DESC LIMIT 50",
+     {'a': 1, 'b': 2}, 'ix_messages_sender_receiver_created'),
+    ("SELECT * FROM messages WHERE receiver_id = :user_id AND deleted = 0 ORDER BY created_at DESC LIMIT 50",
+     {'user_id': 1}, 'ix_messages_receiver_created_live'),
+    ("SELECT COUNT(*) FROM messages WHERE created_at >= :since",
+     {'since': '2024-01-01'}, 'ix_messages_created_at'),
+    ("SELECT * FROM messages WHERE group_id = :g AND id > :after ORDER BY id DESC LIMIT 50",
+     {'g': 1, 'after': 0}, 'ix_messages_group_id'),
+    ("SELECT * FROM flagged_content WHERE reviewed = 0 ORDER BY created_at DESC",
+     {}, 'ix_flagged_content_reviewed_created'),
+    ("SELECT * FROM flagged_content WHERE message_id = :message_id",
+     {'message_id': 1}, 'ix_flagged_content_message_id'),
+    ("SELECT * FROM activity_logs WHERE user_id = :user_id AND timestamp >= :cutoff ORDER BY timestamp DESC",
+     {'user_id': 1, 'cutoff': '2024-01-01'}, 'ix_activity_logs_user_timestamp'),
+    ("SELECT * FROM activity_logs ORDER BY timestamp DESC LIMIT 20",
+     {}, 'ix_activity_logs_timestamp'),
+    ("SELECT COUNT(*) FROM users WHERE last_login >= :since",
+     {'since': '2024-01-01'}, 'ix_users_last_login'),
+    ("SELECT COUNT(*) FROM users WHERE moderation_status = 'suspended' AND suspended_until > :now",
+     {'now': '2024-01-01'}, 'ix_users_moderation'),
+    ("SELECT COUNT(*) FROM users WHERE moderation_status = 'banned'",
+     {}, 'ix_users_moderation'),
+    # Either unique index answers an exact membership check
+    ("SELECT * FROM group_membership WHERE group_id = :group_id AND user_id = :user_id",
+     {'group_id': 1, 'user_id': 1}, 'uq_group_membership_'),
+    ("SELECT user_id FROM group_membership WHERE group_id = :group_id",
+     {'group_id': 1}, 'uq_group_membership_group_user'),
+    ("SELECT group_id FROM group_membership WHERE user_id = :user_id ORDER BY group_id",
+     {'user_id': 1}, 'uq_group_membership_user_group'),
+]
+
+@pytest.fixture(scope='module')
+def connection():
+    """
+    In-memory SQLite database with the full schema, indexes included, and
+    planner statistics from a realistic mix of read and unread notifications.
+    """
+    engine = create_engine('sqlite://')
+    db.metadata.create_all(engine)
+    with engine.connect() as connection:
+        connection.execute(
+            text("INSERT INTO notifications (user_id, type, message, is_read, created_at) "
+                 "VALUES (:user_id, 'info', 'hello', :is_read, '2024-01-01')"),
+            [{'user_id': i % 50, 'is_read': int(i % 10 != 0)} for i in range(2000)]
+        )
+        connection.execute(text("ANALYZE"))
+        yield connection
+
+@pytest.mark.parametrize("query, params, index_name", HOT_QUERIES)
+def test_hot_query_uses_index(connection, query, params, index_name):
+    """Each hot query is answered from its index rather than a full table scan."""
+    plan = connection.execute(text("EXPLAIN QUERY PLAN " + query), params).fetchall()
+    details = " | ".join(row[-1] for row in plan)
+    assert index_name in details, details
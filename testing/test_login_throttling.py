@@ -0,0 +1,97 @@
+import pytest
+from sqlalchemy import func, select
+
+from models import LoginFailure, db
+import login_throttling
+from login_throttling import LoginThrottle, account_key, ip_key
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(login_throttling, 'time', clock)
+    return clock
+
+
+@pytest.fixture
+def app_config():
+    return dict(LOGIN_THROTTLE_ACCOUNT_LIMIT=6, LOGIN_THROTTLE_IP_LIMIT=20, LOGIN_THROTTLE_FREE_FAILURES=3,
+                LOGIN_THROTTLE_WINDOW_SECONDS=600, LOGIN_THROTTLE_SYNC_SECONDS=5)
+
+
+def make_throttle(app):
+    throttle = LoginThrottle()
+    throttle.init_app(app)
+    return throttle
+
+
+def test_delays_grow_then_lock_out_until_failures_age_out(app, clock):
+    throttle = make_throttle(app)
+    keys = (account_key('login', ' Alice '), ip_key('10.0.0.1'))
+    assert keys[0] == 'login:alice'
+
+    waits = []
+    for _ in range(6):
+        assert throttle.retry_after(*keys) == 0
+        throttle.record_failure(*keys)
+        waits.append(throttle.retry_after(*keys))
+        clock.now += waits[-1]
+    # Three free failures, then 1, 2, 4 s, then locked out for the rest of the window
+    assert waits[:5] == [0, 0, 1, 2, 4]
+    assert waits[5] == 600 - 7
+
+    clock.now += 600
+    assert throttle.retry_after(*keys) == 0
+    metrics = throttle.get_metrics()
+    assert metrics["failures"] == 6 and metrics["delayed"] == 3 and metrics["locked_out"] == 1
+
+
+def test_success_clears_the_account_but_not_the_ip(app, clock):
+    throttle = make_throttle(app)
+    address = ip_key('10.0.0.2')
+    for user in range(20):
+        throttle.record_failure(account_key('login', f'user{user}'), address)
+    assert throttle.retry_after(account_key('login', 'someone-else'), address) == 600
+
+    account = account_key('login', 'bob')
+    for _ in range(4):
+        throttle.record_failure(account)
+    throttle.record_success(account)
+    assert throttle.retry_after(account) == 0
+    with db.engine.connect() as connection:
+        assert connection.execute(
+            select(func.count()).select_from(LoginFailure.__table__)
+            .where(LoginFailure.__table__.c.throttle_key == account)
+        ).scalar() == 0
+
+
+def test_workers_share_failures_and_fall_back_to_memory(app, clock):
+    first, second = make_throttle(app), make_throttle(app)
+    account = account_key('reset', 'carol@example.com')
+    for _ in range(6):
+        first.record_failure(account)
+    assert second.retry_after(account) == 600
+
+    # Without the shared table each process still throttles on what it saw itself
+    LoginFailure.__table__.drop(db.engine)
+    for _ in range(6):
+        second.record_failure(account_key('login', 'dave'))
+    assert second.retry_after(account_key('login', 'dave')) == 600
+    assert second.get_metrics()["store_errors"] > 0
+
+    LoginFailure.__table__.create(db.engine)
+    first.record_failure(account)
+    clock.now += login_throttling.login_throttle.window + 1
+    with app.app_context():
+        assert login_throttling.sweep_login_failures() == 1
@@ -0,0 +1,102 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, update
+
+from db_engines import engines
+from models import Message, MessageArchivePartition
+import message_archive
+import messages
+import sharding
+
+
+@pytest.fixture
+def app(app):
+    now = datetime.utcnow()
+    # One message every 10 days for a year between users 1 and 2, plus noise from user 3
+    sharding.insert_rows('messages', [
+        {'sender_id': 1 + i % 2, 'receiver_id': 2 - i % 2, 'content': f'message {i}',
+         'created_at': now - timedelta(days=10 * i), 'deleted': False}
+        for i in range(37)
+    ] + [
+        {'sender_id': 3, 'receiver_id': 1, 'content': 'noise', 'created_at': now - timedelta(days=200),
+         'deleted': False}
+    ])
+    return app
+
+
+def test_old_messages_move_to_monthly_partitions(app):
+    assert message_archive.archive_messages(older_than_days=90) == 29
+    assert sharding.count_rows('messages') == 9
+    assert message_archive.count_archived_messages() == 29
+
+    partitions = message_archive.list_partitions()
+    assert len(partitions) >= 8
+    assert [p.month for p in partitions] == sorted((p.month for p in partitions), reverse=True)
+    assert sum(p.row_count for p in partitions) == 29
+
+    # Nothing left to move, and a rerun does not duplicate rows
+    assert message_archive.archive_messages(older_than_days=90) == 0
+    assert message_archive.count_archived_messages() == 29
+
+
+def test_archived_conversation_pages_newest_first(app):
+    message_archive.archive_messages(older_than_days=90)
+
+    history = message_archive.get_archived_conversation(1, 2, limit=100)
+    assert [row.content for row in history] == [f'message {i}' for i in range(9, 37)]
+
+    first_page = message_archive.get_archived_conversation(1, 2, limit=5)
+    assert [row.content for row in first_page] == [f'message {i}' for i in range(9, 14)]
+    older = message_archive.get_archived_conversation(1, 2, limit=5, before=first_page[-1].created_at)
+    assert [row.content for row in older] == [f'message {i}' for i in range(14, 19)]
+
+
+def test_archived_messages_are_found_by_id(app):
+    messages = Message.__table__
+    with engines.get_engine().connect() as connection:
+        old_ids = connection.execute(
+            select(messages.c.id).where(messages.c.content.in_(['message 20', 'message 30']))
+        ).scalars().all()
+    message_archive.archive_messages(older_than_days=90)
+
+    found = message_archive.get_archived_messages(old_ids + [999999])
+    assert set(found) == set(old_ids)
+    assert {row.content for row in found.values()} == {'message 20', 'message 30'}
+
+
+def test_conversation_pages_continue_from_hot_rows_into_the_archive(app):
+    message_archive.archive_messages(older_than_days=90)
+
+    first_page = messages.get_conversation(1, 2, limit=12)
+    assert [row.content for row in first_page] == [f'message {i}' for i in range(12)]
+    older = messages.get_conversation(1, 2, limit=12, before=first_page[-1].created_at)
+    assert [row.content for row in older] == [f'message {i}' for i in range(12, 24)]
+
+
+def test_only_archive_files_holding_the_conversation_are_opened(app, monkeypatch):
+    message_archive.archive_messages(older_than_days=90)
+    opened = []
+    partition_engine = message_archive._partition_engine
+
+    def counting_partition_engine(path):
+        opened.append(path)
+        return partition_engine(path)
+
+    monkeypatch.setattr(message_archive, '_partition_engine', counting_partition_engine)
+    assert messages.get_conversation(2, 3) == []
+    assert opened == []
+    assert [row.content for row in messages.get_conversation(3, 1)] == ['noise']
+    assert len(opened) == 1
+
+    # Files archived before conversations were indexed are searched until the archive job indexes them
+    table = MessageArchivePartition.__table__
+    with engines.get_engine().begin() as connection:
+        unindexed = connection.execute(update(table).values(conversations_indexed=False)).rowcount
+    opened.clear()
+    assert message_archive.get_archived_conversation(2, 3) == []
+    assert len(opened) == unindexed
+    assert message_archive.index_archived_conversations() == unindexed
+    opened.clear()
+    assert message_archive.get_archived_conversation(2, 3) == [] and opened == []
+    assert len(message_archive.get_archived_conversation(1, 2, limit=100)) == 28
@@ -0,0 +1,90 @@
+from datetime import datetime, timedelta
+import sqlite3
+
+import pytest
+from sqlalchemy import func, select, update
+
+from db_engines import engines, sqlite_incremental_vacuum
+from models import FlaggedContent, Message
+import message_archive
+import message_compaction
+import sharding
+
+
+@pytest.fixture
+def app(app):
+    now = datetime.utcnow()
+    sharding.insert_rows('messages', [
+        {'sender_id': 1, 'receiver_id': 2, 'content': 'x' * 2000, 'deleted': False,
+         'created_at': now - timedelta(days=400 if i < 10 else 0)}
+        for i in range(200)
+    ])
+    return app
+
+
+def _soft_delete(ids, deleted_at):
+    messages = Message.__table__
+    with engines.get_engine().begin() as connection:
+        connection.execute(
+            update(messages).where(messages.c.id.in_(ids)).values(deleted=True, deleted_at=deleted_at)
+        )
+
+
+def _flag(message_ids):
+    with engines.get_engine().begin() as connection:
+        connection.execute(FlaggedContent.__table__.insert(), [
+            {'message_id': message_id, 'user_id': 3, 'reason': 'spam', 'created_at': datetime.utcnow()}
+            for message_id in message_ids
+        ])
+
+
+def _count(table):
+    with engines.get_engine().connect() as connection:
+        return connection.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_new_files_use_incremental_auto_vacuum(app):
+    with engines.get_engine().connect() as connection:
+        assert connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2
+
+
+def test_purge_respects_grace_period_and_cascades_to_flags(app):
+    now = datetime.utcnow()
+    _soft_delete(range(11, 111), now - timedelta(hours=48))
+    _soft_delete([150], now)
+    _flag([20, 150, 180])
+
+    assert message_compaction.purge_deleted_messages(older_than_hours=24, batch_size=30) == 100
+    assert _count(Message.__table__) == 100
+    with engines.get_engine().connect() as connection:
+        flagged = connection.execute(select(FlaggedContent.__table__.c.message_id)).scalars().all()
+    assert sorted(flagged) == [150, 180]
+    # Purged pages were handed back, so nothing is left to vacuum
+    assert sqlite_incremental_vacuum(engines.get_engine()) == 0
+
+
+def test_deleted_archived_messages_are_purged(app):
+    assert message_archive.archive_messages(older_than_days=90) == 10
+    assert message_archive.delete_archived_message(3)
+    assert not message_archive.delete_archived_message(3)
+    assert sorted(row.id for row in message_archive.get_archived_conversation(1, 2, limit=20)) == [1, 2, 4, 5, 6, 7, 8, 9, 10]
+    _flag([3])
+
+    # Archived messages get the same grace period as hot ones
+    assert message_compaction.purge_deleted_messages() == 0
+    assert message_archive.count_archived_messages() == 10
+    assert message_compaction.purge_deleted_messages(older_than_hours=0) == 1
+    assert message_archive.count_archived_messages() == 9
+    assert _count(FlaggedContent.__table__) == 0
+
+
+def test_archive_files_from_before_deleted_at_are_upgraded(app):
+    assert message_archive.archive_messages(older_than_days=90) == 10
+    path = message_archive.list_partitions()[0].path
+    message_archive._partition_engines.pop(path).dispose()
+    with sqlite3.connect(path) as connection:
+        connection.execute("ALTER TABLE archived_messages DROP COLUMN deleted_at")
+
+    assert message_archive.delete_archived_message(3)
+    assert message_compaction.purge_deleted_messages() == 0
+    assert message_compaction.purge_deleted_messages(older_than_hours=0) == 1
@@ -0,0 +1,29 @@
+import pytest
+from sqlalchemy.orm import configure_mappers
+
+from conftest import user_row
+from models import FlaggedContent, User, db
+
+
+@pytest.fixture
+def user_rows():
+    return [user_row(1, role='admin'), user_row(2)]
+
+
+def test_mappers_configure():
+    configure_mappers()
+
+
+def test_orm_round_trip(app):
+    flag = FlaggedContent(message_id=64, user_id=2, reason='spam')
+    db.session.add(flag)
+    db.session.commit()
+
+    reporter = db.session.get(User, 2)
+    assert User.query.filter_by(role='admin').one().id == 1
+    assert reporter.flagged_contents == [flag] and flag.reporter is reporter and flag.user is reporter
+
+    flag.reviewer = db.session.get(User, 1)
+    db.session.commit()
+    assert db.session.get(FlaggedContent, flag.id).reviewed_by == 1
+    assert db.session.get(User, 1).reviewed_flags == [flag]
@@ -0,0 +1,59 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import select
+
+from conftest import user_row
+from db_engines import engines
+from models import User
+import moderation
+
+
+@pytest.fixture
+def user_rows():
+    now = datetime.utcnow()
+    return [
+        *[user_row(i, moderation_status='suspended', suspended_until=now - timedelta(hours=i)) for i in range(1, 6)],
+        user_row(6, moderation_status='suspended', suspended_until=now + timedelta(days=3)),
+        user_row(7, moderation_status='banned', suspended_until=None, is_banned=True),
+        user_row(8, moderation_status=None, suspended_until=None),
+    ]
+
+
+def statuses():
+    users = User.__table__
+    with engines.get_engine().connect() as connection:
+        return dict(connection.execute(select(users.c.id, users.c.moderation_status)).fetchall())
+
+
+def test_counts_only_running_suspensions(app):
+    assert moderation.count_moderated_users() == {'banned': 1, 'suspended': 1}
+
+
+def test_sweeper_lifts_expired_suspensions_and_notifies_in_batches(app):
+    notified = []
+    lifted = moderation.lift_expired_suspensions(
+        batch_size=2, notify=lambda user_ids, message, notif_type: notified.append(list(user_ids)))
+
+    assert lifted == 5
+    # Longest expired first, one bulk notification per batch
+    assert notified == [[5, 4], [3, 2], [1]]
+    assert statuses() == {1: None, 2: None, 3: None, 4: None, 5: None, 6: 'suspended', 7: 'banned', 8: None}
+    assert moderation.lift_expired_suspensions(notify=lambda *args: notified.append(args)) == 0
+    assert len(notified) == 3
+
+
+def test_ban_and_suspend_set_status(app):
+    # Only the attributes the helpers set (mapping User needs modules this suite cannot import)
+    banned = SimpleNamespace(id=6, is_banned=False, moderation_status='suspended', suspended_until=datetime.utcnow())
+    active = SimpleNamespace(id=8, is_banned=False, moderation_status=None, suspended_until=None)
+    until = datetime.utcnow() + timedelta(days=1)
+    moderation.ban_user(banned)
+    moderation.suspend_user(active, until)
+    assert (banned.is_banned, banned.moderation_status, banned.suspended_until) == (True, 'banned', None)
+    assert (active.moderation_status, active.suspended_until) == ('suspended', until)
+
+    # Suspending does not downgrade a ban
+    moderation.suspend_user(banned, until)
+    assert (banned.moderation_status, banned.suspended_until) == ('banned', None)
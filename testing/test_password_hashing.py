@@ -0,0 +1,61 @@
+import threading
+
+import pytest
+from flask import Flask
+
+from password_hashing import HashingPoolSaturated, PasswordHasher
+
+
+def make_hasher(**config):
+    app = Flask(__name__)
+    app.config.update({'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000', **config})
+    hasher = PasswordHasher()
+    hasher.init_app(app)
+    return hasher
+
+
+@pytest.mark.parametrize('executor', ['inline', 'thread', 'process'])
+def test_hash_and_verify_on_each_executor(executor):
+    hasher = make_hasher(PASSWORD_HASH_EXECUTOR=executor, PASSWORD_HASH_WORKERS=2)
+    try:
+        password_hash = hasher.hash_password('hunter2')
+        assert password_hash.startswith('pbkdf2:sha256:1000$')
+        assert hasher.verify_password(password_hash, 'hunter2')
+        assert not hasher.verify_password(password_hash, 'hunter3')
+        metrics = hasher.get_metrics()
+        assert metrics['completed'] == 3 and metrics['in_flight'] == 0
+    finally:
+        hasher.shutdown()
+
+
+def test_outdated_hashes_are_upgraded_on_login():
+    old_hash = make_hasher(PASSWORD_HASH_EXECUTOR='inline').hash_password('hunter2')
+
+    hasher = make_hasher(PASSWORD_HASH_EXECUTOR='inline', PASSWORD_HASH_METHOD='pbkdf2:sha256:2000')
+    new_hash = hasher.rehash_if_needed(old_hash, 'hunter2')
+    assert new_hash.startswith('pbkdf2:sha256:2000$')
+    assert hasher.verify_password(new_hash, 'hunter2')
+    assert hasher.rehash_if_needed(new_hash, 'hunter2') is None
+    assert hasher.get_metrics()['rehashed'] == 1
+
+
+def test_saturated_pool_sheds_requests_with_503():
+    hasher = make_hasher(PASSWORD_HASH_EXECUTOR='thread', PASSWORD_HASH_WORKERS=1, PASSWORD_HASH_QUEUE_SIZE=1)
+    release = threading.Event()
+    blocked = threading.Thread(target=hasher._run, args=(release.wait,))
+    blocked.start()
+    try:
+        while hasher.get_metrics()['in_flight'] == 0:
+            release.wait(0.01)
+        with pytest.raises(HashingPoolSaturated) as error:
+            hasher.hash_password('hunter2')
+        response = error.value.get_response()
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+        assert hasher.get_metrics()['rejected'] == 1
+        release.set()
+        blocked.join()
+        assert hasher.verify_password(hasher.hash_password('hunter2'), 'hunter2')
+    finally:
+        release.set()
+        hasher.shutdown()
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from conftest import user_row
+from db_engines import engines
+from models import User, UserPresence, db
+import presence
+from presence import PresenceTracker
+import sharding
+
+
+@pytest.fixture
+def shard_count():
+    return 2
+
+
+@pytest.fixture
+def app_config():
+    return {'PRESENCE_TTL_SECONDS': 60}
+
+
+@pytest.fixture
+def user_rows():
+    return [user_row(i) for i in range(1, 6)]
+
+
+def make_tracker(app):
+    tracker = PresenceTracker()
+    # Not bound to the app, so no flusher thread starts: the tests flush by hand
+    tracker.ttl = app.config['PRESENCE_TTL_SECONDS']
+    return tracker
+
+
+def count(table):
+    with engines.get_engine().connect() as connection:
+        return connection.execute(select(func.count()).select_from(table)).scalar()
+
+
+def test_heartbeats_are_written_in_one_batch_and_shared(app):
+    tracker, other_worker = make_tracker(app), make_tracker(app)
+    login_at = datetime.utcnow()
+    tracker.record_login(1, login_at)
+    tracker.touch(2)
+    tracker.touch(3, datetime.utcnow() - timedelta(minutes=5))
+    assert count(UserPresence.__table__) == 0
+    statuses = tracker.online_status([1, 2, 3, 4])
+    assert [statuses[user_id]['online'] for user_id in (1, 2, 3, 4)] == [True, True, False, False]
+    assert statuses[1]['last_seen'] == login_at.isoformat() and statuses[4]['last_seen'] is None
+
+    assert tracker.flush() == 4
+    assert tracker.flush() == 0
+    assert count(UserPresence.__table__) == 3
+    users = User.__table__
+    with engines.get_engine().connect() as connection:
+        assert connection.execute(select(users.c.last_login).where(users.c.id == 1)).scalar() == login_at
+        assert connection.execute(select(users.c.last_login).where(users.c.id == 2)).scalar() is None
+
+    statuses = other_worker.online_status([1, 2, 3, 5])
+    assert {user_id: status['online'] for user_id, status in statuses.items()} == {1: True, 2: True, 3: False, 5: False}
+
+
+def test_failed_flush_keeps_pending_heartbeats(app):
+    tracker = make_tracker(app)
+    tracker.touch(1)
+    UserPresence.__table__.drop(db.engine)
+    assert tracker.flush() == 0
+    assert tracker.get_metrics()["flush_errors"] == 1
+
+    UserPresence.__table__.create(db.engine)
+    assert tracker.flush() == 1
+    assert count(UserPresence.__table__) == 1
+
+
+def test_contacts_span_shards(app):
+    sharding.insert_rows('messages', [
+        {'sender_id': 1, 'receiver_id': other, 'group_id': None, 'content': 'hi', 'created_at': datetime.utcnow(),
+         'deleted': False}
+        for other in (2, 3, 4)
+    ] + [{'sender_id': 5, 'receiver_id': 1, 'group_id': None, 'content': 'hi', 'created_at': datetime.utcnow(),
+          'deleted': False},
+         # A group post has no receiver and makes nobody a contact
+         {'sender_id': 1, 'receiver_id': None, 'group_id': 7, 'content': 'hi all', 'created_at': datetime.utcnow(),
+          'deleted': False}])
+    shard_map = sharding.get_shard_map()
+    assert len({shard_map.shard_for_conversation(1, other) for other in (2, 3, 4, 5)}) == 2
+
+    tracker = make_tracker(app)
+    assert tracker.contact_ids(1) == [2, 3, 4, 5]
+    tracker.touch(4)
+    status = tracker.contacts_status(1)
+    assert [user_id for user_id, entry in status.items() if entry['online']] == [4]
+
+
+def test_pending_heartbeats_are_written_when_the_worker_exits(app, monkeypatch):
+    exit_hooks = []
+    monkeypatch.setattr(presence.atexit, 'register', lambda hook, *args: exit_hooks.append((hook, args)))
+    tracker = PresenceTracker()
+    tracker.init_app(app)
+    tracker.flush_seconds = 3600  # the periodic flush never gets to run
+    login_at = datetime.utcnow()
+    tracker.record_login(2, login_at)
+    tracker.touch(3)
+    assert len(exit_hooks) == 1 and count(UserPresence.__table__) == 0
+
+    hook, args = exit_hooks[0]
+    hook(*args)
+    assert count(UserPresence.__table__) == 2
+    users = User.__table__
+    with engines.get_engine().connect() as connection:
+        assert connection.execute(select(users.c.last_login).where(users.c.id == 2)).scalar() == login_at
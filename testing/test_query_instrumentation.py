@@ -0,0 +1,57 @@
+import logging
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+
+import query_instrumentation
+from query_instrumentation import fingerprint, get_route_query_stats, track_queries
+
+
+def test_fingerprint_ignores_parameters():
+    assert fingerprint("SELECT * FROM users WHERE id = 1") == fingerprint("select *  from users\nwhere id = 42")
+    assert fingerprint("SELECT * FROM users WHERE name = 'bob'") == "select * from users where name = ?"
+    assert fingerprint("SELECT * FROM t WHERE id IN (?, ?, ?)") == fingerprint("SELECT * FROM t WHERE id IN (?)")
+    assert fingerprint("SELECT * FROM table1") == "select * from table1"
+
+
+def test_track_queries_counts_repeats():
+    engine = create_engine('sqlite://')
+    with track_queries() as stats, engine.connect() as connection:
+        for i in range(5):
+            connection.execute(text("SELECT :i"), {'i': i})
+        connection.execute(text("SELECT 1 + 1"))
+    assert stats.count == 6
+    assert stats.max_repeats == 5
+    assert stats.repeated(4) == [(fingerprint("SELECT ?"), 5)]
+    assert stats.total_ms > 0
+
+
+def test_queries_outside_tracking_are_ignored():
+    engine = create_engine('sqlite://')
+    with engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    with track_queries() as stats:
+        pass
+    assert stats.count == 0
+
+
+def test_request_reports_n_plus_one_and_server_timing(caplog):
+    engine = create_engine('sqlite://')
+    app = Flask(__name__)
+    app.config.update(QUERY_REPEAT_THRESHOLD=3, SERVER_TIMING_HEADER=True)
+    query_instrumentation.init_app(app)
+
+    @app.route('/inbox/<int:user_id>')
+    def inbox(user_id):
+        with engine.connect() as connection:
+            for i in range(5):
+                connection.execute(text("SELECT :i"), {'i': i})
+        return 'ok'
+
+    with caplog.at_level(logging.WARNING, logger='query_instrumentation'):
+        response = app.test_client().get('/inbox/7')
+
+    assert response.headers['Server-Timing'].endswith('desc="5 queries"')
+    assert any("Possible N+1 on /inbox/<int:user_id>" in record.message for record in caplog.records)
+    route = get_route_query_stats()['/inbox/<int:user_id>']
+    assert route['requests'] == 1 and route['queries'] == 5 and route['n_plus_one'] == 1
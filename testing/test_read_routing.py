@@ -0,0 +1,93 @@
+import pytest
+from flask import g
+from sqlalchemy import event, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import OperationalError
+
+import analytics_summary
+from conftest import user_row
+from db_engines import engines
+from models import db
+from read_routing import get_read_engine, get_read_session, read_only_sqlite_uri, read_session, uses_read_engine
+
+
+@pytest.fixture
+def user_rows():
+    return [user_row(1), user_row(2)]
+
+
+def read_only_target(db_url):
+    url = make_url(read_only_sqlite_uri(db_url))
+    return url.database, dict(url.query)
+
+
+def test_read_only_sqlite_uri():
+    assert read_only_target('sqlite:///database.db') == ('file:database.db', {'mode': 'ro', 'uri': 'true'})
+    assert read_only_target('sqlite:////var/db/app.db') == ('file:/var/db/app.db', {'mode': 'ro', 'uri': 'true'})
+    assert read_only_target('sqlite:///file:app.db?mode=ro&uri=true') == ('file:app.db', {'mode': 'ro', 'uri': 'true'})
+    assert read_only_sqlite_uri('sqlite://') is None
+    assert read_only_sqlite_uri('sqlite:///:memory:') is None
+    assert read_only_sqlite_uri('postgresql://user:secret@db/app') is None
+
+
+def assert_read_only(engine):
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA query_only")).scalar() == 1
+        assert connection.execute(text("SELECT COUNT(*) FROM users")).scalar() == 2
+        with pytest.raises(OperationalError, match='readonly'):
+            connection.execute(text("UPDATE users SET role = 'admin'"))
+
+
+def test_sqlite_primary_is_reopened_read_only(app):
+    engine = get_read_engine()
+    assert engine is not engines.get_engine()
+    assert engine.url.query['mode'] == 'ro' and engine.url.database.endswith('primary.db')
+    assert_read_only(engine)
+
+
+def test_configured_read_database_is_query_only(app, tmp_path):
+    # A writable URI (e.g. a snapshot copy) is still refused writes by PRAGMA query_only
+    app.config['SQLALCHEMY_READ_DATABASE_URI'] = f"sqlite:///{tmp_path / 'primary.db'}"
+    engine = get_read_engine()
+    assert 'mode' not in engine.url.query
+    assert_read_only(engine)
+
+
+@pytest.mark.parametrize('app_config', [{'SQLALCHEMY_DATABASE_URI': 'sqlite://'}])
+def test_in_memory_primary_shares_its_engine(app):
+    assert get_read_engine() is engines.get_engine()
+    with get_read_session() as session:
+        assert session.execute(text("SELECT COUNT(*) FROM users")).scalar() == 2
+
+
+def test_read_session_routing(app):
+    assert read_session() is db.session
+
+    @uses_read_engine
+    def outer():
+        session = read_session()
+        assert session is not db.session and session.get_bind() is get_read_engine()
+        assert inner() is session
+        return session
+
+    @uses_read_engine
+    def inner():
+        return read_session()
+
+    with app.test_request_context():
+        outer()
+        assert 'read_session' not in g
+        assert read_session() is db.session
+
+
+def test_analytics_queries_go_to_the_read_engine(app):
+    statements = []
+    event.listen(get_read_engine(), 'before_cursor_execute',
+                 lambda connection, cursor, statement, *args: statements.append(statement))
+
+    with app.test_request_context():
+        assert analytics_summary.build_analytics_summary()['total_users'] == 2
+        assert statements == []
+        summary = uses_read_engine(analytics_summary.build_analytics_summary)()
+    assert summary['total_users'] == 2
+    assert any('FROM users' in statement for statement in statements)
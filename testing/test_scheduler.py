@@ -0,0 +1,141 @@
+from datetime import datetime, timedelta
+import threading
+import pytest
+from sqlalchemy import select, update
+from db_engines import engines
+from models import JobLease
+from scheduler import CronSchedule, IntervalSchedule, Scheduler, acquire_lease, record_run
+
+def test_interval_schedule():
+    """Interval jobs run a fixed time after the previous run."""
+    schedule = IntervalSchedule(90)
+    assert schedule.next_after(datetime(2024, 1, 1, 12, 0)) == datetime(2024, 1, 1, 12, 1, 30)
+
+def test_cron_every_fifteen_minutes():
+    """Step values pick every nth minute."""
+    schedule = CronSchedule('*/15 * * * *')
+    assert schedule.next_after(datetime(2024, 1, 1, 12, 7, 30)) == datetime(2024, 1, 1, 12, 15)
+    assert schedule.next_after(datetime(2024, 1, 1, 12, 45)) == datetime(2024, 1, 1, 13, 0)
+
+def test_cron_daily_at_fixed_time_rolls_over_month_and_year():
+    """A daily 03:30 job scheduled after 03:30 on Dec 31 runs on Jan 1."""
+    schedule = CronSchedule('30 3 * * *')
+    assert schedule.next_after(datetime(2024, 12, 31, 4, 0)) == datetime(2025, 1, 1, 3, 30)
+
+def test_cron_weekday_uses_sunday_as_zero():
+    """Day-of-week 0 and 7 both mean Sunday."""
+    # 2024-01-01 was a Monday
+    assert CronSchedule('0 0 * * 0').next_after(datetime(2024, 1, 1)) == datetime(2024, 1, 7)
+    assert CronSchedule('0 0 * * 7').next_after(datetime(2024, 1, 1)) == datetime(2024, 1, 7)
+
+def test_cron_day_of_month_or_weekday():
+    """When both day fields are restricted, either one matching is enough."""
+    schedule = CronSchedule('0 0 15 * 1')
+    assert schedule.next_after(datetime(2024, 1, 2)) == datetime(2024, 1, 8)
+    assert schedule.next_after(datetime(2024, 1, 12)) == datetime(2024, 1, 15)
+
+def test_cron_leap_day():
+    """Feb 29 schedules find the next leap year."""
+    assert CronSchedule('0 0 29 2 *').next_after(datetime(2024, 3, 1)) == datetime(2028, 2, 29)
+
+@pytest.mark.parametrize("expression", ['* * * *', '60 * * * *', '* * * 13 *', '*/0 * * * *'])
+def test_cron_rejects_invalid_expressions(expression):
+    """Malformed or out-of-range fields are rejected."""
+    with pytest.raises(ValueError):
+        CronSchedule(expression)
+
+def test_job_registration_requires_one_schedule():
+    """A job needs exactly one of interval or cron, and a unique name."""
+    scheduler = Scheduler()
+    with pytest.raises(ValueError):
+        scheduler.job('bad')
+    scheduler.job('nightly', cron='0 2 * * *')(lambda: None)
+    with pytest.raises(ValueError):
+        scheduler.job('nightly', interval=60)(lambda: None)
+
+def lease(name):
+    with engines.get_engine().connect() as connection:
+        return connection.execute(select(JobLease.__table__).where(JobLease.__table__.c.name == name)).one()
+
+def expire_lease(name):
+    table = JobLease.__table__
+    with engines.get_engine().begin() as connection:
+        connection.execute(update(table).where(table.c.name == name)
+                           .values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+
+@pytest.fixture
+def worker(app):
+    """A scheduler on this app, as one of several workers."""
+    scheduler = Scheduler()
+    scheduler.app = app
+    return scheduler
+
+def test_live_lease_refuses_other_owners(app):
+    """Only the holder of a live lease (re)acquires it."""
+    assert acquire_lease('sweep', 'worker-a', 60)
+    assert not acquire_lease('sweep', 'worker-b', 60)
+    assert acquire_lease('sweep', 'worker-a', 60)
+    assert lease('sweep').owner == 'worker-a'
+
+def test_expired_lease_is_taken_over(app):
+    """A lease its holder never released can be taken once it expires."""
+    assert acquire_lease('sweep', 'worker-a', 60)
+    expire_lease('sweep')
+    assert acquire_lease('sweep', 'worker-b', 60)
+    assert not acquire_lease('sweep', 'worker-a', 60)
+    assert lease('sweep').owner == 'worker-b'
+
+def test_record_run_stores_status_and_releases(app):
+    """Recording a run stores its metrics; only the holder's record counts."""
+    started_at = datetime.utcnow()
+    acquire_lease('sweep', 'worker-a', 60)
+    record_run('sweep', 'worker-b', started_at, 5, 'ok')
+    assert lease('sweep').run_count == 0
+    record_run('sweep', 'worker-a', started_at, 12, 'failed', 'boom')
+    row = lease('sweep')
+    assert (row.run_count, row.last_status, row.last_error, row.last_duration_ms) == (1, 'failed', 'boom', 12)
+    assert acquire_lease('sweep', 'worker-b', 60)
+
+def test_each_run_happens_on_one_worker(app, worker):
+    """A job runs on whichever worker takes the lease; the others skip it."""
+    runs = []
+    worker.job('count', interval=60, timeout=5)(lambda: runs.append(1))
+    other = Scheduler()
+    other.app = app
+    other.job('count', interval=60, timeout=5)(lambda: runs.append(2))
+
+    acquire_lease('count', other.owner, 60)
+    assert worker.run_job('count') == 'skipped' and runs == []
+    assert worker.run_job('count', force=True) == 'ok' and runs == [1]
+    assert lease('count').run_count == 0
+
+    expire_lease('count')
+    assert worker.run_job('count') == 'ok' and runs == [1, 1]
+    assert (lease('count').owner, lease('count').run_count, lease('count').last_status) == (worker.owner, 1, 'ok')
+    # The lease was released, so the other worker runs the next one
+    assert other.run_job('count') == 'ok' and runs == [1, 1, 2]
+
+def test_failed_run_is_recorded(app, worker):
+    """A job that raises is recorded as failed with its error."""
+    def fail():
+        raise RuntimeError('boom')
+    worker.job('fail', interval=60, timeout=5)(fail)
+    assert worker.run_job('fail') == 'failed'
+    assert (lease('fail').last_status, lease('fail').last_error) == ('failed', 'boom')
+    assert worker.jobs['fail'].stats['failures'] == 1
+
+def test_timed_out_run_keeps_its_lease_and_is_skipped(app, worker):
+    """A run past its timeout is recorded, keeps the lease and is not started again while it runs."""
+    release = threading.Event()
+    worker.job('slow', interval=60, timeout=0.05)(lambda: release.wait(5))
+    try:
+        assert worker.run_job('slow') == 'timeout'
+        row = lease('slow')
+        assert (row.last_status, row.run_count) == ('timeout', 1) and row.expires_at > datetime.utcnow()
+        assert not acquire_lease('slow', 'worker-b', 60)
+        assert worker.run_job('slow') == 'skipped'
+        stats = worker.jobs['slow'].stats
+        assert (stats['timeouts'], stats['skipped']) == (1, 1)
+    finally:
+        release.set()
+        worker.jobs['slow'].worker.join()
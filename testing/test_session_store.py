@@ -0,0 +1,145 @@
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask, session
+from sqlalchemy import func, select, update
+
+from db_engines import engines
+from models import ServerSession, db
+from query_instrumentation import track_queries
+import session_store
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{tmp_path / 'sessions.db'}"
+    engines.init_app(app, db)
+    session_store.init_app(app)
+
+    @app.route('/login/<int:user_id>')
+    def login(user_id):
+        session['user_id'] = user_id
+        return 'ok'
+
+    @app.route('/theme/<name>')
+    def theme(name):
+        session['theme'] = name
+        return 'ok'
+
+    @app.route('/whoami')
+    def whoami():
+        return str(session.get('user_id'))
+
+    @app.route('/revoke-during-request/<int:user_id>')
+    def revoke_during_request(user_id):
+        # A request still running when the user is signed out elsewhere, which then changes the session
+        session_store.revoke_user_sessions(user_id)
+        session['seen'] = True
+        return 'ok'
+
+    @app.route('/logout')
+    def logout():
+        session.clear()
+        return 'ok'
+
+    with app.app_context():
+        ServerSession.__table__.create(engines.get_engine())
+    return app
+
+
+def count_sessions(app):
+    with app.app_context(), engines.get_engine().connect() as connection:
+        return connection.execute(select(func.count()).select_from(ServerSession.__table__)).scalar()
+
+
+def test_sessions_are_read_with_one_query_and_written_only_on_change(app):
+    client = app.test_client()
+    with track_queries() as stats:
+        assert client.get('/whoami').text == 'None'
+    assert stats.count == 0 and count_sessions(app) == 0
+
+    client.get('/login/5')
+    assert count_sessions(app) == 1
+
+    with track_queries() as stats:
+        assert client.get('/whoami').text == '5'
+    assert stats.count == 1
+
+    client.get('/logout')
+    assert count_sessions(app) == 0
+    assert client.get('/whoami').text == 'None'
+
+
+def test_stale_expiry_is_refreshed(app):
+    client = app.test_client()
+    client.get('/login/5')
+    table = ServerSession.__table__
+    soon = datetime.utcnow() + timedelta(days=1)
+    with app.app_context(), engines.get_engine().begin() as connection:
+        connection.execute(update(table).values(expires_at=soon))
+
+    with track_queries() as stats:
+        client.get('/whoami')
+    assert stats.count > 1
+    with app.app_context(), engines.get_engine().connect() as connection:
+        assert connection.execute(select(table.c.expires_at)).scalar() > soon + timedelta(days=5)
+
+
+def test_revoke_and_sweep(app):
+    clients = [app.test_client() for _ in range(3)]
+    for client, user_id in zip(clients, [5, 5, 6]):
+        client.get(f'/login/{user_id}')
+
+    with app.app_context():
+        assert session_store.revoke_user_sessions(5) == 2
+    assert clients[0].get('/whoami').text == 'None'
+    assert clients[2].get('/whoami').text == '6'
+
+    table = ServerSession.__table__
+    with app.app_context():
+        with engines.get_engine().begin() as connection:
+            connection.execute(update(table).values(expires_at=datetime.utcnow() - timedelta(seconds=1)))
+        assert session_store.sweep_expired_sessions(batch_size=1) == 1
+    assert count_sessions(app) == 0
+
+
+def test_revoked_session_is_not_recreated_by_an_in_flight_request(app):
+    client = app.test_client()
+    client.get('/login/5')
+    response = client.get('/revoke-during-request/5')
+    assert 'session=;' in response.headers['Set-Cookie']
+    assert count_sessions(app) == 0
+    assert client.get('/whoami').text == 'None'
+
+    # The same holds for a request that only refreshes a stale expiry
+    with app.app_context():
+        revoked = session_store.StoredSession({'user_id': 5}, sid='revoked', expires_at=datetime.utcnow())
+        assert session_store._write_session(revoked, datetime.utcnow() + timedelta(days=31)) is False
+    assert count_sessions(app) == 0
+
+
+def test_changing_user_moves_the_session_to_a_new_id(app):
+    client = app.test_client()
+    client.get('/theme/dark')  # anonymous, but the session holds data so it is stored
+    planted = client.get_cookie('session').value
+    assert count_sessions(app) == 1
+
+    client.get('/login/5')
+    signed_in = client.get_cookie('session').value
+    assert signed_in != planted and count_sessions(app) == 1
+    # Someone holding the pre-login id gets nothing
+    other = app.test_client()
+    other.set_cookie('session', planted)
+    assert other.get('/whoami').text == 'None'
+    assert client.get('/whoami').text == '5'
+    with app.app_context(), engines.get_engine().connect() as connection:
+        data = connection.execute(select(ServerSession.__table__.c.data)).scalar()
+    assert b'"theme":"dark"' in data.replace(b' ', b'')
+
+    # Other changes keep the id; switching accounts does not
+    client.get('/theme/light')
+    assert client.get_cookie('session').value == signed_in
+    client.get('/login/6')
+    assert client.get_cookie('session').value not in (planted, signed_in)
+    assert count_sessions(app) == 1
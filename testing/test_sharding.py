@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import select, text
+
+from conftest import make_app
+from models import FlaggedContent, MessageArchivePartition, db
+import sharding
+from sharding import ID_STRIDE, ShardMap, conversation_key, jump_hash
+from unit_of_work import note_write, unit_of_work
+
+
+def test_jump_hash_is_stable_and_moves_few_keys():
+    keys = range(0, 10_000 * 7919, 7919)
+    before = [jump_hash(key, 4) for key in keys]
+    assert before == [jump_hash(key, 4) for key in keys]
+    assert set(before) == {0, 1, 2, 3}
+    after = [jump_hash(key, 5) for key in keys]
+    moved = sum(a != b for a, b in zip(before, after))
+    # Only keys moving to the new bucket change: about 1/5 of them
+    assert 0.15 < moved / len(before) < 0.25
+    assert all(b == 4 for a, b in zip(before, after) if a != b)
+
+
+def test_shard_map_routing():
+    shard_map = ShardMap(['primary', 'sqlite:///a.db', 'sqlite:///b.db'])
+    assert conversation_key(3, 9) == conversation_key(9, 3)
+    assert shard_map.shard_for_conversation(3, 9) == shard_map.shard_for_conversation(9, 3)
+    assert shard_map.shard_for_id(ID_STRIDE * 5 + 2) == 2
+    assert shard_map.shard_for_id(ID_STRIDE * 5 + 7) is None
+    assert ShardMap().shard_for_id(12345) == 0
+
+
+def notification(user_id, minutes_ago=0):
+    return {'user_id': user_id, 'type': 'info', 'message': f'hello {user_id}', 'is_read': False,
+            'created_at': datetime(2026, 1, 1) - timedelta(minutes=minutes_ago)}
+
+
+def message(sender_id, receiver_id):
+    return {'sender_id': sender_id, 'receiver_id': receiver_id, 'content': 'hi',
+            'created_at': datetime(2026, 1, 1), 'deleted': False}
+
+
+@pytest.fixture
+def shard_count():
+    return 3
+
+
+def test_rows_are_written_to_their_shard(app):
+    shard_map = sharding.get_shard_map()
+    sharding.insert_rows('notifications', [notification(user_id) for user_id in range(60)])
+
+    for user_id in range(60):
+        index = shard_map.shard_for_user(user_id)
+        rows = sharding.execute_on_shard(index, text("SELECT id FROM notifications WHERE user_id = :u"), {'u': user_id})
+        assert len(rows) == 1 and rows[0].id % ID_STRIDE == index
+    per_shard = [sharding.execute_on_shard(i, text("SELECT COUNT(*) FROM notifications"))[0][0] for i in range(3)]
+    assert all(per_shard) and sum(per_shard) == 60
+    assert sharding.count_rows('notifications') == 60
+
+
+def test_lookup_update_and_delete_by_id(app):
+    message_id = sharding.insert_row('messages', message(4, 11))
+    assert sharding.get_rows_by_id('messages', [message_id])[message_id].receiver_id == 11
+    assert sharding.update_row_by_id('messages', message_id, {'deleted': True})
+    assert sharding.get_rows_by_id('messages', [message_id])[message_id].deleted
+    assert sharding.delete_row_by_id('messages', message_id)
+    assert sharding.get_rows_by_id('messages', [message_id]) == {}
+
+
+def test_scatter_top_merges_shards(app):
+    sharding.insert_rows('notifications', [notification(user_id, minutes_ago=user_id) for user_id in range(30)])
+    table = db.metadata.tables['notifications']
+    query = select(table).order_by(table.c.created_at.desc()).limit(5)
+    newest = sharding.scatter_top(query, 5, key=lambda row: row.created_at)
+    assert [row.user_id for row in newest] == [0, 1, 2, 3, 4]
+
+
+def test_shard_writes_commit_and_roll_back_with_the_unit_of_work(app):
+    shard_map = sharding.get_shard_map()
+    user_id = next(user_id for user_id in range(100) if shard_map.shard_for_user(user_id) != 0)
+    index = shard_map.shard_for_user(user_id)
+    flags = FlaggedContent.__table__
+
+    def flag_and_notify(reason):
+        db.session.execute(flags.insert().values(message_id=1, user_id=user_id, reason=reason))
+        note_write()
+        notification_id = sharding.insert_row('notifications', notification(user_id))
+        # The request reads its own uncommitted shard write
+        assert notification_id in sharding.get_rows_by_id('notifications', [notification_id])
+        return notification_id
+
+    with pytest.raises(RuntimeError):
+        with app.test_request_context(), unit_of_work():
+            flag_and_notify('rolled back')
+            raise RuntimeError
+    assert sharding.count_rows('notifications') == 0
+
+    with sharding.shard_engine(index).connect() as other, app.test_request_context(), unit_of_work():
+        notification_id = flag_and_notify('kept')
+        # Nothing is visible to other connections until the unit commits
+        assert other.execute(text("SELECT COUNT(*) FROM notifications")).scalar() == 0
+        other.rollback()
+    assert list(sharding.get_rows_by_id('notifications', [notification_id])) == [notification_id]
+    assert db.session.scalars(select(flags.c.reason)).all() == ['kept']
+
+
+def test_rebalance_moves_rows_written_before_sharding(tmp_path):
+    flags = db.metadata.tables['flagged_content']
+    cursors = db.metadata.tables['group_read_cursors']
+    messages_table = db.metadata.tables['messages']
+    single = make_app(tmp_path)
+    with single.app_context():
+        db.metadata.create_all(db.engine)
+        ids = [sharding.insert_row('messages', message(sender, sender + 1)) for sender in range(40)]
+        group_ids = {
+            group_id: [sharding.insert_row('messages', {**message(7, None), 'group_id': group_id,
+                                                        'content': f'g{group_id} m{i}'}) for i in range(5)]
+            for group_id in range(1, 5)
+        }
+        with db.engine.begin() as connection:
+            connection.execute(flags.insert(), [
+                {'message_id': message_id, 'user_id': 1, 'reason': f'flag {message_id}'} for message_id in ids
+            ])
+            # User 1 has read each group up to its third message
+            connection.execute(cursors.insert(), [
+                {'user_id': 1, 'group_id': group_id, 'last_read_message_id': message_ids[2], 'unread_count': 2,
+                 'counted_through_id': message_ids[-1]}
+                for group_id, message_ids in group_ids.items()
+            ])
+            connection.execute(MessageArchivePartition.__table__.insert(), {
+                'month': '2020-01', 'path': 'archive.db', 'row_count': 1, 'min_message_id': 900,
+                'max_message_id': 1000, 'conversations_indexed': True,
+            })
+
+    app = make_app(tmp_path, shard_count=3)
+    with app.app_context():
+        assert sharding.rebalance(batch_size=7, dry_run=True)['messages'] > 0
+        moved = sharding.rebalance(batch_size=7)
+        assert moved['messages'] == 60
+        assert sharding.rebalance()['messages'] == 0
+        assert sharding.count_rows('messages') == 60
+        # New ids never reuse an archived message's id
+        assert min(row.id for row in sharding.scatter(select(messages_table.c.id))) > 1000
+
+        # Read cursors follow their groups' messages, and stored counts are recounted on read
+        with db.engine.connect() as connection:
+            cursor_rows = connection.execute(select(cursors)).fetchall()
+        assert len(cursor_rows) == 4
+        for cursor in cursor_rows:
+            assert cursor.unread_count is None and cursor.counted_through_id is None
+            index = sharding.get_shard_map().shard_for_group(cursor.group_id)
+            group_rows = sharding.execute_on_shard(index, select(messages_table).where(
+                messages_table.c.group_id == cursor.group_id).order_by(messages_table.c.id))
+            assert [row.content for row in group_rows] == [f'g{cursor.group_id} m{i}' for i in range(5)]
+            unread = [row.content for row in group_rows if row.id > cursor.last_read_message_id]
+            assert unread == [f'g{cursor.group_id} m3', f'g{cursor.group_id} m4']
+
+        # Every flag still points at the message it was raised on
+        with db.engine.connect() as connection:
+            flag_rows = connection.execute(select(flags.c.message_id, flags.c.reason)).fetchall()
+        messages = sharding.get_rows_by_id('messages', [row.message_id for row in flag_rows])
+        assert len(messages) == 40
+        for row in flag_rows:
+            sender = ids.index(int(row.reason.split()[1]))
+            assert messages[row.message_id].sender_id == sender
@@ -0,0 +1,84 @@
+from collections import Counter
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, inspect, select
+
+from conftest import make_app
+from models import FlaggedContent, GroupMembership, Message, User, db
+import sharding
+import synthetic_data
+
+END = datetime(2026, 1, 1)
+
+
+def generate(app, **counts):
+    with app.app_context():
+        db.metadata.create_all(db.engine)
+        return synthetic_data.generate_dataset(end=END, batch_size=500, **counts)
+
+
+def rows(engine, table, exclude=()):
+    columns = [column for column in table.c if column.name not in exclude]
+    with engine.connect() as connection:
+        return connection.execute(select(*columns).order_by(*columns)).fetchall()
+
+
+def test_same_seed_generates_same_rows(tmp_path):
+    counts = dict(users=50, messages=2000, groups=5, flags=20, notifications=100, activity_logs=100, seed=7)
+    (tmp_path / 'a').mkdir()
+    (tmp_path / 'b').mkdir()
+    first, second = make_app(tmp_path / 'a'), make_app(tmp_path / 'b')
+    assert generate(first, **counts) == generate(second, **counts)
+
+    # Everything matches but the password hashes, which are salted
+    exclude = ('password_hash', 'security_answer_hash')
+    with first.app_context():
+        first_rows = {table.name: rows(db.engine, table, exclude) for table in db.metadata.sorted_tables}
+    with second.app_context():
+        second_rows = {table.name: rows(db.engine, table, exclude) for table in db.metadata.sorted_tables}
+    assert first_rows == second_rows
+    assert len(first_rows['messages']) == 2000
+
+
+def test_activity_is_skewed_and_flags_point_at_messages(app):
+    counts = generate(app, users=200, messages=5000, groups=20, flags=200, notifications=0, activity_logs=0)
+    assert counts['messages'] == 5000 and counts['group_memberships'] >= 20
+
+    with app.app_context():
+        messages = rows(db.engine, Message.__table__)
+        senders = Counter(row.sender_id for row in messages)
+        assert senders.most_common(1)[0][1] > 10 * sorted(senders.values())[len(senders) // 2]
+        assert all(row.sender_id != row.receiver_id for row in messages)
+
+        message_ids = {row.id for row in messages}
+        assert all(row.message_id in message_ids for row in rows(db.engine, FlaggedContent.__table__))
+        creators = {(row.id, row.created_by) for row in rows(db.engine, db.metadata.tables['groups'])}
+        members = {(row.group_id, row.user_id) for row in rows(db.engine, GroupMembership.__table__)}
+        assert creators <= members
+
+        admins = [row for row in rows(db.engine, User.__table__) if row.role == 'admin']
+        assert admins and admins[0].id == 1
+
+
+@pytest.mark.parametrize('shard_count', [3])
+def test_rows_land_on_their_shards_and_indexes_are_restored(app):
+    generate(app, users=100, messages=3000, groups=0, flags=50, notifications=500, activity_logs=0)
+
+    with app.app_context():
+        shard_map = sharding.get_shard_map()
+        total = 0
+        for index in range(shard_map.num_shards):
+            engine = sharding.shard_engine(index)
+            for table_name in ('messages', 'notifications'):
+                shard_rows = rows(engine, db.metadata.tables[table_name])
+                assert all(shard_map.is_placed(table_name, row._mapping, index) for row in shard_rows)
+                total += len(shard_rows) if table_name == 'messages' else 0
+            indexes = {index['name'] for index in inspect(engine).get_indexes('messages')}
+            assert {index.name for index in Message.__table__.indexes} <= indexes
+        assert total == 3000
+
+        flagged = [row.message_id for row in rows(db.engine, FlaggedContent.__table__)]
+        assert len(sharding.get_rows_by_id('messages', flagged)) == len(set(flagged))
+        with db.engine.connect() as connection:
+            assert connection.execute(select(func.count()).select_from(User.__table__)).scalar() == 100
@@ -0,0 +1,102 @@
+import pytest
+from sqlalchemy import Column, Integer, String, event, func, select
+from sqlalchemy.orm import DeclarativeBase
+
+from models import db
+from unit_of_work import after_commit, commit_or_flush, current_unit_of_work, transactional, unit_of_work
+
+
+class Base(DeclarativeBase):
+    pass
+
+
+class Note(Base):
+    __tablename__ = 'uow_notes'
+    id = Column(Integer, primary_key=True)
+    text = Column(String(50))
+
+
+@pytest.fixture
+def app(app):
+    Base.metadata.create_all(db.engine)
+    commits = []
+    event.listen(db.engine, 'commit', lambda conn: commits.append(1))
+    app.commits = commits
+    return app
+
+
+def count_notes():
+    return db.session.scalar(select(func.count()).select_from(Note))
+
+
+def add_note(text):
+    db.session.add(Note(text=text))
+    commit_or_flush()
+
+
+def test_one_commit_per_unit_of_work(app):
+    ran = []
+    with unit_of_work():
+        for i in range(5):
+            add_note(f"note {i}")
+            after_commit(ran.append, i)
+        assert ran == []
+    assert app.commits == [1]
+    assert ran == [0, 1, 2, 3, 4]
+    assert count_notes() == 5
+
+
+def test_commit_or_flush_commits_outside_unit_of_work(app):
+    add_note("a")
+    add_note("b")
+    assert len(app.commits) == 2
+    after_commit(app.commits.append, 'now')
+    assert app.commits[-1] == 'now'
+
+
+def test_error_rolls_back_everything_and_drops_hooks(app):
+    ran = []
+    with pytest.raises(ValueError):
+        with unit_of_work():
+            add_note("lost")
+            after_commit(ran.append, 1)
+            raise ValueError("boom")
+    assert ran == []
+    assert count_notes() == 0
+    assert current_unit_of_work() is None
+
+
+def test_nested_units_join_and_views_commit_once(app):
+    @transactional
+    def view():
+        add_note("outer")
+        with unit_of_work() as inner:
+            assert inner is current_unit_of_work()
+            add_note("inner")
+        assert app.commits == []
+        return 'ok'
+
+    assert view() == 'ok'
+    assert app.commits == [1]
+    assert count_notes() == 2
+
+
+def test_lock_errors_are_not_retried_once_the_unit_has_written(app):
+    import sqlite3
+    from sqlalchemy.exc import OperationalError
+    from db_retry import retry_on_lock
+
+    attempts = []
+
+    @retry_on_lock
+    def locked_write():
+        attempts.append(1)
+        raise OperationalError("INSERT", {}, sqlite3.OperationalError("database is locked"))
+
+    with pytest.raises(OperationalError):
+        with unit_of_work() as uow:
+            add_note("first")
+            assert uow.has_writes
+            locked_write()
+    assert attempts == [1]
+    assert count_notes() == 0
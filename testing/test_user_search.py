@@ -0,0 +1,74 @@
+import time
+
+import pytest
+from sqlalchemy import update
+
+from conftest import user_row
+from db_engines import engines
+from models import User
+from user_search import UserSearchIndex
+
+
+@pytest.fixture
+def app_config():
+    return {'USER_SEARCH_SYNC_SECONDS': 0}
+
+
+@pytest.fixture
+def user_rows():
+    return [
+        user_row(1, username='annie', first_name='Ann', last_name='Lee'),
+        user_row(2, username='Ann', first_name='Zed', last_name='Smith'),
+        user_row(3, username='bob', first_name='Anna', last_name='Brown'),
+        user_row(4, username='anvil', first_name='Carl', last_name='Anders'),
+        user_row(5, username='annoying', first_name='Spam', last_name='Bot', is_banned=True),
+    ]
+
+
+def test_prefix_matches_rank_usernames_before_names(app):
+    index = UserSearchIndex()
+    assert [user['id'] for user in index.search('ANN')] == [2, 1, 3]
+    assert [user['id'] for user in index.search('an', limit=3)] == [2, 1, 4]
+    assert index.search('ann lee') == [{'id': 1, 'username': 'annie', 'full_name': 'Ann Lee'}]
+    assert index.search('anders')[0]['id'] == 4
+    assert index.search('zzz') == [] and index.search('  ') == []
+
+
+def test_index_follows_registrations_and_bans(app):
+    index = UserSearchIndex()
+    assert 5 not in [user['id'] for user in index.search('ann')]
+
+    # Registered by another worker: picked up by the incremental sync
+    with engines.get_engine().begin() as connection:
+        connection.execute(User.__table__.insert(),
+                           [user_row(6, username='annabel', first_name='Bel', last_name='Jones')])
+    assert [user['id'] for user in index.search('annab')] == [6]
+
+    index.remove_user(6)
+    index.add_user(1, 'annie', 'Ann', 'Lee-Park')
+    assert index.search('annab') == []
+    assert index.search('ann lee-p')[0]['full_name'] == 'Ann Lee-Park'
+    assert sum(1 for _, user_id in index._names if user_id == 1) == 3
+
+    # A full rebuild drops users banned elsewhere
+    with engines.get_engine().begin() as connection:
+        connection.execute(update(User.__table__).where(User.__table__.c.id == 2).values(is_banned=True))
+    index.rebuild()
+    assert [user['id'] for user in index.search('ann')] == [6, 1, 3]
+
+
+def test_lookups_do_not_scale_with_user_count(app):
+    app.config['USER_SEARCH_SYNC_SECONDS'] = 60
+    with engines.get_engine().begin() as connection:
+        connection.execute(User.__table__.insert(), [
+            user_row(user_id, first_name=f'First{user_id % 997}', last_name=f'Last{user_id}')
+            for user_id in range(100, 20100)
+        ])
+    index = UserSearchIndex()
+    index.rebuild()
+
+    start = time.perf_counter()
+    for _ in range(1000):
+        results = index.search('user4', limit=10)
+    assert len(results) == 10
+    assert (time.perf_counter() - start) / 1000 < 0.001